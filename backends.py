@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Backends that run the AppleScript produced by gen.py
+
+Every backend has a run(script_str, step=None) method returning a
+(stdout, stderr) pair of strings, in the form osascript produces, and
+a close() method. `step` names the logical generation step the script
+belongs to (for example "apply_master") and may be None.
+"""
+
+import re
+import subprocess
+import time
+from typing import NamedTuple
+
+from osa_worker import AppleScriptWorker
+
+
+class OsascriptBackend:
+    """Run each script with a new osascript process"""
+
+    def run(self, script_str, step=None):
+        osa = subprocess.Popen(['osascript', '-'],
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+        result = osa.communicate(script_str.encode('utf-8'))
+        stdout, stderr = [stream.decode('utf-8') for stream in result]
+        return stdout, stderr
+
+    def close(self):
+        pass
+
+
+class WorkerBackend:
+    """Run every script in one persistent osa_worker process
+
+    `command` is passed to AppleScriptWorker, and can be used to start
+    a stand-in worker that speaks the same protocol.
+    """
+
+    def __init__(self, command=None):
+        self.worker = AppleScriptWorker(command)
+        self.worker.start()
+
+    def run(self, script_str, step=None):
+        result = self.worker.run(script_str)
+        stdout, stderr = [stream.decode('utf-8') for stream in result]
+        return stdout, stderr
+
+    def close(self):
+        self.worker.stop()
+
+
+class ScriptCall(NamedTuple):
+    """A script run by a RecordingBackend, with its result and timing"""
+    step: str
+    script: str
+    stdout: str
+    stderr: str
+    seconds: float
+
+
+class RecordingBackend:
+    """Pass scripts on to another backend, recording each call
+
+    The recorded ScriptCall tuples are kept in the `calls` list.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = []
+
+    def run(self, script_str, step=None):
+        start = time.perf_counter()
+        stdout, stderr = self.backend.run(script_str, step=step)
+        seconds = time.perf_counter() - start
+        self.calls.append(
+            ScriptCall(step, script_str, stdout, stderr, seconds))
+        return stdout, stderr
+
+    def close(self):
+        self.backend.close()
+
+
+class FakeBackend:
+    """Return canned answers to scripts without running them
+
+    `responses` is a sequence of (pattern, stdout, stderr) tuples. The
+    first pattern found in a script (using re.search) decides the
+    answer. Scripts matching no pattern return empty output.
+
+    `latency` is a number of seconds to sleep for each call, to mimic
+    the cost of a real AppleScript round trip.
+    """
+
+    def __init__(self, responses=(), latency=0.0):
+        self.responses = [(re.compile(pattern), stdout, stderr)
+                          for pattern, stdout, stderr in responses]
+        self.latency = latency
+        self.call_count = 0
+
+    def run(self, script_str, step=None):
+        self.call_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        for pattern, stdout, stderr in self.responses:
+            if pattern.search(script_str):
+                return stdout, stderr
+        return '', ''
+
+    def close(self):
+        pass
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Page Generator Benchmark
+
+Usage:
+    bench_gen.py [--latency=SECONDS] [--desk=DESK...]
+                 [--baseline=FILE] [--tolerance=FRACTION]
+                 [--update-baseline]
+
+Options:
+    --latency=SECONDS     Delay added to every AppleScript call, to mimic
+                          starting osascript and waiting for InDesign.
+                          [default: 0.02]
+    --desk=DESK           Desk to benchmark. Can be repeated.
+                          The default is every desk in pages.json.
+    --baseline=FILE       JSON file of baseline metrics.
+                          [default: bench_baseline.json]
+    --tolerance=FRACTION  Allowed fractional increase in timings over the
+                          baseline before it counts as a regression.
+                          Counts of calls and bytes must not increase.
+                          [default: 0.5]
+    --update-baseline     Store the measured metrics as the new baseline.
+
+Generates every page of each desk against the InDesign emulator, first
+page by page with create_from_master, then as whole editions with
+generate_edition, then as editions with the master opened only once,
+then by running gen.py's main for each desk, and prints the metrics as
+JSON.
+
+Script sizes are measured with the path of the temporary workspace
+replaced by a placeholder, so that they do not depend on where the
+temporary directory is.
+
+Exits with an error if any metric regressed past the stored baseline.
+"""
+
+from datetime import datetime
+import json
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+from docopt import docopt
+
+from backends import RecordingBackend
+from emulator import InDesignEmulator
+import gen
+
+APP_DIR = Path(__file__).parent
+
+# Benchmarks always use the same date so that script sizes are stable
+EDITION_DATE = datetime(2018, 1, 23)
+
+# Timings below this many seconds are too small to compare reliably
+MIN_SECONDS_ALLOWANCE = 0.01
+
+# Stands in for the workspace path when measuring script sizes
+WORKSPACE_PLACEHOLDER = '/workspace'
+
+
+def time_page_specifications(repeat=100):
+    """Return the mean seconds taken by construct_page_specifications"""
+    masters = gen.load_masters_json()
+    pages = gen.load_generators_json()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        gen.construct_page_specifications(pages, masters)
+    return (time.perf_counter() - start) / repeat
+
+
+def script_size(script, workspace):
+    """Return the bytes of script with workspace replaced by a placeholder
+
+    Both the workspace path and its resolved form (which differ where
+    the temporary directory is behind a symlink, as on macOS) are
+    replaced.
+    """
+    for path in sorted({str(workspace.resolve()), str(workspace)},
+                       key=len, reverse=True):
+        script = script.replace(path, WORKSPACE_PLACEHOLDER)
+    return len(script.encode('utf-8'))
+
+
+def measure(generate, latency, workspace):
+    """Run generate(), returning (calls, script bytes, seconds, failures)
+
+    generate is called with the recording backend in use, and returns
+    the number of failed pages. Script bytes are counted with the
+    workspace path replaced (see script_size).
+    """
+    backend = RecordingBackend(InDesignEmulator(latency=latency))
+    with gen.use_backend(backend):
+        start = time.perf_counter()
+        failures = generate()
+        seconds = time.perf_counter() - start
+    script_bytes = sum(script_size(call.script, workspace)
+                       for call in backend.calls)
+    return len(backend.calls), script_bytes, seconds, failures
+
+
+def run_benchmarks(desks, latency, workspace):
+    """Benchmark page and edition generation, returning a metrics dict"""
+    pages = gen.construct_page_specifications(
+        gen.load_generators_json(), gen.load_masters_json())
+    master_file = workspace.joinpath('Master.indd')
+    master_file.write_text('Benchmark master document\n', encoding='utf-8')
+    jobs = {desk: gen.make_page_jobs(pages, desk, pages[desk], EDITION_DATE,
+                                     master_file, workspace)
+            for desk in desks}
+    page_count = sum(map(len, jobs.values())) or 1
+
+    def generate_pages():
+        for desk_jobs in jobs.values():
+            for job in desk_jobs:
+                gen.create_from_master(**job)
+        return 0
+
+    def generate_editions():
+        return sum(not result.ok
+                   for desk_jobs in jobs.values()
+                   for result in gen.generate_edition(desk_jobs))
+
+    def generate_editions_master_once():
+        with gen.master_document_open(master_file):
+            return sum(not result.ok
+                       for desk_jobs in jobs.values()
+                       for result in gen.generate_edition(
+                           desk_jobs, master_open=True))
+
+    def run_main():
+        """Run gen.py for each desk, counting the pages of failed runs"""
+        failures = 0
+        for desk, desk_jobs in jobs.items():
+            if not desk_jobs:
+                continue
+            argv = [f'--master={master_file}',
+                    f'--pages_dir={workspace / "main"}', f'--desk={desk}',
+                    f'--date={EDITION_DATE:%Y-%m-%d}', '--force']
+            argv += [f'--set={name}' for name in pages[desk]]
+            try:
+                gen.main(argv, backend=gen.get_backend())
+            except SystemExit as exc:
+                if exc.code:
+                    failures += len(desk_jobs)
+        return failures
+
+    metrics = {}
+    for mode, generate in [('per_page', generate_pages),
+                           ('edition', generate_editions),
+                           ('master_once', generate_editions_master_once),
+                           ('main', run_main)]:
+        calls, script_bytes, seconds, failures = measure(generate, latency,
+                                                         workspace)
+        metrics[f'{mode}.backend_calls_per_page'] = calls / page_count
+        metrics[f'{mode}.script_bytes_per_page'] = script_bytes / page_count
+        metrics[f'{mode}.seconds_per_page'] = seconds / page_count
+        metrics[f'{mode}.failed_pages'] = failures
+    metrics['edition.seconds_per_edition'] = (
+        metrics['edition.seconds_per_page'] * page_count / len(desks))
+    metrics['construct_page_specifications.seconds'] = (
+        time_page_specifications())
+    return metrics
+
+
+def find_regressions(metrics, baseline, tolerance):
+    """Return (name, baseline, measured) for every regressed metric
+
+    Timings (metrics ending in "seconds" or "seconds_per_...") may grow
+    by the fractional tolerance. Every other metric is a count that
+    must not grow at all.
+    """
+    regressions = []
+    for name, expected in baseline.items():
+        measured = metrics.get(name)
+        if measured is None:
+            continue
+        if 'seconds' in name:
+            limit = max(expected * (1 + tolerance),
+                        expected + MIN_SECONDS_ALLOWANCE)
+        else:
+            limit = expected + 1e-9
+        if measured > limit:
+            regressions.append((name, expected, measured))
+    return regressions
+
+
+def main():
+    args = docopt(__doc__)
+    latency = float(args['--latency'])
+    desks = args['--desk'] or list(gen.load_generators_json())
+    baseline_file = APP_DIR.joinpath(args['--baseline'])
+
+    with tempfile.TemporaryDirectory() as workspace:
+        metrics = run_benchmarks(desks, latency, Path(workspace))
+    report = {'latency': latency, 'desks': desks, 'metrics': metrics}
+    print(json.dumps(report, indent=2))
+
+    if args['--update-baseline']:
+        baseline_file.write_text(json.dumps(report, indent=2) + '\n',
+                                 encoding='utf-8')
+        return
+    if not baseline_file.exists():
+        return
+
+    baseline = json.loads(baseline_file.read_text(encoding='utf-8'))
+    if (baseline['latency'], baseline['desks']) != (latency, desks):
+        gen.log.critical('Baseline was measured with latency %s for %s. '
+                         'Cannot compare.', baseline['latency'],
+                         baseline['desks'])
+        sys.exit(1)
+    regressions = find_regressions(metrics, baseline['metrics'],
+                                   float(args['--tolerance']))
+    for name, expected, measured in regressions:
+        gen.log.critical('Regression in %s: baseline %s, measured %s',
+                         name, expected, measured)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def master_file(tmp_path):
+    """A master document in tmp_path
+
+    The emulator opens a file that is not one of its own documents as a
+    master document with every master spread in masters.json.
+    """
+    path = tmp_path / 'Master.indd'
+    path.write_text('master', encoding='utf-8')
+    return path
+
+
+@pytest.fixture
+def make_job(master_file, tmp_path):
+    """Return a function making gen.create_from_master arguments
+
+    By default the job is page 3 of the News desk on 23 January 2018,
+    created from master_file and saved in tmp_path. Keyword arguments
+    given to the function replace those.
+    """
+    def make_job(**arguments):
+        job = dict(master_name='News-Base-R', spread=False, slug='News',
+                   edition_date=datetime(2018, 1, 23), page_number=3,
+                   master_file=master_file, pages_root=tmp_path)
+        job.update(arguments)
+        return job
+    return make_job
@@ -4,8 +4,12 @@ import json
 from pathlib import Path
 import sys
 
+import specials
+
 masters_file = Path('masters.json')
 pages_file = Path('pages.json')
+archive_dir = Path(specials.ARCHIVE_DIR)
+journal_file = Path(specials.JOURNAL_FILE)
 
 
 def read_json(filename):
@@ -20,12 +24,6 @@ def read_masters(masters=None):
     return read_json(masters)
 
 
-def read_pages(pages=None):
-    if pages is None:
-        pages = pages_file
-    return read_json(pages)
-
-
 def main(custom_spec):
     spec_lines = [l.rstrip() for l in custom_spec.split('\n')
                   if not l.startswith('#')
@@ -35,7 +33,6 @@ def main(custom_spec):
     spec_lines = spec_lines[1:]
 
     masters = read_masters()
-    pages_inventory = read_pages()
 
     reject = []
     accept = []
@@ -75,13 +72,15 @@ def main(custom_spec):
     page_dicts = [{'master': master, 'page': page}
                   for _, page, master in accept]
 
-    pages_inventory['Specials'][title] = page_dicts
-
-    with open(pages_file, 'w', encoding='utf-8') as f:
-        json.dump(pages_inventory, f, indent=2)
-
+    entries = specials.append_special(journal_file, title, page_dicts)
     print(f'\n# Added "{title}" to page generator Specials section')
 
+    if entries < specials.COMPACT_AFTER:
+        return
+    archived = specials.compact(pages_file, journal_file, archive_dir)
+    for archived_title in archived:
+        print(f'# Archived past special "{archived_title}" in {archive_dir}')
+
 
 if __name__ == '__main__':
     main(custom_spec=sys.stdin.read())
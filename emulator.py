@@ -0,0 +1,697 @@
+#!/usr/bin/env python3
+"""
+InDesign Emulator
+
+Usage:
+    emulator.py --pages_dir=DIR [--date=DATE] [--desk=DESK...]
+                [--chunk_size=N]
+
+Options:
+    --date=DATE     Edition date in ISO format (YYYY-MM-DD).
+                    The default is tomorrow.
+    --desk=DESK     Desk to generate. Can be repeated.
+                    The default is every desk in pages.json.
+    --chunk_size=N  Number of pages compiled into each AppleScript run.
+                    0 sends the whole edition as one script. [default: 0]
+
+Runs editions from pages.json end to end against an emulated InDesign,
+writing placeholder documents to DIR, and reports the number of
+scripts and bytes of AppleScript sent per page.
+
+The emulator understands the small AppleScript vocabulary that gen.py
+produces, and keeps a simple model of the open documents: pages and
+the masters applied to them, labelled text frames and layers. Saved
+documents are written as JSON, so that they can be opened again and
+inspected by tests.
+
+Anything outside that vocabulary is reported as an execution error,
+so that changes to the generated command stream are caught before
+they reach InDesign.
+"""
+
+import copy
+from datetime import datetime, timedelta
+import json
+from pathlib import Path
+import re
+import sys
+import time
+
+from docopt import docopt
+
+import gen
+
+# Key identifying JSON files written by the emulator
+DOCUMENT_MARKER = 'emulated InDesign document'
+
+APPLICATION = 'Adobe InDesign CC 2019'
+
+
+class EmulatorError(Exception):
+    """An AppleScript error raised while emulating a script"""
+
+    def __init__(self, message, number=-2700):
+        super().__init__(message)
+        self.message = message
+        self.number = number
+
+
+class _Return(Exception):
+    """Raised by a return statement to stop running the script"""
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+
+def master_frames(master_name, spread):
+    """Return the labelled frames placed on a master spread
+
+    Single-page masters have a date and page number frame (and a price
+    on front pages). Spread masters have a date on each page and
+    separate left and right page numbers. Every master also has an
+    unlabelled frame on the locked Furniture layer.
+    """
+    def frame(label, side=None, layer='Work'):
+        return {'label': label, 'contents': '', 'layer': layer,
+                'side': side}
+
+    if spread:
+        frames = [frame('Edition date', 'L'), frame('Edition date', 'R'),
+                  frame('L-Page number', 'L'), frame('R-Page number', 'R')]
+    else:
+        frames = [frame('Edition date'), frame('Page number')]
+        if 'Front' in master_name:
+            frames.append(frame('Price'))
+    frames.append(frame('', layer='Furniture'))
+    return frames
+
+
+def new_master_document(path, masters):
+    """Return the model of a freshly opened master document"""
+    return {
+        DOCUMENT_MARKER: 1,
+        'path': str(path),
+        'pages': [{'master': None, 'side': None, 'frames': []}],
+        'masters': {name: master_frames(name, details['spread'])
+                    for name, details in masters.items()},
+        'layers': {'Furniture': {'locked': False},
+                   'Work': {'locked': False}},
+        'active layer': 'Furniture',
+    }
+
+
+def _logical_lines(script_str):
+    """Split a script into stripped lines, keeping multi-line strings"""
+    lines = []
+    current = []
+    in_string = escaped = False
+    for char in script_str:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '\n':
+            lines.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    lines.append(''.join(current).strip())
+    return [line for line in lines if line and not line.startswith('--')]
+
+
+def _parse(lines, position=0, terminators=()):
+    """Parse lines into a list of nodes, stopping at a terminator
+
+    Nodes are tuples of:
+        ('tell', target, body)
+        ('try', body, error_variables, handler)
+        ('repeat', header, body)
+        ('if', condition, body)
+        ('command', line)
+
+    Returns (nodes, position of the terminating line).
+    """
+    nodes = []
+    while position < len(lines):
+        line = lines[position]
+        if line.startswith(terminators):
+            return nodes, position
+        position += 1
+        tell = re.match(r'^tell (.+?)(?: to (.+))?$', line)
+        if tell and tell.group(2):
+            nodes.append(('tell', tell.group(1),
+                          [('command', tell.group(2))]))
+        elif tell:
+            body, position = _parse(lines, position, ('end tell',))
+            nodes.append(('tell', tell.group(1), body))
+            position += 1
+        elif line == 'try':
+            body, position = _parse(lines, position, ('on error', 'end try'))
+            variables, handler = [], []
+            if position < len(lines) and lines[position].startswith(
+                    'on error'):
+                variables = re.match(
+                    r'^on error(?: (\w+))?(?: number (\w+))?$',
+                    lines[position]).groups()
+                handler, position = _parse(lines, position + 1,
+                                           ('end try',))
+            nodes.append(('try', body, variables, handler))
+            position += 1
+        elif line.startswith('repeat '):
+            body, position = _parse(lines, position, ('end repeat',))
+            nodes.append(('repeat', line, body))
+            position += 1
+        elif line.startswith('if ') and line.endswith(' then'):
+            body, position = _parse(lines, position, ('end if',))
+            nodes.append(('if', line[len('if '):-len(' then')], body))
+            position += 1
+        elif line.startswith('end '):
+            raise EmulatorError(f'Unexpected “{line}”', -2741)
+        else:
+            nodes.append(('command', line))
+    if terminators:
+        raise EmulatorError(f'Expected “{terminators[-1]}”', -2741)
+    return nodes, position
+
+
+def _unquote(literal):
+    """Return the text of an AppleScript string literal"""
+    return re.sub(r'\\(.)', r'\1', literal[1:-1])
+
+
+def _split_outside_strings(text, separator):
+    """Split text on separator where it does not occur inside a string"""
+    if '"' not in text:
+        return [part.strip() for part in text.split(separator)]
+    parts = []
+    current = ''
+    in_string = False
+    i = 0
+    while i < len(text):
+        if text[i] == '"' and (i == 0 or text[i - 1] != '\\'):
+            in_string = not in_string
+        if not in_string and text.startswith(separator, i):
+            parts.append(current.strip())
+            current = ''
+            i += len(separator)
+            continue
+        current += text[i]
+        i += 1
+    parts.append(current.strip())
+    return parts
+
+
+def _format_result(value):
+    """Format a result value the way osascript prints it"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, list):
+        return ', '.join(_format_result(item) for item in value)
+    return str(value)
+
+
+class InDesignEmulator:
+    """A backend that emulates InDesign instead of running osascript
+
+    `masters` is the masters.json dict describing the master spreads
+    in opened master documents (by default masters.json is loaded).
+
+    `selections` maps the prompt of a "choose from list" dialog to the
+    items to choose. Otherwise the first item is chosen, or every item
+    if multiple selections are allowed. Text dialogs return their
+    default answer.
+
+    `latency` is a number of seconds to sleep for each script, to mimic
+    the cost of a real AppleScript round trip.
+
+    The emulator counts the scripts and bytes of AppleScript it is
+    sent, and records the paths of saved documents.
+    """
+
+    def __init__(self, masters=None, selections=None, latency=0.0):
+        if masters is None:
+            masters = gen.load_masters_json()
+        self.masters = masters
+        self.selections = selections or {}
+        self.latency = latency
+        self.documents = []
+        self.told_document = None
+        self.snapshots = {}
+        self.interaction_level = 'interact with all'
+        self.saved = []
+        self.script_count = 0
+        self.script_bytes = 0
+
+    @property
+    def active_document(self):
+        """The document of the enclosing tell block, or the frontmost"""
+        if self.told_document is not None:
+            return self.told_document
+        if not self.documents:
+            raise EmulatorError('Can’t get active document.', -1728)
+        return self.documents[-1]
+
+    def _named_document(self, name):
+        for document in self.documents:
+            if Path(document['path']).name == name:
+                return document
+        raise EmulatorError(f'Can’t get document "{name}".', -1728)
+
+    def run(self, script_str, step=None):
+        self.script_count += 1
+        self.script_bytes += len(script_str.encode('utf-8'))
+        if self.latency:
+            time.sleep(self.latency)
+        self.variables = {}
+        self.result = None
+        try:
+            nodes, _ = _parse(_logical_lines(script_str))
+            self._execute(nodes, target=None)
+        except _Return as returned:
+            self.result = returned.value
+        except EmulatorError as exc:
+            return '', f'execution error: {exc.message} ({exc.number})'
+        return _format_result(self.result), ''
+
+    def close(self):
+        pass
+
+    def _execute(self, nodes, target):
+        for node in nodes:
+            kind = node[0]
+            if kind == 'tell':
+                told = self.told_document
+                try:
+                    self._execute(node[2],
+                                  self._tell_target(node[1], target))
+                finally:
+                    self.told_document = told
+            elif kind == 'try':
+                _, body, variables, handler = node
+                try:
+                    self._execute(body, target)
+                except EmulatorError as exc:
+                    for name, value in zip(variables,
+                                           [exc.message, exc.number]):
+                        if name:
+                            self.variables[name] = value
+                    self._execute(handler, target)
+            elif kind == 'repeat':
+                self._repeat(node[1], node[2], target)
+            elif kind == 'if':
+                if self._condition(node[1]):
+                    self._execute(node[2], target)
+            else:
+                self.result = self._command(node[1], target)
+
+    def _tell_target(self, target_str, target):
+        application = re.match(r'^application "(.*)"$', target_str)
+        if application:
+            if application.group(1) != APPLICATION:
+                raise EmulatorError(
+                    f'Can’t get application "{application.group(1)}".',
+                    -2753)
+            return 'application'
+        if target_str == 'the active document' and target == 'application':
+            self.told_document = self.active_document
+            return 'document'
+        document = re.match(r'^document "(.*)"$', target_str)
+        if document and target == 'application':
+            self.told_document = self._named_document(document.group(1))
+            return 'document'
+        raise EmulatorError(f'Can’t get {target_str}.', -1728)
+
+    def _repeat(self, header, body, target):
+        loop = re.match(r'^repeat with (\w+) from (.+) to (.+)$', header)
+        if not loop:
+            raise EmulatorError(f'Emulator does not understand “{header}”',
+                                -2741)
+        name, first, last = loop.groups()
+        for value in range(self._evaluate(first), self._evaluate(last) + 1):
+            self.variables[name] = value
+            self._execute(body, target)
+
+    def _condition(self, condition):
+        """Evaluate an “a is b” or “a is in b” comparison"""
+        parts = _split_outside_strings(condition, ' is in ')
+        if len(parts) == 2:
+            return self._evaluate(parts[0]) in self._evaluate(parts[1])
+        parts = _split_outside_strings(condition, ' is ')
+        if len(parts) != 2:
+            raise EmulatorError(
+                f'Emulator does not understand “if {condition}”', -2741)
+        return self._evaluate(parts[0]) == self._evaluate(parts[1])
+
+    def _value(self, part):
+        """Evaluate a single literal, variable, list item or count"""
+        constants = {'tab': '\t', 'linefeed': '\n', 'true': True,
+                     'false': False}
+        if part in self.variables:
+            return self.variables[part]
+        item = re.fullmatch(r'item (\w+) of (\w+)', part)
+        count = re.fullmatch(r'count of (\w+)', part)
+        # NSDates are held as their time.perf_counter() values
+        interval = re.fullmatch(r"(\w+)'s timeIntervalSinceNow\(\)", part)
+        if part.startswith('"') and part.endswith('"'):
+            return _unquote(part)
+        if part.startswith('{') and part.endswith('}'):
+            if not part[1:-1].strip():
+                return []
+            return [self._value(element)
+                    for element in _split_outside_strings(part[1:-1], ',')]
+        if re.fullmatch(r'-?\d+', part):
+            return int(part)
+        if part in constants:
+            return constants[part]
+        if part == "current application's NSDate's |date|()":
+            return time.perf_counter()
+        if interval:
+            return self._value(interval.group(1)) - time.perf_counter()
+        if item:
+            items = self._value(item.group(2))
+            index = self._value(item.group(1))
+            if not 1 <= index <= len(items):
+                raise EmulatorError(f'Can’t get item {index}.', -1728)
+            return items[index - 1]
+        if count:
+            return len(self._value(count.group(1)))
+        raise EmulatorError(f'The variable {part} is not defined.', -2753)
+
+    def _evaluate(self, expression):
+        """Evaluate a concatenation of strings, constants and variables"""
+        values = []
+        for part in _split_outside_strings(expression, '&'):
+            as_text = part.endswith(' as text')
+            if as_text:
+                part = part[:-len(' as text')].strip()
+            value = self._value(part)
+            if as_text and isinstance(value, list):
+                delimiter = self.variables.get('text item delimiters', '')
+                value = delimiter.join(map(_format_result, value))
+            values.append(value)
+        if len(values) == 1:
+            return values[0]
+        return ''.join(map(_format_result, values))
+
+    def _command(self, line, target):
+        """Run a single command, returning its result"""
+        for pattern, scope, handler in self._commands:
+            match = pattern.match(line)
+            if match:
+                if scope is not None and scope != target:
+                    raise EmulatorError(
+                        f'“{line}” cannot be used outside the {scope}',
+                        -1708)
+                return handler(self, *match.groups())
+        raise EmulatorError(f'Emulator does not understand “{line}”', -2741)
+
+    # Script control
+
+    def _set_list(self, name):
+        self.variables[name] = []
+
+    def _set_variable(self, name, expression):
+        self.variables[name] = self._evaluate(expression)
+
+    def _append_to_list(self, name, expression):
+        self.variables[name].append(self._evaluate(expression))
+
+    def _set_delimiters(self, expression):
+        self.variables['text item delimiters'] = self._evaluate(expression)
+
+    def _return(self, expression):
+        raise _Return(self._evaluate(expression))
+
+    def _error(self, expression, number_expression):
+        number = -2700
+        if number_expression:
+            number = self._evaluate(number_expression)
+        raise EmulatorError(_format_result(self._evaluate(expression)),
+                            number)
+
+    # Application commands
+
+    def _use(self, library):
+        pass
+
+    def _set_interaction_level(self, level):
+        self.interaction_level = level
+
+    def _open(self, path):
+        path = Path(path)
+        if not path.exists():
+            raise EmulatorError(f'File {path} wasn’t found.', -43)
+        try:
+            document = json.loads(path.read_text(encoding='utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            document = None
+        if not isinstance(document, dict) or DOCUMENT_MARKER not in document:
+            document = new_master_document(path, self.masters)
+        document['path'] = str(path)
+        self.documents.append(document)
+        self.snapshots[id(document)] = copy.deepcopy(document)
+
+    def _choose_from_list(self, items, prompt, multiple):
+        items = [_unquote(item) for item in
+                 re.findall(r'"(?:[^"\\]|\\.)*"', '{' + items + '}')]
+        if prompt in self.selections:
+            return list(self.selections[prompt])
+        return items if multiple else items[:1]
+
+    def _display_dialog(self, message, default):
+        return f'button returned:OK, text returned:{default}'
+
+    # Document commands
+
+    def _page(self, number):
+        pages = self.active_document['pages']
+        number = int(number)
+        if not 1 <= number <= len(pages):
+            raise EmulatorError(f'Can’t get page {number}.', -1728)
+        return pages[number - 1]
+
+    def _master(self, name):
+        if name not in self.active_document['masters']:
+            raise EmulatorError(f'Can’t get master spread "{name}".', -1728)
+        return name
+
+    def _apply_master(self, number, master_name):
+        self._page(number)['master'] = self._master(master_name)
+
+    def _make_spread(self, master_name):
+        master_name = self._master(master_name)
+        self.active_document['pages'].extend(
+            {'master': master_name, 'side': side, 'frames': []}
+            for side in 'LR')
+
+    def _text_frames(self):
+        document = self.active_document
+        for frames in document['masters'].values():
+            yield from frames
+        for page in document['pages']:
+            yield from page['frames']
+
+    def _set_contents(self, label, text):
+        label, text = _unquote(f'"{label}"'), _unquote(f'"{text}"')
+        for frame in self._text_frames():
+            if frame['label'] == label:
+                frame['contents'] = text
+
+    def _frames_of(self, master_name):
+        """Return the text frames of a master spread, or the document"""
+        if master_name is None:
+            return list(self._text_frames())
+        return self.active_document['masters'][self._master(master_name)]
+
+    def _get_labels(self, name, master_name):
+        self.variables[name] = [frame['label']
+                                for frame in self._frames_of(master_name)]
+
+    def _set_frame_contents(self, index_expression, master_name, expression):
+        frames = self._frames_of(master_name)
+        index = self._evaluate(index_expression)
+        if not 1 <= index <= len(frames):
+            raise EmulatorError(f'Can’t get text frame {index}.', -1728)
+        frames[index - 1]['contents'] = _format_result(
+            self._evaluate(expression))
+
+    def _override(self, source_number, layer, destination_number):
+        source = self._page(source_number)
+        destination = self._page(destination_number)
+        if source['master'] is None:
+            return
+        frames = self.active_document['masters'][source['master']]
+        destination['frames'].extend(
+            dict(frame, overridden=True) for frame in frames
+            if frame['layer'] == layer
+            and frame['side'] in (None, source['side']))
+
+    def _lock_layer(self, name, locked):
+        layers = self.active_document['layers']
+        if name not in layers:
+            raise EmulatorError(f'Can’t get layer "{name}".', -1728)
+        layers[name]['locked'] = locked == 'true'
+
+    def _set_active_layer(self, name):
+        if name not in self.active_document['layers']:
+            raise EmulatorError(f'Can’t get layer "{name}".', -1728)
+        self.active_document['active layer'] = name
+
+    def _write(self, document, path):
+        path = Path(path)
+        if not path.parent.is_dir():
+            raise EmulatorError(f'Folder {path.parent} wasn’t found.', -43)
+        path.write_text(json.dumps(dict(document, path=str(path)), indent=1),
+                        encoding='utf-8')
+        self.saved.append(path)
+
+    def _save(self, path):
+        document = self.active_document
+        self._write(document, path)
+        document['path'] = path
+        self.snapshots[id(document)] = copy.deepcopy(document)
+
+    def _save_copy(self, path):
+        self._write(self.active_document, path)
+
+    def _revert(self, name=None):
+        document = (self.active_document if name is None
+                    else self._named_document(name))
+        index = self.documents.index(document)
+        snapshot = self.snapshots.pop(id(document))
+        reverted = copy.deepcopy(snapshot)
+        self.documents[index] = reverted
+        self.snapshots[id(reverted)] = snapshot
+        if self.told_document is document:
+            self.told_document = reverted
+
+    def _close(self, saving, name=None):
+        document = (self.active_document if name is None
+                    else self._named_document(name))
+        if saving == 'yes':
+            self._write(document, document['path'])
+        self.documents.remove(document)
+        self.snapshots.pop(id(document), None)
+
+    def _close_named(self, name, saving):
+        self._close(saving, name)
+
+    _commands = [
+        (r'^set (\w+) to \{\}$', None, _set_list),
+        (r'^set end of (\w+) to (.+)$', None, _append_to_list),
+        (r"^set AppleScript's text item delimiters to (.+)$", None,
+         _set_delimiters),
+        (r'^return (.+)$', None, _return),
+        (r'^error (.+?)(?: number (\w+))?$', None, _error),
+        (r'^use (framework "Foundation"|scripting additions)$', None, _use),
+        (r'^set user interaction level of script preferences to (.+)$',
+         'application', _set_interaction_level),
+        (r'^open POSIX file "(.*)"$', 'application', _open),
+        (r'^choose from list \{(.*)\} with prompt "(.*)"'
+         r'( with multiple selections allowed)?$',
+         'application', _choose_from_list),
+        (r'^display dialog "(.*)" default answer "(.*)"$', 'application',
+         _display_dialog),
+        (r'^close the active document saving (yes|no)$', 'application',
+         _close),
+        (r'^close document "(.*)" saving (yes|no)$', 'application',
+         _close_named),
+        (r'^revert the active document$', 'application', _revert),
+        (r'^revert document "(.*)"$', 'application', _revert),
+        (r'^set applied master of page (\d+) to master spread "(.*)"$',
+         'document', _apply_master),
+        (r'^make new spread with properties '
+         r'\{applied master:master spread "(.*)"\}$',
+         'document', _make_spread),
+        (r'^set the contents of every text frame whose label is "(.*?)" '
+         r'to "(.*)"$', 'document', _set_contents),
+        (r'^set (\w+) to label of every text frame'
+         r'(?: of master spread "(.*)")?$', 'document', _get_labels),
+        (r'^set contents of text frame (\w+)'
+         r'(?: of master spread "(.*?)")? to (.+)$', 'document',
+         _set_frame_contents),
+        (r'^override \(every item of master page items of page (\d+)\s*'
+         r'whose item layer\'s name is "(.*)"\) destination page '
+         r'page (\d+)$', 'document', _override),
+        (r'^set locked of layer "(.*)" to (true|false)$', 'document',
+         _lock_layer),
+        (r'^set active layer to "(.*)"$', 'document', _set_active_layer),
+        (r'^save to POSIX file "(.*)"$', 'document', _save),
+        (r'^save a copy to POSIX file "(.*)"$', 'document', _save_copy),
+        (r'^revert$', 'document', _revert),
+        (r'^close saving (yes|no)$', 'document', _close),
+        (r'^set (\w+) to (.+)$', None, _set_variable),
+    ]
+    _commands = [(re.compile(pattern, re.DOTALL), scope, handler)
+                 for pattern, scope, handler in _commands]
+
+
+def run_editions(emulator, pages, desks, edition_date, master_file,
+                 pages_root, chunk_size=0):
+    """Generate every page set of each desk, returning statistics per desk
+
+    Each statistics dict holds the number of pages generated and
+    failed, and the scripts and bytes of AppleScript sent per page.
+    """
+    stats = {}
+    with gen.use_backend(emulator):
+        for desk in desks:
+            scripts = emulator.script_count
+            script_bytes = emulator.script_bytes
+            page_jobs = gen.make_page_jobs(pages, desk, pages[desk],
+                                           edition_date, master_file,
+                                           pages_root)
+            results = gen.generate_edition(page_jobs, chunk_size=chunk_size)
+            page_count = len(results) or 1
+            stats[desk] = {
+                'pages': len(results),
+                'failed': sum(not result.ok for result in results),
+                'scripts per page':
+                    (emulator.script_count - scripts) / page_count,
+                'bytes per page':
+                    (emulator.script_bytes - script_bytes) / page_count,
+            }
+            for result in results:
+                if not result.ok:
+                    gen.log.error('Failed to generate page %s: %s',
+                                  result.page_number, result.error)
+    return stats
+
+
+def main():
+    args = docopt(__doc__)
+
+    pages_root = Path(args['--pages_dir']).expanduser().resolve()
+    pages_root.mkdir(parents=True, exist_ok=True)
+    if args['--date']:
+        edition_date = datetime.strptime(args['--date'], '%Y-%m-%d')
+    else:
+        edition_date = datetime.today() + timedelta(1)
+
+    masters = gen.load_masters_json()
+    pages = gen.construct_page_specifications(
+        gen.load_generators_json(), masters)
+    desks = args['--desk'] or list(pages)
+
+    # Any file that is not a saved emulator document opens as the master
+    master_file = pages_root.joinpath('Emulated Master.indd')
+    master_file.write_text('Emulated master document\n', encoding='utf-8')
+
+    stats = run_editions(InDesignEmulator(masters), pages, desks,
+                         edition_date, master_file, pages_root,
+                         chunk_size=int(args['--chunk_size']))
+    print(json.dumps(stats, indent=2))
+    if any(desk_stats['failed'] for desk_stats in stats.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
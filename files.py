@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+File handling shared by the page generator's modules
+
+Files hashed to check their contents (master files and uploaded pages)
+can be large, so they are read in blocks. Files that other runs or
+processes read while they are being written (manifests, indexes and
+pages.json) are replaced atomically, so a reader sees either the old
+file or the new one and never part of one.
+"""
+
+import hashlib
+from pathlib import Path
+
+
+def file_digest(path):
+    """Return the size and SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
+
+def write_atomically(path, text):
+    """Write text to path, replacing the previous file atomically
+
+    The text is written to a temporary file next to path, which is then
+    renamed over it.
+    """
+    path = Path(path)
+    temp_file = path.with_name(f'{path.name}.tmp')
+    temp_file.write_text(text, encoding='utf-8')
+    temp_file.replace(path)
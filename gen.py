@@ -4,21 +4,145 @@ InDesign Page Generator
 
 Usage:
     gen.py --master=MASTER --pages_dir=DIR
+           [--desk=DESK] [--date=DATE [--until=DATE]]
+           [--set=SET... | --scheduled]
+           [--chunk_size=N] [--worker] [--open_master_once]
+           [--snapshot_cache=DIR [--snapshot_cache_size=N]]
+           [--workers=N] [--worker_command=CMD...]
+           [--force] [--resume] [--retries=N]
+           [--trace=FILE] [--metrics=FILE] [--record=FILE]
+           [--scratch_dir=DIR] [--archived]
+    gen.py --plan --master=MASTER --pages_dir=DIR
+           [--desk=DESK] [--date=DATE [--until=DATE]]
+           [--set=SET... | --scheduled]
+           [--chunk_size=N] [--open_master_once] [--force] [--archived]
+
+Options:
+    --desk=DESK     Desk to generate pages for, instead of asking.
+    --date=DATE     Edition date in ISO format (YYYY-MM-DD), instead of
+                    asking. --plan uses tomorrow if it is not given.
+    --until=DATE    Last edition date of a range starting at --date. The
+                    page sets are generated for every date in the range
+                    in one session, reusing the backend and (with
+                    --open_master_once) the open master document.
+    --set=SET       Page set of the desk to generate, instead of asking.
+                    Can be repeated to generate several page sets.
+    --scheduled     Generate the page sets whose rules in pages.json
+                    match each edition date, instead of asking.
+    --worker        Run all AppleScript in one persistent worker process
+                    instead of starting osascript for each script.
+    --chunk_size=N  Number of pages compiled into each AppleScript run.
+                    0 sends the whole edition as one script. [default: 0]
+    --open_master_once
+                    Open the master document once for the whole run,
+                    saving each page as a copy and reverting the master,
+                    instead of opening the master file for every page.
+    --snapshot_cache=DIR
+                    Create pages from pre-built snapshots of each master
+                    page kept in DIR, building any that are missing or
+                    out of date with the master file.
+    --snapshot_cache_size=N
+                    Most snapshots to keep in the cache. A run needing
+                    more keeps every snapshot it uses until it finishes.
+                    [default: 64]
+    --workers=N     Generate pages in parallel with N persistent worker
+                    processes, each keeping its own master document open.
+                    Each worker needs its own InDesign instance, such as
+                    InDesign Server, given with --worker_command. The
+                    snapshot cache is not used with several workers.
+                    [default: 1]
+    --worker_command=CMD
+                    Command starting a persistent AppleScript worker (see
+                    osa_worker.py) that drives its own InDesign, such as
+                    "ssh mac2 python3 osa_worker.py" for InDesign on
+                    another Mac. Give one for each of the --workers.
+    --force         Regenerate every page, even those the manifest in the
+                    pages directory shows are already up to date.
+    --resume        Carry on with the last run in the pages directory that
+                    did not finish, without asking for the desk, date and
+                    pages again. Pages it completed are not regenerated.
+    --retries=N     Times to retry pages that fail with a transient error,
+                    such as an AppleEvent timing out. [default: 3]
+    --trace=FILE    Write the timings of the run, each page, each
+                    AppleScript call and each step of a page to FILE as
+                    Chrome trace-event JSON, for viewing in
+                    chrome://tracing or Perfetto. The steps are timed by
+                    the scripts, so pages are still batched.
+    --metrics=FILE  Write the metrics of the run (pages generated, skipped
+                    and failed, latencies of AppleScript calls and of each
+                    step of a page, calls per page and bytes written) to
+                    FILE. A FILE ending in .prom is written as a
+                    Prometheus textfile, otherwise the metrics are added
+                    to the JSON history in FILE.
+    --record=FILE   Record every AppleScript call of the run, with its
+                    output and timing, to the session file FILE. See
+                    session.py for replaying it.
+    --scratch_dir=DIR
+                    Save pages to the local directory DIR, and copy them
+                    to the pages directory in the background while the
+                    next pages are generated. Pages are generated with a
+                    script each (--chunk_size is ignored) so that each
+                    is copied as soon as it is saved. Each copy is
+                    verified and renamed into place, and the run
+                    finishes once every page has been copied.
+    --archived      Include the archived special editions in the Specials
+                    desk. Past specials are moved out of pages.json to
+                    the archive when the specials journal is compacted
+                    (see specials.py).
+    --plan          Print the plan for generating the chosen page sets
+                    (by default every page set of every desk) as JSON,
+                    without using InDesign. The plan holds each page's
+                    output path and scripts, every script that would be
+                    sent, and an estimate of the time taken based on the
+                    timings of earlier runs.
 """
 
-import copy
+from contextlib import contextmanager, ExitStack, nullcontext
 from datetime import datetime, timedelta
 import json
 import logging
 from pathlib import Path
+import queue
 import re
-import subprocess
+import shlex
+import shutil
 import sys
+import threading
+import time
+from typing import NamedTuple
 
 from docopt import docopt
 
+from backends import OsascriptBackend, WorkerBackend
+from files import write_atomically
+from manifest import GenerationManifest, page_spec_hash
+from page_specs import master_specs, MasterSpec, PageSpec
+from page_cache import file_fingerprint, PageSnapshotCache
+from run_journal import RunJournal
+from run_metrics import collect_run_metrics, write_run_metrics
+import session
+import specials
+import tracing
+from uploader import PageUploader
+
 APP_DIR = Path(__file__).parent
 
+# Names of the weekdays used in page set rules, Monday first
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+            'saturday', 'sunday']
+
+# Page specifications compiled from pages.json and masters.json, and the
+# version of the format they are cached in
+SPECIFICATIONS_CACHE_FILE = '.page-specifications.json'
+SPECIFICATIONS_CACHE_VERSION = 3
+
+# Page specifications loaded by load_page_specifications, keyed by the
+# modification times and sizes of the files they were built from
+_specifications = {}
+
+# Timings of earlier runs, kept in the pages directory
+TIMINGS_FILE = '.generation-timings.json'
+
 logging.basicConfig(
     format='%(asctime)s  %(levelname)-10s %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S',
@@ -40,49 +164,210 @@ def remove_zero_padded_dates(date_string):
     return re.sub(r'([ -])0(\d)', r'\1\2', date_string)
 
 
-def run_applescript(script_str):
-    """Encode and run the AppleScript in script_str
+# AppleScript error numbers for failures that may succeed if retried
+RETRYABLE_ERROR_NUMBERS = {
+    -600,   # Application isn't running
+    -609,   # Connection is invalid
+    -1712,  # AppleEvent timed out
+}
+
 
-    An AppleScript execution error will cause the program to
-    quit immediately. This is logged as a fatal error.
+class AppleScriptError(Exception):
+    """An execution error reported when running an AppleScript
+
+    `message` is the error text after "execution error: ", which ends
+    with the error number in brackets, for example:
+        Adobe InDesign CC 2019 got an error: AppleEvent timed out. (-1712)
     """
-    osa = subprocess.Popen(['osascript', '-'],
-                           stdin=subprocess.PIPE,
-                           stdout=subprocess.PIPE,
-                           stderr=subprocess.PIPE)
-    result = osa.communicate(script_str.encode('utf-8'))
 
-    decoded = [stream.decode('utf-8').rstrip() for stream in result]
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+        self.number = error_number(message)
+
+    @property
+    def retryable(self):
+        return self.number in RETRYABLE_ERROR_NUMBERS
+
+
+def error_number(message):
+    """Return the AppleScript error number at the end of message, or None"""
+    match = re.search(r'\((-?\d+)\)$', message.strip())
+    return int(match.group(1)) if match else None
+
+
+def is_retryable_error(message):
+    """Return True if an error message reports a transient failure"""
+    return error_number(message) in RETRYABLE_ERROR_NUMBERS
+
+
+class _ThreadState(threading.local):
+    """Script running state, kept separately for each thread
+
+    backend is the backend used by run_applescript in this thread
+    (None for the default osascript backend). collected_steps is the
+    list of (step, script) pairs while collect_applescript_steps is
+    active. document is the name of the document that scripts from
+    wrap_and_run are addressed to (see open_document), or None to
+    address the active document.
+    """
+    backend = None
+    collected_steps = None
+    document = None
+
+
+_thread_state = _ThreadState()
+_default_backend = OsascriptBackend()
+
+
+def set_backend(backend):
+    """Run subsequent AppleScript with `backend`, returning the previous one
+
+    The backend is set for the current thread only, so that threads
+    can drive separate backends (see generate_parallel). The document
+    scripts are addressed to is forgotten, as it belongs to the
+    previous backend's InDesign.
+
+    See backends.py for the available backends.
+    """
+    previous = get_backend()
+    _thread_state.backend = backend
+    _thread_state.document = None
+    return previous
+
+
+def get_backend():
+    """Return the backend the current thread uses to run AppleScript"""
+    return _thread_state.backend or _default_backend
+
+
+@contextmanager
+def use_backend(backend, close=True):
+    """Run AppleScript with `backend` for the duration of a with block
+
+    The backend is closed when the block exits, unless `close` is False.
+    """
+    previous = set_backend(backend)
+    try:
+        yield backend
+    finally:
+        set_backend(previous)
+        if close:
+            backend.close()
+
+
+def run_applescript(script_str, step=None):
+    """Encode and run the AppleScript in script_str
+
+    An AppleScript execution error is logged and raised as an
+    AppleScriptError.
+
+    The script is run by the current backend (see set_backend), which
+    by default starts a new osascript process for each script.
+
+    If steps are being collected (see collect_applescript_steps) the
+    script is queued under the name `step` instead of being run, and
+    an empty string is returned.
+    """
+    if _thread_state.collected_steps is not None:
+        _thread_state.collected_steps.append((step, script_str))
+        return ''
+
+    start = time.perf_counter()
+    with tracing.span(step or 'applescript', 'applescript',
+                      script_bytes=len(script_str.encode('utf-8'))) as call:
+        result = get_backend().run(script_str, step=step)
+        call['stdout_bytes'], call['stderr_bytes'] = [
+            len(stream.encode('utf-8')) for stream in result]
+    session.record_call(step, script_str, *result,
+                        time.perf_counter() - start)
+
+    decoded = [stream.rstrip() for stream in result]
     stdout, stderr = decoded
     if any(decoded):
         log.debug('AppleScript output: %s', decoded)
     if 'execution error' in stderr:
-        # Program cannot continue running as it is in an unknown state
-        log.critical('AppleScript: ' + stderr.split('execution error: ')[-1])
-        sys.exit()
+        message = stderr.split('execution error: ')[-1]
+        log.error('AppleScript: ' + message)
+        raise AppleScriptError(message)
 
     return stdout if stdout else stderr
 
 
-def wrap_and_run(script):
+@contextmanager
+def collect_applescript_steps():
+    """Queue scripts passed to run_applescript rather than running them
+
+    Yields the list of (step, script) pairs, which can be run as a
+    single script with run_applescript_steps once the block exits.
+    """
+    previous = _thread_state.collected_steps
+    _thread_state.collected_steps = steps = []
+    try:
+        yield steps
+    finally:
+        _thread_state.collected_steps = previous
+
+
+def compile_applescript_steps(steps):
+    """Join (step, script) pairs into a single AppleScript
+
+    Each step is wrapped in its own try block so that an error names
+    the step that failed, for example:
+        execution error: apply_master failed: Invalid object (-1728)
+    """
+    blocks = []
+    for step, script in steps:
+        blocks.append(f'''\
+try
+{script.strip()}
+on error error_message number error_number
+  error "{step} failed: " & error_message number error_number
+end try
+''')
+    return ''.join(blocks)
+
+
+def run_applescript_steps(steps):
+    """Run the collected (step, script) pairs with one osascript call"""
+    if not steps:
+        return ''
+    return run_applescript(compile_applescript_steps(steps), step='batch')
+
+
+def document_reference(name=None):
+    """Return an AppleScript reference to the document called name
+
+    By default this is the document last opened or saved by this
+    thread, which is addressed by name so that scripts never act on
+    whichever document happens to be active (for example one the user
+    is working on), or the active document if there is none.
+    """
+    name = name or _thread_state.document
+    if name is None:
+        return 'the active document'
+    return f'document "{name}"'
+
+
+def wrap_and_run(script, step=None):
     """Wrap the InDesign script in appropriate tell blocks and run it
 
     The script is wrapped in the boilerplate block for addressing
-    the active application in Adobe InDesign. This is to cut down
-    on repetition in this file.
+    the document opened by this thread in Adobe InDesign (see
+    document_reference). This is to cut down on repetition in this file.
 
     The result of the AppleScript runner is returned
     """
     return run_applescript(f'''
 tell application "Adobe InDesign CC 2019"
-  tell the active document
+  tell {document_reference()}
     {script}
   end tell
 end tell
-''')
+''', step=step)
 
 
-def set_frame_contents(frame_name, text):
+def set_frame_contents(frame_name, text, step='set_frame_contents'):
     """Set the contents of text frames in the active InDesign document
 
     frame_name corresponds to the script label of the frame in InDesign.
@@ -91,7 +376,45 @@ def set_frame_contents(frame_name, text):
     """
     script = ('set the contents of every text frame whose label is '
               f'"{frame_name}" to "{text}"')
-    wrap_and_run(script)
+    wrap_and_run(script, step=step)
+
+
+def set_labelled_frames(values, master_name=None, step='fill_frames'):
+    """Set the contents of labelled text frames in one pass
+
+    `values` maps script labels to the contents of the frames with that
+    label. The labels of the text frames are fetched with a single
+    query, and each frame whose label is in `values` is filled, so
+    adding a label costs no extra round trips.
+
+    With `master_name` only the frames of that master spread are
+    walked, otherwise every text frame in the active document.
+
+    Frames with labels not in `values` are left alone, as are labels
+    that no frame has.
+    """
+    if not values:
+        return
+    container = ''
+    if master_name is not None:
+        container = f' of master spread "{master_name}"'
+    script = f'''\
+set frame_labels to label of every text frame{container}
+set fill_labels to {wrap_seq_for_applescript(values)}
+set fill_values to {wrap_seq_for_applescript(values.values())}
+repeat with frame_index from 1 to count of frame_labels
+  set frame_label to item frame_index of frame_labels
+  if frame_label is in fill_labels then
+    repeat with fill_index from 1 to count of fill_labels
+      if item fill_index of fill_labels is frame_label then
+        set fill_value to item fill_index of fill_values
+        set contents of text frame frame_index{container} to fill_value
+      end if
+    end repeat
+  end if
+end repeat
+'''
+    wrap_and_run(script, step=step)
 
 
 def _format_page_date_for_weekend(edition_date):
@@ -164,50 +487,45 @@ def apply_master(master_name: str, spread: bool):
         apply_master_script = (
             'make new spread with properties {applied master:master spread "' +
             master_name + '"}')
-    wrap_and_run(apply_master_script)
-
-
-def set_date_on_page(date_string):
-    """Set the content of the current document’s `Edition date` frames"""
-    set_frame_contents('Edition date', date_string)
+    wrap_and_run(apply_master_script, step='apply_master')
 
 
-def set_price(edition_date):
-    """Set the price on the front page
+def format_price(edition_date):
+    """Return the cover price of the edition
 
     Weekday and weekend editions have a different price
     """
     weekday_price = '£1.20'
     weekend_price = '£1.50'
     is_saturday = edition_date.isoweekday() == 6
-    price = weekend_price if is_saturday else weekday_price
-    set_frame_contents('Price', price)
+    return weekend_price if is_saturday else weekday_price
 
 
-def set_spread_page_numbers(left_page_number):
-    """Set the page numbers on both halves of a spread"""
-    set_frame_contents('L-Page number', left_page_number)
-    set_frame_contents('R-Page number', left_page_number + 1)
-
-
-def set_single_page_number(page_number):
-    """Set the page numbers on a single page"""
-    set_frame_contents('Page number', page_number)
-
-
-def save_file(path):
-    """Save the active document to the provided path
+def save_file(path, copy=False):
+    """Save the current document to the provided path
 
     path should be a pathlib.Path object (as the path
     needs to be resolved, and .resolve() is called on it.)
+
+    If `copy` is True a copy of the document is saved, and the current
+    document is left associated with its original file.
     """
     path = path.resolve()
+    save_command = 'save a copy' if copy else 'save'
     script = f'''\
 set locked of layer "Furniture" to true
 set active layer to "Work"
-save to POSIX file "{path}"
+{save_command} to POSIX file "{path}"
 '''
-    wrap_and_run(script)
+    wrap_and_run(script, step='save_file')
+    if not copy:
+        # The document now takes the name of the file it was saved to
+        _thread_state.document = path.name
+
+
+def revert_document():
+    """Revert the current document to its last saved state"""
+    wrap_and_run('revert', step='revert_document')
 
 
 def format_file_path(edition_date, page_number, slug,
@@ -225,18 +543,48 @@ def format_file_path(edition_date, page_number, slug,
     return pages_root.joinpath(f'{str_num}_{slug}_{file_date}.indd')
 
 
-def open_master(master_file):
-    """Open the master InDesign file for page creation"""
+def open_document(path, step='open_document'):
+    """Open an InDesign file, making it the current document
+
+    Scripts run with wrap_and_run in this thread are addressed to the
+    document until it is closed.
+    """
     run_applescript(f'''
 tell application "Adobe InDesign CC 2019"
-  open POSIX file "{master_file}"
+  open POSIX file "{path}"
 end tell
-''')
+''', step=step)
+    _thread_state.document = Path(path).name
+
+
+def open_master(master_file):
+    """Open the master InDesign file for page creation"""
+    open_document(master_file, step='open_master')
 
 
 def close_active_document():
-    """Close and save the current active InDesign document"""
-    wrap_and_run('close saving yes')
+    """Close and save the current InDesign document"""
+    wrap_and_run('close saving yes', step='close_active_document')
+    _thread_state.document = None
+
+
+@contextmanager
+def master_document_open(master_file):
+    """Keep the master document open for the duration of a with block
+
+    Alerts are disabled while the master is open. Pages should be
+    created with create_from_master(..., master_open=True), which saves
+    each page as a copy and reverts the master, rather than opening and
+    closing the master file for every page.
+    """
+    set_indesign_alerts_status(enabled=False)
+    open_master(master_file)
+    try:
+        yield
+    finally:
+        wrap_and_run('close saving no', step='close_master')
+        _thread_state.document = None
+        set_indesign_alerts_status(enabled=True)
 
 
 def override_master_items(master_name, spread=False):
@@ -249,7 +597,7 @@ def override_master_items(master_name, spread=False):
             'whose item layer\'s name is "Work") destination page '
             f'page {num}\n')
     script += 'end try'
-    return wrap_and_run(script)
+    return wrap_and_run(script, step='override_master_items')
 
 
 def set_indesign_alerts_status(*, enabled: bool):
@@ -264,35 +612,738 @@ def set_indesign_alerts_status(*, enabled: bool):
     else:
         interaction_level = 'never interact'
     run_applescript(
-        'tell application "Adobe InDesign CC 2019" to set user interaction level'
-        f' of script preferences to {interaction_level}')
+        'tell application "Adobe InDesign CC 2019" to set user interaction '
+        f'level of script preferences to {interaction_level}',
+        step='set_indesign_alerts_status')
 
 
-def create_from_master(master_name: str, spread: bool, slug,
-                       edition_date: datetime, page_number: int,
-                       master_file, pages_root):
-    """Create a new working document from a master page"""
-    set_indesign_alerts_status(enabled=False)
-    open_master(master_file)
-    apply_master(master_name, spread)
+def page_frame_values(master_name: str, spread: bool,
+                      edition_date: datetime, page_number: int):
+    """Return the contents of the labelled frames of a page by label
 
+    New labelled fields are filled on every page by adding them here.
+    """
     page_date = format_page_date(edition_date)
+    values = {}
     if 'Front' in master_name:
         page_date = page_date.replace('\n', ' ')
-        set_price(edition_date)
-    set_date_on_page(page_date)
+        values['Price'] = format_price(edition_date)
+    values['Edition date'] = page_date
 
     if spread:
-        set_spread_page_numbers(page_number)
+        values['L-Page number'] = page_number
+        values['R-Page number'] = page_number + 1
     else:
-        set_single_page_number(page_number)
+        values['Page number'] = page_number
+    return values
+
+
+def fill_page_frames(master_name: str, spread: bool,
+                     edition_date: datetime, page_number: int,
+                     on_master: bool = True):
+    """Set the date, price and page numbers in the active document
+
+    If `on_master` is True the frames of the master spread are filled,
+    before its items are overridden on the page. Otherwise the frames
+    are filled wherever they are in the document.
+    """
+    set_labelled_frames(
+        page_frame_values(master_name, spread, edition_date, page_number),
+        master_name=master_name if on_master else None)
 
+
+def create_from_master(master_name: str, spread: bool, slug,
+                       edition_date: datetime, page_number: int,
+                       master_file, pages_root, batched: bool = True,
+                       master_open: bool = False):
+    """Create a new working document from a master page
+
+    If `batched` is True the steps needed to create the page are
+    compiled into a single AppleScript and run with one osascript
+    call, rather than one call per step. An error in the batch still
+    names the step that failed.
+
+    If `master_open` is True the master document must already be open
+    (see master_document_open). The page is saved as a copy and the
+    master reverted, instead of opening and closing the master file.
+
+    The master, slug, spread and page number of a PageSpec can be
+    passed with `**page.arguments()`.
+
+    Returns the path the new document is saved to.
+    """
+    if batched:
+        with collect_applescript_steps() as steps:
+            save_location = create_from_master(
+                master_name=master_name, spread=spread, slug=slug,
+                edition_date=edition_date, page_number=page_number,
+                master_file=master_file, pages_root=pages_root,
+                batched=False, master_open=master_open)
+        with tracing.span('page', page=page_number, master=master_name):
+            run_applescript_steps(steps)
+        return save_location
+
+    if not master_open:
+        set_indesign_alerts_status(enabled=False)
+        open_master(master_file)
+    apply_master(master_name, spread)
+    fill_page_frames(master_name, spread, edition_date, page_number)
     override_master_items(master_name, spread=spread)
     save_location = format_file_path(edition_date, page_number, slug, spread,
                                      pages_root)
-    save_file(path=save_location)
+    if master_open:
+        save_file(path=save_location, copy=True)
+        revert_document()
+    else:
+        save_file(path=save_location)
+        close_active_document()
+        set_indesign_alerts_status(enabled=True)
+    return save_location
+
+
+def create_snapshot(master_name: str, spread: bool, master_file,
+                    snapshot_path):
+    """Save a page with the master applied but no edition details
+
+    The master page is applied and its Work layer items overridden, as
+    in create_from_master, but the date, price and page number frames
+    are left empty. See page_cache.py.
+    """
+    with collect_applescript_steps() as steps:
+        set_indesign_alerts_status(enabled=False)
+        open_master(master_file)
+        apply_master(master_name, spread)
+        override_master_items(master_name, spread=spread)
+        save_file(path=snapshot_path)
+        close_active_document()
+        set_indesign_alerts_status(enabled=True)
+    run_applescript_steps(steps)
+
+
+def build_snapshots(page_jobs, snapshot_cache):
+    """Find or create the snapshots page_jobs need
+
+    Snapshots not in the cache are built and added to it. Every
+    snapshot found or built is in use by the cache (see
+    PageSnapshotCache), so it stays in place for the rest of the run.
+
+    Returns (snapshots, failed): a dict of the path of each snapshot by
+    (master_name, spread), and a dict of the error message of each
+    snapshot that could not be built.
+    """
+    snapshots = {}
+    failed = {}
+    for job in page_jobs:
+        key = master_name, spread = job['master_name'], job['spread']
+        if key in snapshots or key in failed:
+            continue
+        snapshot = snapshot_cache.get(master_name, spread)
+        if snapshot is None:
+            log.info('Building snapshot of %s', master_name)
+            snapshot = snapshot_cache.path_for(master_name, spread)
+            try:
+                create_snapshot(master_name, spread, job['master_file'],
+                                snapshot)
+            except AppleScriptError as exc:
+                log.error('Could not build snapshot of %s: %s',
+                          master_name, exc.message)
+                failed[key] = exc.message
+                continue
+            snapshot_cache.add(master_name, spread)
+        snapshots[key] = snapshot
+    return snapshots, failed
+
+
+def create_from_snapshot(snapshot, master_name: str, spread: bool, slug,
+                         edition_date: datetime, page_number: int,
+                         pages_root, batched: bool = True):
+    """Create a new working document by copying a page snapshot
+
+    The snapshot (see create_snapshot) is copied to the page's save
+    location, then opened so the edition details can be filled in. If
+    that fails the copy is deleted (see discard_snapshot_copies).
+
+    `batched` has the same meaning as for create_from_master.
+
+    Returns the path the new document is saved to.
+    """
+    if batched:
+        with collect_applescript_steps() as steps:
+            save_location = create_from_snapshot(
+                snapshot, master_name=master_name, spread=spread, slug=slug,
+                edition_date=edition_date, page_number=page_number,
+                pages_root=pages_root, batched=False)
+        with tracing.span('page', page=page_number, master=master_name):
+            try:
+                run_applescript_steps(steps)
+            except AppleScriptError:
+                save_location.unlink(missing_ok=True)
+                raise
+        return save_location
+
+    save_location = format_file_path(edition_date, page_number, slug, spread,
+                                     pages_root)
+    shutil.copyfile(snapshot, save_location)
+    set_indesign_alerts_status(enabled=False)
+    open_document(save_location)
+    fill_page_frames(master_name, spread, edition_date, page_number,
+                     on_master=False)
     close_active_document()
     set_indesign_alerts_status(enabled=True)
+    return save_location
+
+
+class PageResult(NamedTuple):
+    """Outcome of generating one page as part of an edition script"""
+    page_number: int
+    path: Path
+    ok: bool
+    error: str
+
+
+def discard_snapshot_copies(results):
+    """Delete the snapshot copies of the pages in results that failed
+
+    A page created from a snapshot is copied to its save location before
+    it is filled in, so without this a failed page would leave behind a
+    page that looks generated but has no edition details.
+    """
+    for result in results:
+        if not result.ok:
+            result.path.unlink(missing_ok=True)
+
+
+def discard_command(name, revert=False):
+    """Return the command closing a document without saving it
+
+    If `revert` is True the document is reverted instead of closed.
+    """
+    if revert:
+        return f'revert {document_reference(name)}'
+    return f'close {document_reference(name)} saving no'
+
+
+def compile_timed_steps(index, steps):
+    """Join (step, script) pairs, reporting how long each step took
+
+    The steps are compiled as by compile_applescript_steps, and each
+    adds a line to the page_results of an edition script (see
+    compile_edition_script) giving the index of its page and the seconds
+    between the start of the script and its start and end, negated:
+        STEP<tab>0<tab>apply_master<tab>-0.52<tab>-0.61
+    """
+    blocks = []
+    for step, script in steps:
+        blocks.append(f'''\
+set step_start to script_start's timeIntervalSinceNow()
+{compile_applescript_steps([(step, script)])}\
+set step_end to script_start's timeIntervalSinceNow()
+set step_line to "STEP" & tab & "{index}" & tab & "{step}" & tab
+set end of page_results to step_line & step_start & tab & step_end
+''')
+    return ''.join(blocks)
+
+
+def compile_edition_script(pages, master_open=False, timed=False):
+    """Compile several pages into one AppleScript reporting on each page
+
+    `pages` is a sequence of (save_location, steps, documents) tuples,
+    where steps are the (step, script) pairs collected while creating
+    the page and documents the names of the documents the page opens.
+
+    An error while creating a page is caught so that the remaining
+    pages are still generated. The page's documents that are open are
+    closed without saving, or reverted if `master_open` is True (so the
+    master stays open for the following pages). Other documents, such
+    as one the user has open, are never touched. The script returns one
+    line per page, giving its index in `pages`, where it was saved and
+    the error message and number if it failed:
+        OK<tab>0<tab>save_location<tab>
+        FAILED<tab>1<tab>save_location<tab>error message (error number)
+
+    If `timed` is True each step of a page is timed with NSDate, and
+    reports its timings before the page's line (see compile_timed_steps
+    and edition_step_times).
+    """
+    blocks = ['set page_results to {}\n']
+    if timed:
+        blocks.insert(0, '''\
+use framework "Foundation"
+use scripting additions
+set script_start to current application's NSDate's |date|()
+''')
+    for index, (save_location, steps, documents) in enumerate(pages):
+        if timed:
+            compiled_steps = compile_timed_steps(index, steps)
+        else:
+            compiled_steps = compile_applescript_steps(steps)
+        result = f'tab & "{index}" & tab & "{save_location}" & tab'
+        discards = ''.join(
+            f'''\
+try
+tell application "Adobe InDesign CC 2019"
+{discard_command(name, master_open)}
+end tell
+end try
+''' for name in documents)
+        blocks.append(f'''\
+try
+{compiled_steps}\
+set end of page_results to "OK" & {result}
+on error error_message number error_number
+set failure to error_message & " (" & error_number & ")"
+set end of page_results to "FAILED" & {result} & failure
+{discards}\
+end try
+''')
+    if not master_open:
+        blocks.append('''\
+tell application "Adobe InDesign CC 2019"
+set user interaction level of script preferences to interact with all
+end tell
+''')
+    blocks.append('''\
+set AppleScript's text item delimiters to linefeed
+return page_results as text
+''')
+    return ''.join(blocks)
+
+
+def parse_edition_results(output, pages):
+    """Turn the output of an edition script into a list of PageResult
+
+    `pages` is a sequence of (page_number, save_location) pairs in the
+    order they were compiled into the script. Pages that have no line
+    in the output (for example because the script did not compile) are
+    reported as failed with the raw output as the error.
+    """
+    statuses = {}
+    current = None
+    for line in output.splitlines():
+        # The empty error of the last line may have been stripped
+        fields = line.split('\t', 3) + ['']
+        if (len(fields) >= 4 and fields[0] in ('OK', 'FAILED')
+                and fields[1].isdigit()):
+            status, index, _, error = fields[:4]
+            current = statuses[int(index)] = [status == 'OK', error]
+        elif line.startswith('STEP\t'):
+            current = None
+        elif current is not None:
+            # Continuation of a multi-line error message
+            current[1] += '\n' + line
+
+    results = []
+    for index, (page_number, save_location) in enumerate(pages):
+        ok, error = statuses.get(
+            index, [False, f'No result returned: {output}'])
+        results.append(PageResult(page_number, save_location, ok, error))
+    return results
+
+
+def edition_step_times(output):
+    """Return the step timings reported by a timed edition script
+
+    Returns a dict of lists of (step, start, end) tuples by page index,
+    where start and end are the seconds from the start of the script.
+    """
+    times = {}
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) != 5 or fields[0] != 'STEP':
+            continue
+        try:
+            # AppleScript writes reals with the decimal separator of
+            # the user's locale
+            start, end = [-float(field.replace(',', '.'))
+                          for field in fields[3:]]
+        except ValueError:
+            continue
+        times.setdefault(int(fields[1]), []).append((fields[2], start, end))
+    return times
+
+
+def trace_edition_steps(output, page_numbers, script_start):
+    """Add spans for the pages and steps timed by an edition script
+
+    `page_numbers` are the numbers of the pages in the order they were
+    compiled into the script, and script_start is the
+    time.perf_counter() value when the script was sent. A page span is
+    only added when the script generated several pages, as otherwise
+    the span of the script is the page's.
+    """
+    for index, steps in edition_step_times(output).items():
+        page_number = page_numbers[index]
+        if len(page_numbers) > 1:
+            page_start = steps[0][1]
+            tracing.add_span('page', script_start + page_start,
+                             steps[-1][2] - page_start, page=page_number)
+        for step, start, end in steps:
+            tracing.add_span(step, script_start + start, end - start,
+                             'step', page=page_number)
+
+
+def run_edition_chunk(page_jobs, master_open=False, snapshots=None):
+    """Generate page_jobs with a single edition script
+
+    If `snapshots` is given, every page is created from its snapshot,
+    which must be in the dict of snapshot paths by (master_name, spread)
+    returned by build_snapshots. See generate_edition for the meaning
+    of the other arguments.
+
+    Returns a list of PageResult in the same order as page_jobs.
+    """
+    compiled = []
+    pages = []
+    for job in page_jobs:
+        with collect_applescript_steps() as steps:
+            if snapshots is None:
+                save_location = create_from_master(
+                    **job, batched=False, master_open=master_open)
+            else:
+                save_location = create_from_snapshot(
+                    snapshots[job['master_name'], job['spread']],
+                    batched=False,
+                    **{key: value for key, value in job.items()
+                       if key != 'master_file'})
+        # The documents the page may have open if it fails: its own, and
+        # the master it was created from
+        documents = [save_location.name]
+        if master_open:
+            documents = [Path(job['master_file']).name]
+        elif snapshots is None:
+            documents.append(Path(job['master_file']).name)
+        compiled.append((save_location, steps, documents))
+        pages.append((job['page_number'], save_location))
+    page_numbers = [page_number for page_number, _ in pages]
+    if len(page_numbers) == 1:
+        chunk_span = tracing.span('page', page=page_numbers[0])
+    else:
+        chunk_span = tracing.span('chunk', pages=page_numbers)
+    # The steps of each page are timed by the script when tracing
+    timed = tracing.get_tracer() is not None
+    with chunk_span:
+        script = compile_edition_script(compiled, master_open=master_open,
+                                        timed=timed)
+        script_start = time.perf_counter()
+        try:
+            output = run_applescript(script, step='edition')
+        except AppleScriptError:
+            if snapshots is not None:
+                for _, save_location in pages:
+                    save_location.unlink(missing_ok=True)
+            raise
+    if timed:
+        trace_edition_steps(output, page_numbers, script_start)
+    results = parse_edition_results(output, pages)
+    if snapshots is not None:
+        discard_snapshot_copies(results)
+    return results
+
+
+def generate_edition(page_jobs, chunk_size=0, master_open=False,
+                     snapshot_cache=None, retries=0, retry_delay=5.0,
+                     on_result=None):
+    """Generate pages using one AppleScript run per chunk of pages
+
+    `page_jobs` is a sequence of dicts of keyword arguments for
+    create_from_master. If chunk_size is 0 every page is compiled
+    into a single script.
+
+    If `master_open` is True the master document must already be open
+    (see master_document_open) and is used for every page.
+
+    If a PageSnapshotCache is given, any missing snapshots are built
+    first and every page is then created from its snapshot, without
+    using the master document. The pages whose snapshot could not be
+    built are reported as failed.
+
+    Pages that fail with a transient error (see RETRYABLE_ERROR_NUMBERS)
+    are retried up to `retries` times, waiting retry_delay seconds
+    before the first retry and doubling the wait for each one after.
+    An AppleScriptError for a whole chunk is retried in the same way if
+    it is transient, and raised otherwise.
+
+    `on_result` is called with each final PageResult as soon as its
+    chunk has finished.
+
+    Returns a list of PageResult in the same order as page_jobs.
+    """
+    page_jobs = list(page_jobs)
+    chunk_size = chunk_size or len(page_jobs) or 1
+    results = [None] * len(page_jobs)
+    jobs = list(enumerate(page_jobs))
+    snapshots = None
+    if snapshot_cache is not None:
+        snapshots, failed = build_snapshots(page_jobs, snapshot_cache)
+        master_open = False
+        for index, job in jobs:
+            key = job['master_name'], job['spread']
+            if key in failed:
+                error = f'build_snapshot failed: {failed[key]}'
+            elif not snapshots[key].exists():
+                error = f'Snapshot {snapshots[key]} is missing'
+            else:
+                continue
+            results[index] = PageResult(
+                job['page_number'], job_file_path(job), False, error)
+            if on_result is not None:
+                on_result(results[index])
+        jobs = [(index, job) for index, job in jobs if results[index] is None]
+    for start in range(0, len(jobs), chunk_size):
+        pending = jobs[start:start + chunk_size]
+        for attempt in range(retries + 1):
+            if attempt:
+                delay = retry_delay * 2 ** (attempt - 1)
+                log.warning('Retrying %d pages in %s seconds',
+                            len(pending), delay)
+                time.sleep(delay)
+            try:
+                chunk_results = run_edition_chunk(
+                    [job for _, job in pending], master_open=master_open,
+                    snapshots=snapshots)
+            except AppleScriptError as exc:
+                if exc.retryable and attempt < retries:
+                    continue
+                raise
+            retry = []
+            for (index, job), result in zip(pending, chunk_results):
+                if (not result.ok and attempt < retries
+                        and is_retryable_error(result.error)):
+                    retry.append((index, job))
+                    continue
+                results[index] = result
+                if on_result is not None:
+                    on_result(result)
+            pending = retry
+            if not pending:
+                break
+    return results
+
+
+def _generation_worker(backend, jobs, results, master_open, retries,
+                       on_result):
+    """Generate pages from the jobs queue with one backend
+
+    Each item in the queue is an (index, job) pair, and the PageResult
+    for the job is stored in results[index]. A None item stops the
+    worker.
+
+    If `master_open` is True the worker keeps the master document it
+    last used open between jobs, only switching when a job uses a
+    different master file.
+
+    `retries` and `on_result` are passed on to generate_edition.
+    """
+    with use_backend(backend), ExitStack() as open_master_stack:
+        open_master_file = None
+        while True:
+            item = jobs.get()
+            if item is None:
+                break
+            index, job = item
+            try:
+                if master_open and job['master_file'] != open_master_file:
+                    open_master_stack.close()
+                    open_master_file = None
+                    open_master_stack.enter_context(
+                        master_document_open(job['master_file']))
+                    open_master_file = job['master_file']
+                results[index] = generate_edition(
+                    [job], master_open=master_open, retries=retries,
+                    on_result=on_result)[0]
+            except Exception as exc:
+                results[index] = PageResult(
+                    job['page_number'], job_file_path(job), False,
+                    f'Worker failed: {exc}')
+                if on_result is not None:
+                    on_result(results[index])
+
+
+def generate_parallel(page_jobs, backends, queue_size=0, master_open=False,
+                      retries=0, on_result=None):
+    """Generate pages across several backends at once
+
+    One worker thread is started for each backend (for example one
+    persistent worker per InDesign Server instance). Jobs are passed to
+    the workers through a queue holding at most queue_size jobs (by
+    default twice the number of workers), and each job is generated as
+    a single-page edition script. `retries` and `on_result` have the
+    same meaning as for generate_edition, and on_result is called from
+    the worker threads.
+
+    Each backend is closed when its worker finishes.
+
+    Returns a list of PageResult in the same order as page_jobs.
+    """
+    page_jobs = list(page_jobs)
+    jobs = queue.Queue(maxsize=queue_size or 2 * len(backends))
+    results = [None] * len(page_jobs)
+    workers = [threading.Thread(target=_generation_worker,
+                                args=(backend, jobs, results, master_open,
+                                      retries, on_result))
+               for backend in backends]
+    for worker in workers:
+        worker.start()
+    for item in enumerate(page_jobs):
+        jobs.put(item)
+    for _ in workers:
+        jobs.put(None)
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def make_page_jobs(pages, desk, page_set_names, edition_date, master_file,
+                   pages_root):
+    """Return create_from_master keyword arguments for the chosen page sets
+
+    `pages` is the dict returned by construct_page_specifications.
+    """
+    return [
+        dict(page.arguments(),
+             edition_date=edition_date,
+             master_file=master_file,
+             pages_root=pages_root)
+        for page_set_name in page_set_names
+        for page in pages[desk][page_set_name]]
+
+
+def make_range_jobs(pages, desk, page_set_names, dates, master_file,
+                    pages_root, index=None):
+    """Return the make_page_jobs jobs for every date in dates
+
+    If page_set_names is None, the page sets for each date are looked up
+    in the page set index (see scheduled_page_sets).
+    """
+    page_jobs = []
+    for edition_date in dates:
+        if page_set_names is None:
+            names = scheduled_page_sets(index, desk, edition_date)
+            log.info('Page sets of %s scheduled for %s: %s', desk,
+                     edition_date.strftime('%Y-%m-%d'), ', '.join(names))
+        else:
+            names = page_set_names
+        page_jobs.extend(make_page_jobs(pages, desk, names, edition_date,
+                                        master_file, pages_root))
+    return page_jobs
+
+
+def plan_generation(page_jobs, chunk_size=0, master_open=False):
+    """Render the scripts generate_edition would send, without sending them
+
+    Returns (pages, scripts). `pages` is a list of dicts describing each
+    page job: its page number, master, output path and the (step,
+    script) pairs that create it. `scripts` is the list of (step,
+    script) pairs that would be sent to the backend, in order.
+    """
+    page_jobs = list(page_jobs)
+    chunk_size = chunk_size or len(page_jobs) or 1
+
+    def master_context():
+        if master_open and page_jobs:
+            return master_document_open(page_jobs[0]['master_file'])
+        return nullcontext()
+
+    pages = []
+    # The steps of each page are rendered with the master open, as they
+    # are in the scripts, so that they refer to the same document
+    with collect_applescript_steps(), master_context():
+        for job in page_jobs:
+            with collect_applescript_steps() as steps:
+                save_location = create_from_master(
+                    **job, batched=False, master_open=master_open)
+            pages.append({'page': job['page_number'],
+                          'master': job['master_name'],
+                          'path': str(save_location),
+                          'steps': steps})
+
+    with collect_applescript_steps() as scripts, master_context():
+        for start in range(0, len(page_jobs), chunk_size):
+            run_edition_chunk(page_jobs[start:start + chunk_size],
+                              master_open=master_open)
+    return pages, scripts
+
+
+def worker_commands(args):
+    """Return the command of each worker given with --worker_command
+
+    Several workers cannot share one InDesign, so the program exits
+    unless there is a command for each of --workers (or there is a
+    single worker and no command, which uses the default worker).
+    """
+    commands = [shlex.split(command) for command in args['--worker_command']]
+    count = int(args['--workers'])
+    if (count > 1 or commands) and len(commands) != count:
+        log.critical('--workers=%s needs a --worker_command for each worker, '
+                     'each driving its own InDesign instance (%s given).',
+                     count, len(commands))
+        sys.exit(1)
+    return commands
+
+
+def generation_mode(args):
+    """Name the way pages are generated, for recording run timings"""
+    if int(args['--workers']) > 1:
+        return 'parallel'
+    if args['--snapshot_cache']:
+        return 'snapshot'
+    if args['--open_master_once']:
+        return 'master_once'
+    return 'edition'
+
+
+def load_run_timings(pages_root):
+    """Return the timings of earlier runs in the pages directory
+
+    The timings are a dict of generation mode (see generation_mode) to
+    the total number of pages generated and seconds taken.
+    """
+    try:
+        return json.loads(pages_root.joinpath(TIMINGS_FILE).read_text(
+            encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def record_run_timing(pages_root, mode, page_count, seconds):
+    """Add the time taken to generate page_count pages to the timings"""
+    timings = load_run_timings(pages_root)
+    totals = timings.setdefault(mode, {'pages': 0, 'seconds': 0.0})
+    totals['pages'] += page_count
+    totals['seconds'] += seconds
+    pages_root.mkdir(parents=True, exist_ok=True)
+    pages_root.joinpath(TIMINGS_FILE).write_text(
+        json.dumps(timings, indent=2), encoding='utf-8')
+
+
+def job_spec_hash(job):
+    """Return the manifest specification hash for a page job"""
+    return page_spec_hash(job['master_name'], job['slug'], job['spread'],
+                          job['page_number'], job['edition_date'])
+
+
+def job_file_path(job):
+    """Return the path a page job will be saved to"""
+    return format_file_path(job['edition_date'], job['page_number'],
+                            job['slug'], job['spread'], job['pages_root'])
+
+
+def split_current_jobs(page_jobs, manifest, master_fingerprint):
+    """Separate page jobs that need generating from those up to date
+
+    A job is up to date if its file exists and the manifest shows it was
+    generated from the same specification and master file.
+
+    Returns two lists: (jobs to generate, jobs up to date).
+    """
+    to_generate, up_to_date = [], []
+    for job in page_jobs:
+        if manifest.is_current(job_file_path(job), job_spec_hash(job),
+                               master_fingerprint):
+            up_to_date.append(job)
+        else:
+            to_generate.append(job)
+    return to_generate, up_to_date
 
 
 def load_masters_json(masters_file='masters.json'):
@@ -302,34 +1353,266 @@ def load_masters_json(masters_file='masters.json'):
     return masters
 
 
-def load_generators_json(pages_file='pages.json'):
-    """Load a JSON file showing the page sets available to be generated"""
+def load_generators_json(pages_file='pages.json',
+                         journal_file=specials.JOURNAL_FILE):
+    """Load a JSON file showing the page sets available to be generated
+
+    Page sets with rules for the dates they are used are returned as
+    their plain list of pages. See split_page_set_rules. Specials added
+    to the journal since it was last compacted are included.
+    """
+    journal_specials = specials.read_journal(APP_DIR.joinpath(journal_file))
     with open(APP_DIR.joinpath(pages_file)) as json_file:
         pages = json.load(json_file)
-    return pages
+    if journal_specials:
+        pages.setdefault(specials.DESK, {}).update(journal_specials)
+    return split_page_set_rules(pages)[0]
+
+
+def parse_weekday(name):
+    """Return the number of a weekday (Monday is 0) from its name
+
+    Full names and three-letter abbreviations are accepted, in any case.
+    Raises ValueError for anything else.
+    """
+    day = name.strip().lower()
+    for number, weekday in enumerate(WEEKDAYS):
+        if day in (weekday, weekday[:3]):
+            return number
+    raise ValueError(f'Unknown weekday {name!r}')
+
+
+def split_page_set_rules(pages_dict):
+    """Separate the pages of each page set from the rules for its dates
+
+    A page set in pages.json is either a list of pages, or a dict of
+    the list of pages with rules for when the page set is used:
+        {"days": ["Mon", "Tue"], "dates": ["2018-12-24"], "pages": [...]}
+
+    Returns (pages, index). `pages` has every page set as its list of
+    pages. `index` maps each desk to a dict whose keys are weekday
+    numbers (Monday is 0) and ISO format dates, and whose values are
+    the names of the page sets used on that weekday or date, in the
+    order they appear in pages_dict. Page sets without rules are never
+    in the index.
+
+    Raises ValueError if a rule names an unknown weekday or a date not
+    in YYYY-MM-DD format.
+    """
+    pages, index = {}, {}
+    for desk, page_sets in pages_dict.items():
+        pages[desk], index[desk] = {}, {}
+        for name, page_set in page_sets.items():
+            if isinstance(page_set, list):
+                pages[desk][name] = page_set
+                continue
+            pages[desk][name] = page_set['pages']
+            keys = [parse_weekday(day) for day in page_set.get('days', [])]
+            for date in page_set.get('dates', []):
+                keys.append(datetime.strptime(date, '%Y-%m-%d')
+                            .strftime('%Y-%m-%d'))
+            for key in keys:
+                index[desk].setdefault(key, []).append(name)
+    return pages, index
+
+
+def scheduled_page_sets(index, desk, edition_date):
+    """Return the names of the page sets of desk used on edition_date
+
+    `index` is the page set index from load_page_specifications (see
+    split_page_set_rules).
+    """
+    rules = index.get(desk, {})
+    names = rules.get(edition_date.weekday(), [])
+    dated = rules.get(edition_date.strftime('%Y-%m-%d'), [])
+    return names + [name for name in dated if name not in names]
 
 
 def construct_page_specifications(pages_dict, masters_dict):
-    """Construct dict by adding details from masters to page instructions
+    """Construct page specifications from the pages and masters dicts
 
     The pages dict only contains the name of the master to use and the
     page number, which is not enough to generate the page. This function
-    fills in the needed details from the masters dict.
+    joins each page to the details of its master from the masters dict.
 
     This allows the file containing the page-generating instructions
     to be kept reasonably clear, allowing for easier editing, and
     removes repetition.
+
+    Returns a dict of desks, each a dict of page sets, each a tuple of
+    PageSpec. Pages using the same master share its MasterSpec.
+
+    Raises ValueError if a page uses a master not in masters_dict.
     """
-    detailed_dict = copy.deepcopy(pages_dict)
-    for desk in detailed_dict:
-        for page_list in detailed_dict[desk].values():
+    masters = master_specs(masters_dict)
+    detailed_dict = {}
+    for desk, page_sets in pages_dict.items():
+        detailed_dict[desk] = {}
+        for page_set_name, page_list in page_sets.items():
+            detailed_pages = []
             for page in page_list:
-                master = masters_dict[page['master']]
-                page['slug'] = master['slug']
-                page['spread'] = master['spread']
+                if page['master'] not in masters:
+                    raise ValueError(
+                        f'Page {page["page"]} of {desk} page set '
+                        f'{page_set_name!r} uses unknown master '
+                        f'{page["master"]!r}')
+                detailed_pages.append(PageSpec(page['page'],
+                                               masters[page['master']]))
+            detailed_dict[desk][page_set_name] = tuple(detailed_pages)
     return detailed_dict
 
 
+def compile_page_specifications(pages_file, masters_file, cache_file):
+    """Return (pages, index) for load_page_specifications
+
+    The page specifications, with every page resolved to its master's
+    slug and spread, and the page set index are kept in cache_file
+    with the size, modification time and hash of the files they came
+    from, and are loaded from there if the files are unchanged. A file
+    whose modification time has changed but whose contents have not
+    does not invalidate the cache.
+
+    The cache is only an optimisation: if it cannot be read or written
+    the specifications are compiled from the files.
+    """
+    sources = {path.name: path for path in [pages_file, masters_file]}
+    try:
+        cached = json.loads(cache_file.read_text(encoding='utf-8'))
+        if (cached['version'] != SPECIFICATIONS_CACHE_VERSION
+                or cached['sources'].keys() != sources.keys()):
+            cached = None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        cached = None
+
+    if cached is not None:
+        fingerprints = cached['sources']
+        touched = False
+        for name, path in sources.items():
+            stat = path.stat()
+            if (stat.st_size, stat.st_mtime_ns) != (
+                    fingerprints[name]['size'], fingerprints[name]['mtime']):
+                fingerprint = file_fingerprint(path)
+                if fingerprint['sha256'] != fingerprints[name]['sha256']:
+                    break
+                fingerprints[name] = fingerprint
+                touched = True
+        else:
+            pages = _specifications_from_rows(cached['pages'])
+            # JSON objects only have string keys, so the index is kept as
+            # lists of (weekday number or date, page set names) pairs
+            index = {desk: dict(items)
+                     for desk, items in cached['index'].items()}
+            if touched:
+                _write_specifications_cache(cache_file, fingerprints, pages,
+                                            index)
+            return pages, index
+
+    fingerprints = {name: file_fingerprint(path)
+                    for name, path in sources.items()}
+    with open(pages_file) as json_file:
+        pages, index = split_page_set_rules(json.load(json_file))
+    with open(masters_file) as json_file:
+        masters = json.load(json_file)
+    pages = construct_page_specifications(pages, masters)
+    _write_specifications_cache(cache_file, fingerprints, pages, index)
+    return pages, index
+
+
+def _specifications_from_rows(rows):
+    """Rebuild construct_page_specifications' dict from cached rows
+
+    Each page set is cached as a list of (page number, master name,
+    slug, spread) rows.
+    """
+    masters = {}
+    pages = {}
+    for desk, page_sets in rows.items():
+        pages[desk] = {}
+        for page_set_name, page_rows in page_sets.items():
+            page_set = []
+            for number, master_name, slug, spread in page_rows:
+                master = masters.get(master_name)
+                if master is None:
+                    master = masters[master_name] = MasterSpec(
+                        master_name, slug, spread)
+                page_set.append(PageSpec(number, master))
+            pages[desk][page_set_name] = tuple(page_set)
+    return pages
+
+
+def _write_specifications_cache(cache_file, fingerprints, pages, index):
+    rows = {desk: {page_set_name: [[page.number, page.master_name,
+                                    page.slug, page.spread]
+                                   for page in page_set]
+                   for page_set_name, page_set in page_sets.items()}
+            for desk, page_sets in pages.items()}
+    cached = {'version': SPECIFICATIONS_CACHE_VERSION,
+              'sources': fingerprints,
+              'pages': rows,
+              'index': {desk: list(rules.items())
+                        for desk, rules in index.items()}}
+    try:
+        write_atomically(cache_file, json.dumps(cached))
+    except OSError as exc:
+        log.warning('Could not write page specifications cache: %s', exc)
+
+
+def load_page_specifications(pages_file='pages.json',
+                             masters_file='masters.json',
+                             cache_file=SPECIFICATIONS_CACHE_FILE,
+                             journal_file=specials.JOURNAL_FILE):
+    """Return (pages, index) built from the pages and masters files
+
+    `pages` is the dict of construct_page_specifications and `index` the
+    page set index (see split_page_set_rules). Both are kept in memory
+    and reused until either file or the specials journal changes, so
+    they must not be modified (the PageSpecs themselves cannot be).
+    Between runs they are kept compiled in cache_file (see
+    compile_page_specifications).
+
+    Specials added to the journal since it was last compacted are added
+    to the Specials desk (see specials.py).
+    """
+    paths = [APP_DIR.joinpath(pages_file), APP_DIR.joinpath(masters_file)]
+    journal = APP_DIR.joinpath(journal_file)
+    key = tuple((str(path), path.stat().st_mtime_ns, path.stat().st_size)
+                for path in paths)
+    try:
+        key += ((str(journal), journal.stat().st_mtime_ns,
+                 journal.stat().st_size),)
+    except FileNotFoundError:
+        pass
+    if key not in _specifications:
+        # The journal is read before pages.json: compacting it writes its
+        # specials to pages.json before emptying it, so none are missed
+        journal_specials = specials.read_journal(journal)
+        pages, index = compile_page_specifications(
+            *paths, APP_DIR.joinpath(cache_file))
+        if journal_specials:
+            added = construct_page_specifications(
+                {specials.DESK: journal_specials},
+                load_masters_json(masters_file))
+            pages = {**pages, specials.DESK: {**pages.get(specials.DESK, {}),
+                                              **added[specials.DESK]}}
+        _specifications.clear()
+        _specifications[key] = pages, index
+    return _specifications[key]
+
+
+def add_archived_specials(pages, archive_dir=specials.ARCHIVE_DIR,
+                          masters_file='masters.json'):
+    """Return pages with the archived specials added to the Specials desk
+
+    `pages` is the dict of construct_page_specifications, which is left
+    unchanged. See specials.load_archived_specials.
+    """
+    archived = specials.load_archived_specials(APP_DIR.joinpath(archive_dir))
+    archived = construct_page_specifications(
+        {specials.DESK: archived}, load_masters_json(masters_file))
+    return {**pages, specials.DESK: {**archived[specials.DESK],
+                                     **pages.get(specials.DESK, {})}}
+
+
 def wrap_seq_for_applescript(seq):
     """Wrap a Python sequence in braces and quotes for use in AppleScript"""
     quoted = [f'"{item}"' for item in seq]
@@ -379,12 +1662,15 @@ def prompt_for_text_input(message, default=''):
     If the user cancels the dialog this function will exit the program
     using sys.exit
     """
-    result = run_applescript(f'''\
+    try:
+        result = run_applescript(f'''\
 tell application "Adobe InDesign CC 2019"
   display dialog "{message}" default answer "{default}"
 end tell
 ''')
-    if 'execution error: User canceled. (-128)' in result:
+    except AppleScriptError as exc:
+        if exc.number != -128:
+            raise
         log.debug('User cancelled text input')
         sys.exit()
     return result.split('text returned:')[-1]
@@ -408,38 +1694,411 @@ def prompt_for_date(offset=1):
     return datetime.strptime(date_match.group(1), '%Y-%m-%d')
 
 
-def main():
-    args = docopt(__doc__)
+def main(argv=None, backend=None):
+    """Run the page generator with the command line arguments argv
 
-    pages_root = Path(args['--pages_dir']).expanduser().resolve()
-    master_file = Path(args['--master']).expanduser().resolve()
+    If a backend is given it is used, and left open, instead of starting
+    a new one (see gen_daemon.py). A single --worker_command cannot be
+    used with it, as the command's worker would never be started.
+    """
+    args = docopt(__doc__, argv=argv)
+    if args['--plan']:
+        print(json.dumps(plan(args), indent=2, ensure_ascii=False))
+        return
+    commands = worker_commands(args)
+    if backend is not None and len(commands) == 1:
+        log.critical('--worker_command cannot be used with a running '
+                     'backend, such as the daemon\'s.')
+        sys.exit(1)
+    close_backend = backend is None
+    if backend is None and len(commands) == 1:
+        backend = WorkerBackend(commands[0])
+    elif backend is None:
+        backend = WorkerBackend() if args['--worker'] else OsascriptBackend()
+    tracer = tracing.Tracer() if args['--trace'] else None
+    recorder = None
+    if args['--record']:
+        recorder = session.SessionRecorder(args['--record'], argv=argv)
+    try:
+        with use_backend(backend, close=close_backend):
+            with tracing.use_tracer(tracer), session.use_recorder(recorder):
+                generate(args)
+    finally:
+        if tracer is not None:
+            tracer.write(args['--trace'])
+        if recorder is not None:
+            recorder.close()
 
-    masters = load_masters_json()
-    pages = load_generators_json()
-    pages = construct_page_specifications(pages, masters)
 
-    desk = prompt_for_list_selection(pages, prompt='Choose a desk')[0]
-    date = prompt_for_date()
+def parse_date_argument(date_string):
+    """Return a datetime for an ISO format date given on the command line
+
+    Exits the program if the date is not in YYYY-MM-DD format.
+    """
+    try:
+        return datetime.strptime(date_string, '%Y-%m-%d')
+    except ValueError:
+        log.critical('Could not understand date %s. Use YYYY-MM-DD.',
+                     date_string)
+        sys.exit(1)
+
 
+def edition_dates(start, until=None):
+    """Return the list of dates from start to until, inclusive
+
+    until is an ISO format date string from the command line, or None
+    for start alone. Exits the program if until is before start.
+    """
+    if until is None:
+        return [start]
+    end = parse_date_argument(until)
+    if end < start:
+        log.critical('Date range ends on %s, before it starts on %s.',
+                     until, start.strftime('%Y-%m-%d'))
+        sys.exit(1)
+    return [start + timedelta(days)
+            for days in range((end - start).days + 1)]
+
+
+def summarise_by_date(page_jobs, results):
+    """Return {date: {'generated': n, 'failed': n, 'skipped': n}}
+
+    Dates are ISO format strings, in the order of page_jobs. Jobs
+    without a result were skipped, as they were up to date or already
+    generated by the run being resumed.
+    """
+    job_dates = {job_file_path(job): job['edition_date'].strftime('%Y-%m-%d')
+                 for job in page_jobs}
+    summary = {date: {'generated': 0, 'failed': 0, 'skipped': 0}
+               for date in job_dates.values()}
+    for result in results:
+        counts = summary[job_dates.pop(Path(result.path))]
+        counts['generated' if result.ok else 'failed'] += 1
+    for date in job_dates.values():
+        summary[date]['skipped'] += 1
+    return summary
+
+
+def check_page_sets(pages, desk, page_set_names):
+    """Exit the program if the desk or any of the page sets is unknown"""
+    if desk not in pages:
+        log.critical('There is no desk called %s. Choose from: %s',
+                     desk, ', '.join(pages))
+        sys.exit(1)
+    unknown = [name for name in page_set_names if name not in pages[desk]]
+    if unknown:
+        log.critical('%s has no page sets called: %s',
+                     desk, ', '.join(unknown))
+        sys.exit(1)
+
+
+def choose_edition(args, pages):
+    """Return the (desk, date, page set names) to generate
+
+    Details given with --desk, --date and --set are used as they are.
+    The user is asked for any that are missing. With --scheduled the
+    page set names are None, as they depend on the date.
+    """
+    if args['--desk']:
+        desk = args['--desk']
+    else:
+        desk = prompt_for_list_selection(pages, prompt='Choose a desk')[0]
+    check_page_sets(pages, desk, args['--set'])
+
+    if args['--date']:
+        date = parse_date_argument(args['--date'])
+    else:
+        date = prompt_for_date()
+
+    if args['--set']:
+        return desk, date, args['--set']
+    if args['--scheduled']:
+        return desk, date, None
     try:
         to_generate = prompt_for_list_selection(
             pages[desk],
             prompt='Choose pages to generate. Select multiple with ⌘.',
             multiple_selections=True)
     except ValueError as exc:
-        log.critical('Malformed page set name. Cannot continue.', exc_info=exc)
+        log.critical('Malformed page set name. Cannot continue.',
+                     exc_info=exc)
         sys.exit()
+    return desk, date, to_generate
 
-    for page_set_name in to_generate:
-        for page in pages[desk][page_set_name]:
-            create_from_master(
-                master_name=page['master'],
-                spread=page['spread'],
-                slug=page['slug'],
-                page_number=page['page'],
-                edition_date=date,
-                master_file=master_file,
-                pages_root=pages_root)
+
+def plan(args):
+    """Return the plan for generating the chosen page sets
+
+    Without --desk every desk is planned, and without --set every page
+    set of the desk, or with --scheduled the page sets whose rules match
+    the date. The date defaults to tomorrow. With --until every date of
+    the range is planned.
+
+    Nothing is sent to InDesign. Pages the manifest shows are already up
+    to date are marked as such (unless --force is given) and are left
+    out of the scripts and the estimate.
+    """
+    pages_root = Path(args['--pages_dir']).expanduser().resolve()
+    master_file = Path(args['--master']).expanduser().resolve()
+    if args['--date']:
+        date = parse_date_argument(args['--date'])
+    else:
+        date = datetime.today() + timedelta(1)
+    dates = edition_dates(date, args['--until'])
+
+    pages, index = load_page_specifications()
+    if args['--archived']:
+        pages = add_archived_specials(pages)
+    if args['--desk']:
+        check_page_sets(pages, args['--desk'], args['--set'])
+        desks = [args['--desk']]
+    else:
+        # Without --desk, --set names the page sets of whichever desks
+        # have them
+        desks = [desk for desk in pages
+                 if all(name in pages[desk] for name in args['--set'])]
+        if not desks:
+            log.critical('No desk has page sets called: %s',
+                         ', '.join(args['--set']))
+            sys.exit(1)
+    page_jobs = []
+    for desk in desks:
+        if args['--scheduled']:
+            page_set_names = None
+        else:
+            page_set_names = args['--set'] or list(pages[desk])
+        page_jobs.extend(make_range_jobs(pages, desk, page_set_names, dates,
+                                         master_file, pages_root, index))
+    up_to_date = []
+    if not args['--force'] and master_file.exists():
+        manifest = GenerationManifest(pages_root)
+        page_jobs, up_to_date = split_current_jobs(
+            page_jobs, manifest,
+            file_fingerprint(master_file, manifest.master_fingerprints()))
+
+    master_open = args['--open_master_once']
+    planned_pages, scripts = plan_generation(
+        page_jobs, chunk_size=int(args['--chunk_size']),
+        master_open=master_open)
+
+    mode = generation_mode(args)
+    history = load_run_timings(pages_root).get(mode)
+    if history and history['pages']:
+        seconds = history['seconds'] / history['pages'] * len(page_jobs)
+    else:
+        seconds = None
+    return {
+        'date': date.strftime('%Y-%m-%d'),
+        'dates': [edition_date.strftime('%Y-%m-%d') for edition_date in dates],
+        'master': str(master_file),
+        'mode': mode,
+        'pages': [
+            dict(page, steps=[{'step': step, 'script': script}
+                              for step, script in page['steps']])
+            for page in planned_pages],
+        'up_to_date': [str(job_file_path(job)) for job in up_to_date],
+        'scripts': [{'step': step, 'script': script}
+                    for step, script in scripts],
+        'estimate': {
+            'pages': len(page_jobs),
+            'backend_calls': len(scripts),
+            'script_bytes': sum(len(script.encode('utf-8'))
+                                for _, script in scripts),
+            'seconds': seconds,
+            'history': history,
+        },
+    }
+
+
+def generate(args):
+    """Generate the pages chosen on the command line or by the user"""
+
+    pages_root = Path(args['--pages_dir']).expanduser().resolve()
+    master_file = Path(args['--master']).expanduser().resolve()
+    commands = worker_commands(args)
+
+    pages, index = load_page_specifications()
+    if args['--archived']:
+        pages = add_archived_specials(pages)
+
+    journal = RunJournal(pages_root)
+    if args['--resume']:
+        run, completed, finished = journal.last_run()
+        if run is None or finished:
+            log.critical('There is no unfinished run to resume.')
+            sys.exit(1)
+        desk, to_generate = run['desk'], run['sets']
+        if run.get('archived') and not args['--archived']:
+            pages = add_archived_specials(pages)
+        date = datetime.strptime(run['date'], '%Y-%m-%d')
+        dates = edition_dates(date, run.get('until'))
+        log.info('Resuming %s pages for %s to %s', desk, run['date'],
+                 run.get('until', run['date']))
+    else:
+        desk, date, to_generate = choose_edition(args, pages)
+        dates = edition_dates(date, args['--until'])
+        completed = set()
+        # The page sets are None when they are scheduled by date
+        run = {'desk': desk, 'date': date.strftime('%Y-%m-%d'),
+               'sets': to_generate}
+        if args['--until']:
+            run['until'] = dates[-1].strftime('%Y-%m-%d')
+        if args['--archived']:
+            run['archived'] = True
+        journal.start(run)
+
+    # Jobs for every date go to the same backend (and open master), so
+    # the setup is paid once for the whole range
+    page_jobs = make_range_jobs(pages, desk, to_generate, dates, master_file,
+                                pages_root, index)
+    all_jobs = page_jobs
+
+    # The master is only hashed if it has changed since it was last
+    # fingerprinted, as it can be large
+    manifest = GenerationManifest(pages_root)
+    snapshot_cache = None
+    if args['--snapshot_cache']:
+        snapshot_cache = PageSnapshotCache(
+            Path(args['--snapshot_cache']).expanduser(), master_file,
+            max_entries=int(args['--snapshot_cache_size']))
+        master_fingerprint = snapshot_cache.fingerprint
+    else:
+        master_fingerprint = file_fingerprint(
+            master_file, manifest.master_fingerprints())
+
+    if not args['--force']:
+        page_jobs, up_to_date = split_current_jobs(page_jobs, manifest,
+                                                   master_fingerprint)
+        for job in up_to_date:
+            log.info('Page %s is up to date: %s', job['page_number'],
+                     job_file_path(job))
+    if completed:
+        page_jobs = [job for job in page_jobs
+                     if job_file_path(job).name not in completed
+                     or not job_file_path(job).exists()]
+
+    spec_hashes = {job_file_path(job): job_spec_hash(job)
+                   for job in page_jobs}
+
+    # Results are kept as they are recorded so that the run's metrics
+    # can be written even if a fatal error stops it
+    recorded = {}
+
+    def record_result(result):
+        recorded[Path(result.path).name] = result
+        journal.record(result)
+        if result.ok:
+            manifest.record(result.path, spec_hashes[result.path],
+                            master_fingerprint)
+
+    # With a scratch directory pages are saved there and uploaded to
+    # pages_root in the background, and only recorded once uploaded
+    generation_jobs, on_result, uploader = page_jobs, record_result, None
+    if args['--scratch_dir']:
+        scratch_root = Path(args['--scratch_dir']).expanduser().resolve()
+        generation_jobs = [dict(job, pages_root=scratch_root)
+                           for job in page_jobs]
+        uploaded_results = {}
+
+        def upload_result(result):
+            final = result._replace(
+                path=pages_root.joinpath(Path(result.path).name))
+            uploaded_results[final.path.name] = final
+            if result.ok:
+                uploader.upload(result.path)
+            else:
+                record_result(final)
+
+        def record_upload(source, destination, error):
+            final = uploaded_results[destination.name]
+            if error is not None:
+                final = final._replace(ok=False,
+                                       error=f'Upload failed: {error}')
+                uploaded_results[destination.name] = final
+            record_result(final)
+
+        uploader = PageUploader(pages_root, on_uploaded=record_upload)
+        on_result = upload_result
+
+    retries = int(args['--retries'])
+    chunk_size = int(args['--chunk_size'])
+    if args['--scratch_dir']:
+        # Each page is uploaded as soon as its own script has finished,
+        # while the following pages are generated
+        chunk_size = 1
+    master_open = args['--open_master_once'] and snapshot_cache is None
+    # Metrics are collected from the spans of the run
+    tracer = tracing.get_tracer()
+    if args['--metrics'] and tracer is None:
+        tracer = tracing.Tracer()
+
+    start = time.perf_counter()
+    run_span = tracing.span(
+        'run', desk=desk, mode=generation_mode(args), pages=len(page_jobs),
+        dates=[edition_date.strftime('%Y-%m-%d') for edition_date in dates])
+    results = None
+    try:
+        with tracing.use_tracer(tracer), run_span:
+            try:
+                if not page_jobs:
+                    results = []
+                elif len(commands) > 1:
+                    results = generate_parallel(
+                        generation_jobs,
+                        [WorkerBackend(command) for command in commands],
+                        master_open=args['--open_master_once'],
+                        retries=retries, on_result=on_result)
+                else:
+                    with (master_document_open(master_file) if master_open
+                          else nullcontext()):
+                        results = generate_edition(
+                            generation_jobs, chunk_size=chunk_size,
+                            master_open=master_open,
+                            snapshot_cache=snapshot_cache, retries=retries,
+                            on_result=on_result)
+            finally:
+                if uploader is not None:
+                    uploader.finish()
+                manifest.save()
+    finally:
+        if uploader is not None and results is not None:
+            results = [uploaded_results[Path(result.path).name]
+                       for result in results]
+        elif results is None:
+            # The run stopped early: pages without a result are failed
+            results = [
+                recorded.get(job_file_path(job).name)
+                or PageResult(job['page_number'], job_file_path(job), False,
+                              'Not generated: the run stopped early')
+                for job in page_jobs]
+        if page_jobs:
+            record_run_timing(pages_root, generation_mode(args),
+                              len(page_jobs), time.perf_counter() - start)
+        if args['--metrics']:
+            run_event = [event for event in tracer.events
+                         if event['name'] == 'run'][-1]
+            write_run_metrics(args['--metrics'], collect_run_metrics(
+                tracer.events, run_event, results,
+                len(all_jobs) - len(page_jobs), desk=desk,
+                mode=generation_mode(args)))
+
+    for result in results:
+        if result.ok:
+            log.info('Generated page %s: %s', result.page_number, result.path)
+        else:
+            log.error('Failed to generate page %s: %s',
+                      result.page_number, result.error)
+    if len(dates) > 1:
+        for edition_date, counts in summarise_by_date(all_jobs,
+                                                      results).items():
+            log.info('%s: %d pages generated, %d failed, %d skipped',
+                     edition_date, counts['generated'], counts['failed'],
+                     counts['skipped'])
+    if not all(result.ok for result in results):
+        log.critical('Some pages could not be generated. '
+                     'Run again with --resume to retry them.')
+        sys.exit(1)
+    journal.finish()
 
 
 if __name__ == '__main__':
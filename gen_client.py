@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Page Generator Client
+
+Usage:
+    gen_client.py [gen.py arguments...]
+
+Passes its arguments to a running page generator daemon (gen_daemon.py)
+and prints what the daemon reports, exiting with the generator's exit
+status. If no daemon is running, gen.py is run directly instead.
+
+The daemon's socket is PAGE_GENERATOR_SOCKET from the environment, or
+DEFAULT_SOCKET.
+
+This script only uses the standard library and does not import gen.py,
+so that it starts quickly.
+"""
+
+import json
+import os
+from pathlib import Path
+import socket
+import sys
+
+DEFAULT_SOCKET = f'/tmp/page-generator-{os.getuid()}.sock'
+
+APP_DIR = Path(__file__).parent
+
+
+def socket_path():
+    """Return the path of the daemon's Unix socket"""
+    return os.environ.get('PAGE_GENERATOR_SOCKET', DEFAULT_SOCKET)
+
+
+def send_request(path, argv, cwd, stdout=None, stderr=None):
+    """Ask the daemon listening on path to run gen.py with argv
+
+    Relative paths in argv are taken relative to cwd. Output from the
+    generator is written to stdout and stderr as it arrives.
+
+    Returns the generator's exit status. Raises OSError if the daemon
+    cannot be reached.
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(path))
+        try:
+            with client.makefile('rwb') as connection:
+                request = {'argv': list(argv), 'cwd': str(cwd)}
+                connection.write(json.dumps(request).encode('utf-8') + b'\n')
+                connection.flush()
+                for line in connection:
+                    message = json.loads(line)
+                    if 'exit' in message:
+                        return message['exit']
+                    stream = (stdout if message['stream'] == 'stdout'
+                              else stderr)
+                    stream.write(message['text'])
+                    stream.flush()
+        except OSError:
+            pass
+    stderr.write('The page generator daemon stopped before finishing.\n')
+    return 1
+
+
+def main():
+    argv = sys.argv[1:]
+    try:
+        status = send_request(socket_path(), argv, os.getcwd())
+    except OSError:
+        gen_script = str(APP_DIR.joinpath('gen.py'))
+        os.execv(sys.executable, [sys.executable, gen_script] + argv)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Page Generator Daemon
+
+Usage:
+    gen_daemon.py [--socket=PATH] [--worker]
+
+Options:
+    --socket=PATH   Unix socket to listen on. The default is the socket
+                    gen_client.py connects to (see gen_client.socket_path).
+    --worker        Run all AppleScript in one persistent worker process,
+                    kept running between requests and started again if
+                    it exits.
+
+Stays resident with gen.py imported, the page specifications loaded and
+an AppleScript backend ready, and runs generation requests from
+gen_client.py one at a time. Each request is the gen.py command line
+arguments and the client's working directory. The generator's output
+and log are sent back to the client as they are produced.
+
+The page specifications are loaded again only when pages.json,
+masters.json or the specials journal change (see
+gen.load_page_specifications).
+"""
+
+from contextlib import redirect_stdout
+import json
+import logging
+import os
+from pathlib import Path
+import socketserver
+
+from docopt import docopt
+
+from backends import OsascriptBackend, WorkerBackend
+import gen
+import gen_client
+
+
+class _ClientStream:
+    """File-like object sending text written to it to the client"""
+
+    def __init__(self, connection, stream):
+        self.connection = connection
+        self.stream = stream
+
+    def write(self, text):
+        message = {'stream': self.stream, 'text': text}
+        try:
+            self.connection.write(json.dumps(message).encode('utf-8') + b'\n')
+            self.connection.flush()
+        except OSError:
+            # The client has gone away. Generation carries on regardless.
+            pass
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def run_request(argv, backend, cwd=None):
+    """Run gen.main with argv and backend, returning the exit status
+
+    If cwd is given the generator is run in that directory, so that
+    relative paths in argv are those the client meant.
+    """
+    try:
+        if cwd is not None:
+            os.chdir(cwd)
+        gen.main(argv, backend=backend)
+    except SystemExit as exc:
+        if exc.code is None or isinstance(exc.code, int):
+            return exc.code or 0
+        # docopt exits with the usage message for bad arguments
+        gen.log.critical(exc.code)
+        return 1
+    except Exception as exc:
+        gen.log.critical('Encountered exception while executing main '
+                         'function.', exc_info=exc)
+        return 1
+    return 0
+
+
+class GenerationHandler(socketserver.StreamRequestHandler):
+    """Run one generation request from gen_client.send_request"""
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        stdout = _ClientStream(self.wfile, 'stdout')
+        log_handler = logging.StreamHandler(_ClientStream(self.wfile,
+                                                          'stderr'))
+        log_handler.setFormatter(logging.root.handlers[0].formatter)
+        logging.root.addHandler(log_handler)
+        try:
+            with redirect_stdout(stdout):
+                status = run_request(request['argv'], self.server.backend,
+                                     request.get('cwd'))
+        finally:
+            logging.root.removeHandler(log_handler)
+            os.chdir(self.server.home)
+        try:
+            self.wfile.write(json.dumps({'exit': status}).encode('utf-8')
+                             + b'\n')
+        except OSError:
+            pass
+
+
+class GenerationServer(socketserver.UnixStreamServer):
+    """Serve generation requests on a Unix socket with one backend"""
+
+    def __init__(self, path, backend):
+        self.path = Path(path)
+        self.path.unlink(missing_ok=True)
+        super().__init__(str(self.path), GenerationHandler)
+        self.path.chmod(0o600)
+        self.backend = backend
+        self.home = os.getcwd()
+
+    def server_close(self):
+        super().server_close()
+        self.path.unlink(missing_ok=True)
+
+
+def main():
+    args = docopt(__doc__)
+    path = args['--socket'] or gen_client.socket_path()
+    backend = WorkerBackend() if args['--worker'] else OsascriptBackend()
+    # Load the specifications now rather than on the first request
+    gen.load_page_specifications()
+    with gen.use_backend(backend), GenerationServer(path, backend) as server:
+        gen.log.info('Page generator daemon listening on %s', path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
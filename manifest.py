@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Manifest of generated pages
+
+The manifest is kept as a JSON file in the pages directory. For each
+file generated it records a hash of the page specification (master,
+slug, spread, page number and date) and the fingerprint of the master
+file it was generated from (see page_cache.file_fingerprint).
+
+A page whose file exists and whose manifest entry matches the current
+specification and master file is up to date and need not be generated
+again.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+from files import write_atomically
+
+MANIFEST_FILE = '.generation-manifest.json'
+
+
+def page_spec_hash(master_name, slug, spread, page_number, edition_date):
+    """Return a hash identifying the specification of a page"""
+    spec = json.dumps([master_name, slug, bool(spread), page_number,
+                       edition_date.strftime('%Y-%m-%d')])
+    return hashlib.sha256(spec.encode('utf-8')).hexdigest()
+
+
+class GenerationManifest:
+    """Manifest of the pages generated in one pages directory"""
+
+    def __init__(self, pages_root):
+        self.path = Path(pages_root).joinpath(MANIFEST_FILE)
+        try:
+            self.entries = json.loads(self.path.read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def is_current(self, page_file, spec_hash, master_fingerprint):
+        """Return True if page_file exists and matches its manifest entry"""
+        page_file = Path(page_file)
+        entry = self.entries.get(page_file.name)
+        return (page_file.exists()
+                and entry == {'spec': spec_hash,
+                              'master': master_fingerprint})
+
+    def master_fingerprints(self):
+        """Return the distinct master fingerprints in the manifest
+
+        These can be passed to page_cache.file_fingerprint so that an
+        unchanged master file is not hashed again.
+        """
+        fingerprints = {}
+        for entry in self.entries.values():
+            fingerprint = entry['master']
+            fingerprints[tuple(sorted(fingerprint.items()))] = fingerprint
+        return list(fingerprints.values())
+
+    def record(self, page_file, spec_hash, master_fingerprint):
+        """Record that page_file has been generated"""
+        self.entries[Path(page_file).name] = {'spec': spec_hash,
+                                              'master': master_fingerprint}
+
+    def save(self):
+        """Write the manifest, replacing the previous file atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomically(self.path, json.dumps(self.entries, indent=2))
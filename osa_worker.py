@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Persistent AppleScript worker
+
+Usage:
+    osa_worker.py [--stub | --emulator]
+
+Options:
+    --stub      Echo each script back instead of running it. This speaks
+                the same framing as the real worker and is used for
+                testing on machines without AppleScript.
+    --emulator  Run each script against the InDesign emulator (see
+                emulator.py) instead of InDesign.
+
+The worker reads scripts from stdin and writes results to stdout, so
+that a single process can run every script in a generation run.
+
+Each request is a header line holding the length in bytes of the
+UTF-8 encoded script, followed by the script:
+    42\\n<script bytes>
+
+Each response is a header line holding the lengths of the encoded
+stdout and stderr text, followed by both:
+    12 0\\n<stdout bytes><stderr bytes>
+
+Errors are reported in stderr in the same form osascript uses, so
+that an "execution error" is still treated as fatal by gen.py.
+"""
+
+from pathlib import Path
+import subprocess
+import sys
+
+from docopt import docopt
+
+
+def read_request(stream):
+    """Read one framed script from stream, or None at end of input"""
+    header = stream.readline()
+    if not header:
+        return None
+    return stream.read(int(header)).decode('utf-8')
+
+
+def write_request(stream, script_str):
+    """Write one framed script to stream"""
+    encoded = script_str.encode('utf-8')
+    stream.write(b'%d\n' % len(encoded) + encoded)
+    stream.flush()
+
+
+def read_response(stream):
+    """Read one framed (stdout, stderr) pair of bytes from stream
+
+    Raises EOFError if the worker has exited.
+    """
+    header = stream.readline()
+    if not header:
+        raise EOFError('AppleScript worker exited unexpectedly')
+    out_len, err_len = map(int, header.split())
+    return stream.read(out_len), stream.read(err_len)
+
+
+def write_response(stream, stdout, stderr):
+    """Write one framed result to stream"""
+    stdout, stderr = stdout.encode('utf-8'), stderr.encode('utf-8')
+    stream.write(b'%d %d\n' % (len(stdout), len(stderr)) + stdout + stderr)
+    stream.flush()
+
+
+# Four-character codes of the descriptor types format_descriptor handles
+_LIST, _RECORD, _USER_FIELDS = 'list', 'reco', 'usrf'
+_BOOLEANS = {'true': 'true', 'fals': 'false'}
+_BOOLEAN, _MISSING, _NULL = 'bool', 'msng', 'null'
+
+# Names of the record keys in the results of the user interaction
+# commands, which osascript prints from the commands' dictionary
+_RECORD_KEYS = {'bhit': 'button returned', 'ttxt': 'text returned',
+                'gavu': 'gave up'}
+
+
+def four_char_code(code):
+    """Return an integer OSType as its four-character string"""
+    return code.to_bytes(4, 'big').decode('mac_roman')
+
+
+def format_descriptor(descriptor):
+    """Format an NSAppleEventDescriptor result the way osascript does
+
+    Lists are written as their items separated by ", ", records as
+    "key:value" pairs separated by ", ", and booleans as true or false,
+    so that results read the same from every backend.
+    """
+    if descriptor is None:
+        return ''
+    kind = four_char_code(descriptor.descriptorType())
+    if kind == _LIST:
+        return ', '.join(format_descriptor(descriptor.descriptorAtIndex_(i))
+                         for i in range(1, descriptor.numberOfItems() + 1))
+    if kind == _RECORD:
+        fields = []
+        for i in range(1, descriptor.numberOfItems() + 1):
+            key = four_char_code(descriptor.keywordForDescriptorAtIndex_(i))
+            value = descriptor.descriptorAtIndex_(i)
+            if key == _USER_FIELDS:
+                # A list of alternating field names and values
+                for j in range(1, value.numberOfItems(), 2):
+                    fields.append((value.descriptorAtIndex_(j).stringValue(),
+                                   value.descriptorAtIndex_(j + 1)))
+            else:
+                fields.append((_RECORD_KEYS.get(key, key), value))
+        return ', '.join(f'{key}:{format_descriptor(value)}'
+                         for key, value in fields)
+    if kind in _BOOLEANS:
+        return _BOOLEANS[kind]
+    if kind == _BOOLEAN:
+        return 'true' if descriptor.booleanValue() else 'false'
+    if kind == _MISSING:
+        return 'missing value'
+    if kind == _NULL:
+        return ''
+    return descriptor.stringValue() or ''
+
+
+def execute_with_osakit(script_str):
+    """Run the script in-process with NSAppleScript (requires PyObjC)"""
+    from Foundation import NSAppleScript
+
+    script = NSAppleScript.alloc().initWithSource_(script_str)
+    compiled, error = script.compileAndReturnError_(None)
+    if not compiled:
+        return '', f'syntax error: {error["NSAppleScriptErrorMessage"]}'
+    result, error = script.executeAndReturnError_(None)
+    if error:
+        return '', (f'execution error: {error["NSAppleScriptErrorMessage"]}'
+                    f' ({error["NSAppleScriptErrorNumber"]})')
+    return format_descriptor(result), ''
+
+
+def execute_with_osascript(script_str):
+    """Run the script with a new osascript process
+
+    This is only used when PyObjC is not installed, so the worker still
+    functions, but without avoiding the cost of process startup.
+    """
+    osa = subprocess.Popen(['osascript', '-'],
+                           stdin=subprocess.PIPE,
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE)
+    result = osa.communicate(script_str.encode('utf-8'))
+    stdout, stderr = [stream.decode('utf-8') for stream in result]
+    return stdout, stderr
+
+
+def execute_stub(script_str):
+    """Return the script as its own result without running it"""
+    return script_str, ''
+
+
+def serve(execute, instream, outstream):
+    """Run each framed script read from instream until it is closed"""
+    while True:
+        script_str = read_request(instream)
+        if script_str is None:
+            break
+        try:
+            stdout, stderr = execute(script_str)
+        except Exception as exc:
+            stdout, stderr = '', f'execution error: {exc} (-2700)'
+        write_response(outstream, stdout, stderr)
+
+
+class AppleScriptWorker:
+    """Client for a persistent worker process started with this module
+
+    The worker is started on first use and stopped with stop(), or at
+    the end of a with block. It is started again if it exits, so that a
+    long-running caller such as gen_daemon.py outlives a crashed worker.
+    """
+
+    def __init__(self, command=None):
+        if command is None:
+            command = [sys.executable, str(Path(__file__).resolve())]
+        self.command = command
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.command,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+
+    def run(self, script_str):
+        """Run script_str in the worker and return (stdout, stderr) bytes
+
+        A worker that has exited, for example by crashing while running
+        an earlier script, is started again first.
+        """
+        if self.process is not None and self.process.poll() is not None:
+            self.stop()
+        if self.process is None:
+            self.start()
+        write_request(self.process.stdin, script_str)
+        return read_response(self.process.stdout)
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            # The worker exited before reading the last script
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    args = docopt(__doc__)
+    if args['--stub']:
+        execute = execute_stub
+    elif args['--emulator']:
+        from emulator import InDesignEmulator
+        execute = InDesignEmulator().run
+    else:
+        try:
+            import Foundation  # noqa: F401
+            execute = execute_with_osakit
+        except ImportError:
+            execute = execute_with_osascript
+    serve(execute, sys.stdin.buffer, sys.stdout.buffer)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Cache of pre-built page documents
+
+A snapshot is a document saved from the master file with a master page
+applied and the items on its Work layer overridden, but without any of
+the details that change from edition to edition (date, price and page
+numbers). Generating a page from a snapshot only needs a file copy and
+those few frames filled in.
+
+Snapshots are keyed by the master page name, whether it is a spread,
+and the size, modification time and hash of the master file, so they
+are invalidated automatically when the master file changes. The cache
+keeps at most a fixed number of snapshots, evicting the least recently
+used.
+"""
+
+import json
+from pathlib import Path
+import re
+
+from files import file_digest, write_atomically
+
+INDEX_FILE = 'index.json'
+
+
+def file_fingerprint(path, known=()):
+    """Return a dict of the size, mtime and SHA-256 hash of a file
+
+    If one of the `known` fingerprints, taken earlier, has the file's
+    size and mtime it is returned rather than hashing the file again.
+    """
+    path = Path(path)
+    stat = path.stat()
+    for fingerprint in known:
+        if (fingerprint['size'], fingerprint['mtime']) == (
+                stat.st_size, stat.st_mtime_ns):
+            return fingerprint
+    return {'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'sha256': file_digest(path)[1]}
+
+
+class PageSnapshotCache:
+    """Directory of page snapshots built from one master file
+
+    The fingerprint of master_file is taken when the cache is created,
+    without hashing the file if the index has a fingerprint of it with
+    the same size and mtime. Snapshots built from an earlier version of
+    the same master file are removed at that point.
+
+    Snapshots used by this PageSnapshotCache (returned by get or added)
+    are kept until it is discarded, even if that takes the cache over
+    max_entries, so that a run needing more snapshots than the cache
+    holds does not evict those it has just built.
+    """
+
+    def __init__(self, root, master_file, max_entries=64):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.master_file = str(Path(master_file).resolve())
+        self.max_entries = max_entries
+        self.in_use = set()
+        self.index = self._load_index()
+        self.fingerprint = file_fingerprint(
+            master_file, [entry['fingerprint']
+                          for entry in self.index.values()
+                          if entry['master_file'] == self.master_file])
+        for key, entry in list(self.index.items()):
+            if (entry['master_file'] == self.master_file
+                    and entry['fingerprint'] != self.fingerprint):
+                self._remove(key)
+        self._save_index()
+
+    def _load_index(self):
+        """Return the index of snapshots, least recently used first"""
+        try:
+            return json.loads(
+                self.root.joinpath(INDEX_FILE).read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_index(self):
+        write_atomically(self.root.joinpath(INDEX_FILE),
+                         json.dumps(self.index, indent=2))
+
+    def _remove(self, key):
+        entry = self.index.pop(key)
+        self.root.joinpath(entry['file']).unlink(missing_ok=True)
+
+    def _key(self, master_name, spread):
+        return '/'.join([self.fingerprint['sha256'], master_name,
+                         'spread' if spread else 'page'])
+
+    def path_for(self, master_name, spread):
+        """Return the path a snapshot should be saved to"""
+        safe_name = re.sub(r'[^\w-]', '_', master_name)
+        kind = 'spread' if spread else 'page'
+        return self.root.joinpath(
+            f'{self.fingerprint["sha256"][:16]}_{safe_name}_{kind}.indd')
+
+    def get(self, master_name, spread):
+        """Return the path of a cached snapshot, or None if there is none"""
+        key = self._key(master_name, spread)
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        path = self.root.joinpath(entry['file'])
+        if not path.exists():
+            del self.index[key]
+            self._save_index()
+            return None
+        # Move the entry to the end to mark it most recently used
+        self.index[key] = self.index.pop(key)
+        self.in_use.add(key)
+        self._save_index()
+        return path
+
+    def add(self, master_name, spread):
+        """Record a snapshot saved to path_for(master_name, spread)
+
+        The least recently used snapshots not in use are removed if the
+        cache holds more than max_entries.
+        """
+        key = self._key(master_name, spread)
+        self.index.pop(key, None)
+        self.index[key] = {
+            'file': self.path_for(master_name, spread).name,
+            'master_file': self.master_file,
+            'fingerprint': self.fingerprint,
+        }
+        self.in_use.add(key)
+        unused = [key for key in self.index if key not in self.in_use]
+        for key in unused[:max(len(self.index) - self.max_entries, 0)]:
+            self._remove(key)
+        self._save_index()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Page specifications
+
+A page specification is the number of a page and the master it is
+created from. Every page using a master shares the one MasterSpec for
+it, rather than carrying its own copy of the master's slug and spread
+setting, and master names and slugs are interned so equal names are
+the same string object.
+
+Specifications are immutable, so a set of them can be loaded once and
+shared by every run (see gen.load_page_specifications).
+"""
+
+import sys
+
+
+class _Immutable:
+    """Base for slotted classes whose attributes cannot be changed"""
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}'
+                           for name in self.__slots__)
+        return f'{type(self).__name__}({values})'
+
+
+class MasterSpec(_Immutable):
+    """A master: its name, the slug of its pages and if it is a spread"""
+
+    __slots__ = ('name', 'slug', 'spread')
+
+    def __init__(self, name, slug, spread):
+        super().__init__(name=sys.intern(name), slug=sys.intern(slug),
+                         spread=bool(spread))
+
+
+class PageSpec(_Immutable):
+    """A page to generate: its number and the MasterSpec it uses"""
+
+    __slots__ = ('number', 'master')
+
+    def __init__(self, number, master):
+        # Set directly rather than through _Immutable, as there is one
+        # PageSpec for every page
+        object.__setattr__(self, 'number', number)
+        object.__setattr__(self, 'master', master)
+
+    @property
+    def master_name(self):
+        return self.master.name
+
+    @property
+    def slug(self):
+        return self.master.slug
+
+    @property
+    def spread(self):
+        return self.master.spread
+
+    def arguments(self):
+        """Return the gen.create_from_master arguments for the page"""
+        return {'master_name': self.master.name, 'spread': self.master.spread,
+                'slug': self.master.slug, 'page_number': self.number}
+
+
+def master_specs(masters_dict):
+    """Return a dict of MasterSpec by name from the masters.json dict"""
+    return {name: MasterSpec(name, details['slug'], details['spread'])
+            for name, details in masters_dict.items()}
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Journal of generation runs
+
+The journal is a JSON Lines file kept in the pages directory. Each run
+starts with a line describing what was asked for (desk, date and page
+sets), followed by a line for each page as soon as it is finished,
+and a final line when the run completes:
+    {"run": {"desk": "News", "date": "2018-01-23", "sets": ["Front"]}}
+    {"page": "1_Front_230118.indd", "ok": true, "error": ""}
+    {"finished": true}
+
+Lines are flushed to disk as they are written, so that a run that
+stops part of the way through can be resumed from the journal.
+"""
+
+import json
+import os
+from pathlib import Path
+
+JOURNAL_FILE = '.generation-journal.jsonl'
+
+
+class RunJournal:
+    """Journal of the runs generating pages in one pages directory"""
+
+    def __init__(self, pages_root):
+        self.path = Path(pages_root).joinpath(JOURNAL_FILE)
+
+    def _append(self, entry):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, run):
+        """Record the start of a run described by the dict `run`"""
+        self._append({'run': run})
+
+    def record(self, result):
+        """Record the PageResult of a finished page"""
+        self._append({'page': Path(result.path).name, 'ok': result.ok,
+                      'error': result.error})
+
+    def finish(self):
+        """Record that the current run has completed"""
+        self._append({'finished': True})
+
+    def last_run(self):
+        """Return details of the most recent run in the journal
+
+        Returns (run, completed, finished), where `run` is the dict
+        passed to start (or None if there are no runs), `completed` is
+        the set of file names of pages generated successfully, and
+        `finished` is True if the run completed.
+        """
+        run, completed, finished = None, set(), False
+        try:
+            lines = self.path.read_text(encoding='utf-8').splitlines()
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short when a run was stopped
+                continue
+            if 'run' in entry:
+                run, completed, finished = entry['run'], set(), False
+            elif 'page' in entry and entry['ok']:
+                completed.add(entry['page'])
+            elif 'finished' in entry:
+                finished = True
+        return run, completed, finished
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Metrics of generation runs
+
+The metrics of a run are collected from the spans traced during it
+(see tracing.py) and the results of its pages:
+    {"time": "2018-01-22T23:10:00", "desk": "News", "mode": "edition",
+     "pages_generated": 12, "pages_skipped": 2, "pages_failed": 0,
+     "seconds": 41.5, "backend_calls": 3, "backend_calls_per_page": 0.25,
+     "bytes_written": 9123456,
+     "call_seconds": {"count": 3, "sum": 40.8, "buckets": {...}},
+     "step_seconds": {"apply_master": {"count": 12, "sum": 1.3, ...},
+                      "edition": {"count": 1, "sum": 40.1, ...}, ...}}
+
+Histograms count the AppleScript calls taking at most each of the
+HISTOGRAM_BUCKETS seconds, cumulatively as Prometheus does. The step
+histograms also count the steps of edition scripts, which are timed by
+the scripts themselves (see gen.compile_timed_steps).
+
+They are written either as a Prometheus textfile (for the node exporter
+textfile collector), replacing the metrics of the previous run, or
+appended to a JSON file holding the metrics of every run.
+"""
+
+from datetime import datetime
+import json
+from pathlib import Path
+
+from files import write_atomically
+
+# Upper bounds in seconds of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Prefix of the names of Prometheus metrics
+METRIC_PREFIX = 'page_generator'
+
+
+def histogram(values):
+    """Return the count, sum and cumulative bucket counts of values"""
+    values = list(values)
+    return {'count': len(values),
+            'sum': sum(values),
+            'buckets': {str(bound): sum(value <= bound for value in values)
+                        for bound in HISTOGRAM_BUCKETS}}
+
+
+def collect_run_metrics(events, run_event, results, skipped, **details):
+    """Return the metrics dict of a run
+
+    `events` are the Chrome trace events of a Tracer, and `run_event`
+    the span of the run itself. Only AppleScript calls and steps made
+    during the run are counted. `results` are the run's PageResults,
+    and `skipped` the number of pages that did not need generating. Any
+    `details` (such as the desk and mode) are added to the dict.
+    """
+    run_end = run_event['ts'] + run_event['dur']
+    run_events = [event for event in events
+                  if run_event['ts'] <= event['ts'] <= run_end]
+    calls = [event for event in run_events if event['cat'] == 'applescript']
+    steps = {}
+    for event in run_events:
+        if event['cat'] in ('applescript', 'step'):
+            steps.setdefault(event['name'], []).append(event['dur'] / 1e6)
+    generated = [result for result in results if result.ok]
+    return dict(
+        time=datetime.now().isoformat(timespec='seconds'),
+        **details,
+        pages_generated=len(generated),
+        pages_skipped=skipped,
+        pages_failed=len(results) - len(generated),
+        seconds=run_event['dur'] / 1e6,
+        backend_calls=len(calls),
+        backend_calls_per_page=len(calls) / len(results) if results else 0,
+        bytes_written=sum(Path(result.path).stat().st_size
+                          for result in generated
+                          if Path(result.path).exists()),
+        call_seconds=histogram(call['dur'] / 1e6 for call in calls),
+        step_seconds={step: histogram(seconds)
+                      for step, seconds in sorted(steps.items())},
+    )
+
+
+def _histogram_lines(name, values, labels=''):
+    separator = ',' if labels else ''
+    lines = [f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}'
+             for bound, count in values['buckets'].items()]
+    lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} '
+                 f'{values["count"]}')
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{name}_sum{suffix} {values["sum"]}')
+    lines.append(f'{name}_count{suffix} {values["count"]}')
+    return lines
+
+
+def prometheus_text(metrics):
+    """Return the metrics in the Prometheus text exposition format"""
+    name = METRIC_PREFIX
+    lines = [
+        f'# HELP {name}_pages Pages in the last run, by outcome.',
+        f'# TYPE {name}_pages gauge',
+    ]
+    for outcome in ['generated', 'skipped', 'failed']:
+        lines.append(f'{name}_pages{{outcome="{outcome}"}} '
+                     f'{metrics[f"pages_{outcome}"]}')
+    for metric, help_text in [
+            ('seconds', 'Duration of the last run in seconds.'),
+            ('backend_calls', 'AppleScript calls made by the last run.'),
+            ('backend_calls_per_page',
+             'AppleScript calls per page in the last run.'),
+            ('bytes_written', 'Bytes of pages written by the last run.')]:
+        lines += [f'# HELP {name}_run_{metric} {help_text}',
+                  f'# TYPE {name}_run_{metric} gauge',
+                  f'{name}_run_{metric} {metrics[metric]}']
+    lines += [
+        f'# HELP {name}_last_run_timestamp_seconds End of the last run.',
+        f'# TYPE {name}_last_run_timestamp_seconds gauge',
+        f'{name}_last_run_timestamp_seconds '
+        f'{datetime.fromisoformat(metrics["time"]).timestamp()}',
+        f'# HELP {name}_call_seconds Duration of AppleScript calls.',
+        f'# TYPE {name}_call_seconds histogram',
+    ]
+    lines += _histogram_lines(f'{name}_call_seconds',
+                              metrics['call_seconds'])
+    lines += [
+        f'# HELP {name}_step_seconds Duration of AppleScript calls and '
+        f'script steps by step.',
+        f'# TYPE {name}_step_seconds histogram',
+    ]
+    for step, values in metrics['step_seconds'].items():
+        lines += _histogram_lines(f'{name}_step_seconds', values,
+                                  f'step="{step}"')
+    return '\n'.join(lines) + '\n'
+
+
+def write_run_metrics(path, metrics):
+    """Write the metrics of a run to path, replacing it atomically
+
+    A path ending in ".prom" is written as a Prometheus textfile.
+    Otherwise the path is a JSON list of the metrics of every run, to
+    which these metrics are appended.
+    """
+    path = Path(path)
+    if path.suffix == '.prom':
+        text = prometheus_text(metrics)
+    else:
+        try:
+            history = json.loads(path.read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            history = []
+        history.append(metrics)
+        text = json.dumps(history, indent=2)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomically(path, text)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Page Generator Session Replay
+
+Usage:
+    session.py show SESSION
+    session.py replay SESSION [--backend=NAME] [--realtime]
+
+Options:
+    --backend=NAME  Backend to replay the scripts against: stub (answers
+                    with the recorded output), emulator, worker or
+                    osascript. [default: stub]
+    --realtime      With the stub backend, take as long over each call
+                    as it took when it was recorded.
+
+A session is every script gen.py sent through run_applescript during a
+run with --record=SESSION, with the step, output and seconds taken for
+each. Sessions are gzip-compressed JSON Lines files: a header line
+followed by a line for each call:
+    {"session": {"started": "2018-01-22T23:10:00", "argv": [...]}}
+    {"step": "edition", "script": "...", "stdout": "...", "stderr": "",
+     "seconds": 41.2}
+
+"show" prints the number of calls and seconds taken by each step.
+"replay" runs every script again, in order, against another backend
+and prints, for each step, the recorded and replayed seconds and the
+number of calls whose output differed.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import gzip
+import json
+import sys
+import threading
+import time
+
+from docopt import docopt
+
+from backends import OsascriptBackend, ScriptCall, WorkerBackend
+
+_recorder = None
+
+
+class SessionRecorder:
+    """Write the AppleScript calls of a run to a session file
+
+    Calls from every thread are written to the same file as they are
+    made.
+    """
+
+    def __init__(self, path, argv=None):
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._write({'session': {
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'argv': sys.argv[1:] if argv is None else argv}})
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def record(self, call):
+        """Write a ScriptCall to the session"""
+        with self._lock:
+            self._write(call._asdict())
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+@contextmanager
+def use_recorder(recorder):
+    """Record calls from every thread with recorder inside the block"""
+    global _recorder
+    previous, _recorder = _recorder, recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+
+
+def record_call(step, script, stdout, stderr, seconds):
+    """Record a call with the recorder in use, if there is one"""
+    if _recorder is not None:
+        _recorder.record(ScriptCall(step, script, stdout, stderr, seconds))
+
+
+def read_session(path):
+    """Return (header, calls) from a session file
+
+    `calls` is a list of ScriptCall. A last line cut short when the run
+    was stopped is ignored.
+    """
+    header, calls = {}, []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if 'session' in entry:
+                    header = entry['session']
+                else:
+                    calls.append(ScriptCall(**entry))
+        except EOFError:
+            # The compressed stream was cut short
+            pass
+    return header, calls
+
+
+class ReplayBackend:
+    """Answer scripts with the output recorded in a session
+
+    Scripts must arrive in the order they were recorded. A script that
+    differs from the recording is answered with an execution error.
+
+    If `realtime` is True each call takes as long as it was recorded to.
+    """
+
+    def __init__(self, calls, realtime=False):
+        self.calls = list(calls)
+        self.realtime = realtime
+        self.position = 0
+
+    def run(self, script_str, step=None):
+        if self.position >= len(self.calls):
+            return '', 'execution error: No more recorded calls. (-2700)'
+        call = self.calls[self.position]
+        self.position += 1
+        if call.script != script_str:
+            return '', ('execution error: Script differs from call '
+                        f'{self.position} of the recording. (-2700)')
+        if self.realtime:
+            time.sleep(call.seconds)
+        return call.stdout, call.stderr
+
+    def close(self):
+        pass
+
+
+def replay(calls, backend):
+    """Run the recorded calls against backend, comparing the results
+
+    Returns a list of (recorded ScriptCall, replayed ScriptCall) pairs.
+    """
+    pairs = []
+    for call in calls:
+        start = time.perf_counter()
+        stdout, stderr = backend.run(call.script, step=call.step)
+        seconds = time.perf_counter() - start
+        pairs.append((call, ScriptCall(call.step, call.script, stdout,
+                                       stderr, seconds)))
+    return pairs
+
+
+def summarise_steps(calls):
+    """Return {step: {'calls': n, 'seconds': total}} for the calls"""
+    summary = {}
+    for call in calls:
+        step = summary.setdefault(call.step or 'applescript',
+                                  {'calls': 0, 'seconds': 0.0})
+        step['calls'] += 1
+        step['seconds'] += call.seconds
+    return summary
+
+
+def compare_replay(pairs):
+    """Return the recorded and replayed seconds and mismatches by step"""
+    summary = {}
+    for recorded, replayed in pairs:
+        step = summary.setdefault(
+            recorded.step or 'applescript',
+            {'calls': 0, 'recorded_seconds': 0.0, 'replayed_seconds': 0.0,
+             'mismatches': 0})
+        step['calls'] += 1
+        step['recorded_seconds'] += recorded.seconds
+        step['replayed_seconds'] += replayed.seconds
+        if ((recorded.stdout.rstrip(), recorded.stderr.rstrip())
+                != (replayed.stdout.rstrip(), replayed.stderr.rstrip())):
+            step['mismatches'] += 1
+    return summary
+
+
+def make_backend(name, calls, realtime=False):
+    """Return the backend called name for replaying calls"""
+    if name == 'stub':
+        return ReplayBackend(calls, realtime=realtime)
+    if name == 'emulator':
+        # Imported here as the emulator imports gen, which imports this
+        from emulator import InDesignEmulator
+        return InDesignEmulator()
+    if name == 'worker':
+        return WorkerBackend()
+    if name == 'osascript':
+        return OsascriptBackend()
+    raise ValueError(f'Unknown backend {name}')
+
+
+def main():
+    args = docopt(__doc__)
+    header, calls = read_session(args['SESSION'])
+    if args['show']:
+        report = {'session': header, 'steps': summarise_steps(calls)}
+    else:
+        try:
+            backend = make_backend(args['--backend'], calls,
+                                   realtime=args['--realtime'])
+        except ValueError as exc:
+            sys.exit(str(exc))
+        try:
+            pairs = replay(calls, backend)
+        finally:
+            backend.close()
+        report = {'session': header, 'backend': args['--backend'],
+                  'steps': compare_replay(pairs)}
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
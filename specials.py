@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Special editions
+
+Usage:
+    specials.py compact
+
+Special editions are the page sets of the Specials desk in pages.json,
+added with custom_edition.py. Their titles start with the edition date
+in YYYY-MM-DD format (see new_custom_template.py).
+
+New specials are not written to pages.json straight away but appended
+to the journal JOURNAL_FILE, kept next to pages.json, as one JSON line
+each:
+    {"title": "2018-07-14 Durham Miners", "pages": [{"master": ...}]}
+Adding a special takes the same time however many specials there are,
+and appends from several people at once are safe (see append_special).
+The journal is merged into the Specials desk when pages.json is loaded.
+
+Once the journal has COMPACT_AFTER entries, the next special added
+compacts it: its specials are written into pages.json and it is
+emptied. "specials.py compact" compacts it straight away, and can be
+run on a schedule (for example nightly from cron) so that past
+specials are archived promptly however few are added.
+
+When the journal is compacted, specials whose date has passed are moved
+out of pages.json into the archive file for their year in ARCHIVE_DIR,
+such as 2018.json, so that pages.json (loaded on every run) holds only
+the live specials. Archived specials are only loaded when asked for,
+with gen.py --archived.
+"""
+
+from contextlib import contextmanager
+from datetime import date, datetime
+import fcntl
+import json
+import os
+from pathlib import Path
+import re
+
+from docopt import docopt
+
+from files import write_atomically
+
+# Desk in pages.json holding the special editions
+DESK = 'Specials'
+
+# Directory of the archive files, relative to pages.json
+ARCHIVE_DIR = 'specials-archive'
+
+# Journal of specials added since pages.json was last compacted, and the
+# number of entries it may reach before it is compacted
+JOURNAL_FILE = 'specials.jsonl'
+COMPACT_AFTER = 20
+
+APP_DIR = Path(__file__).parent
+
+_DATED_TITLE = re.compile(r'(\d{4}-\d{2}-\d{2})\b')
+
+
+def special_date(title):
+    """Return the date a special's title starts with, or None"""
+    match = _DATED_TITLE.match(title)
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _read_archive(path):
+    try:
+        return json.loads(Path(path).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return {}
+
+
+def archive_past_specials(pages_inventory, today, archive_dir):
+    """Move the specials dated before today to the archive files
+
+    The specials are removed from the Specials desk of pages_inventory
+    (the pages.json dict), which the caller must then save. They are
+    written to their archive files first, so a special is never only in
+    memory. Specials whose titles do not start with a date are kept.
+
+    Returns the titles of the specials archived.
+    """
+    specials = pages_inventory.get(DESK, {})
+    by_year = {}
+    for title in list(specials):
+        date = special_date(title)
+        if date is not None and date < today:
+            by_year.setdefault(date.year, {})[title] = specials.pop(title)
+
+    archive_dir = Path(archive_dir)
+    for year, archived in by_year.items():
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        path = archive_dir.joinpath(f'{year}.json')
+        entries = _read_archive(path)
+        entries.update(archived)
+        write_atomically(path, json.dumps(entries, indent=2))
+    return [title for archived in by_year.values() for title in archived]
+
+
+def load_archived_specials(archive_dir):
+    """Return the archived specials as a dict of page sets by title
+
+    The specials are in date order.
+    """
+    specials = {}
+    for path in sorted(Path(archive_dir).glob('[0-9][0-9][0-9][0-9].json')):
+        specials.update(_read_archive(path))
+    return dict(sorted(specials.items(),
+                       key=lambda item: special_date(item[0])))
+
+
+@contextmanager
+def _locked_journal(journal_file):
+    """Open the journal for appending, holding its lock inside the block
+
+    Yields the file descriptor, which is opened with O_APPEND so that
+    each write goes to the end of the file.
+    """
+    fd = os.open(journal_file, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def append_special(journal_file, title, pages):
+    """Add a special to the journal, returning the journal's entry count
+
+    The entry is written with a single write while holding the journal's
+    lock, so concurrent appends and compactions cannot interleave or
+    lose entries.
+    """
+    line = json.dumps({'title': title, 'pages': pages},
+                      ensure_ascii=False) + '\n'
+    with _locked_journal(journal_file) as fd:
+        size = os.fstat(fd).st_size
+        # Finish off a line left incomplete by a writer that was stopped
+        if size and os.pread(fd, 1, size - 1) != b'\n':
+            line = '\n' + line
+        os.write(fd, line.encode('utf-8'))
+    return len(read_journal(journal_file))
+
+
+def read_journal(journal_file):
+    """Return the specials in the journal as a dict of page sets by title
+
+    A special added more than once has its last pages. Lines that are
+    incomplete or not valid JSON are ignored.
+    """
+    specials = {}
+    try:
+        with open(journal_file, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    specials[entry['title']] = entry['pages']
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return specials
+
+
+def merge_journal(pages_inventory, journal_file):
+    """Add the specials in the journal to the pages.json dict"""
+    journal = read_journal(journal_file)
+    if journal:
+        pages_inventory.setdefault(DESK, {}).update(journal)
+    return pages_inventory
+
+
+def compact(pages_file, journal_file, archive_dir, today=None):
+    """Write the journal's specials into pages.json and empty the journal
+
+    Specials dated before today (by default the current date) are moved
+    to the archive (see archive_past_specials). pages.json is replaced
+    atomically before the journal is emptied, so a reader sees every
+    special at any moment, some perhaps twice.
+
+    Returns the titles of the specials archived.
+    """
+    today = today or date.today()
+    pages_file = Path(pages_file)
+    with _locked_journal(journal_file) as fd:
+        with open(pages_file, encoding='utf-8') as f:
+            pages_inventory = json.load(f)
+        merge_journal(pages_inventory, journal_file)
+        archived = archive_past_specials(pages_inventory, today, archive_dir)
+        write_atomically(pages_file, json.dumps(pages_inventory, indent=2))
+        os.ftruncate(fd, 0)
+    return archived
+
+
+def main():
+    docopt(__doc__)
+    archived = compact(APP_DIR.joinpath('pages.json'),
+                       APP_DIR.joinpath(JOURNAL_FILE),
+                       APP_DIR.joinpath(ARCHIVE_DIR))
+    for title in archived:
+        print(f'Archived past special "{title}"')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import bench_gen
+
+
+def test_find_regressions():
+    """Counts must not grow, timings may grow within the tolerance"""
+    baseline = {'edition.backend_calls_per_page': 0.5,
+                'edition.seconds_per_page': 1.0,
+                'construct_page_specifications.seconds': 0.001}
+    metrics = {'edition.backend_calls_per_page': 0.6,
+               'edition.seconds_per_page': 1.4,
+               'construct_page_specifications.seconds': 0.005}
+    assert bench_gen.find_regressions(metrics, baseline, 0.5) == [
+        ('edition.backend_calls_per_page', 0.5, 0.6)]
+    metrics['edition.seconds_per_page'] = 1.6
+    assert len(bench_gen.find_regressions(metrics, baseline, 0.5)) == 2
+
+
+def test_run_benchmarks(tmp_path):
+    """Editions should need fewer backend calls than single pages"""
+    metrics = bench_gen.run_benchmarks(['Blanks'], 0, tmp_path)
+    assert metrics['per_page.backend_calls_per_page'] == 1
+    assert metrics['edition.backend_calls_per_page'] == 1 / 3
+    assert metrics['per_page.failed_pages'] == 0
+    assert metrics['edition.failed_pages'] == 0
+    assert metrics['main.backend_calls_per_page'] == 1 / 3
+    assert metrics['main.failed_pages'] == 0
+
+
+def test_script_size_ignores_workspace(tmp_path):
+    """Script sizes should not depend on the temporary directory's path"""
+    short, long = tmp_path / 'a', tmp_path / 'a-much-longer-directory'
+    sizes = [bench_gen.script_size(f'open POSIX file "{path}/1.indd"', path)
+             for path in [short, long]]
+    assert sizes[0] == sizes[1]
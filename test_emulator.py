@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+import json
+import sys
+
+from docopt import docopt
+import pytest
+
+from backends import RecordingBackend
+import emulator
+import gen
+import osa_worker
+from manifest import GenerationManifest
+from page_cache import file_fingerprint, PageSnapshotCache
+from run_journal import RunJournal
+
+
+def test_generated_page_contents(master_file, tmp_path):
+    """A generated spread should carry the date and page numbers"""
+    indesign = emulator.InDesignEmulator()
+    with gen.use_backend(indesign):
+        path = gen.create_from_master(
+            master_name='News-Base-S', spread=True, slug='News',
+            edition_date=datetime(2018, 1, 23), page_number=2,
+            master_file=master_file, pages_root=tmp_path)
+    document = json.loads(path.read_text(encoding='utf-8'))
+    left, right = document['pages'][1:]
+    contents = {frame['label']: frame['contents'] for frame in left['frames']}
+    assert contents == {'Edition date': 'Tuesday\nJanuary 23 2018',
+                        'L-Page number': '2'}
+    assert [frame['label'] for frame in right['frames']] == [
+        'Edition date', 'R-Page number']
+    assert document['layers']['Furniture']['locked']
+    assert not indesign.documents
+    assert indesign.script_count == 1
+
+
+def test_labelled_frames_fill_front_page(master_file, tmp_path):
+    """Labels without frames should be ignored by the single pass"""
+    indesign = emulator.InDesignEmulator()
+    with gen.use_backend(indesign):
+        gen.open_master(master_file)
+        gen.set_labelled_frames({'Price': '£1.50', 'Weather': 'Fair'})
+    frames = indesign.active_document['masters']['News-Front']
+    assert [frame['contents'] for frame in frames
+            if frame['label'] == 'Price'] == ['£1.50']
+    assert indesign.script_count == 2
+
+
+def test_failed_page_names_step(make_job):
+    """An edition should report the step that failed for a bad page"""
+    jobs = [make_job(master_name=name)
+            for name in ['News-Base-R', 'No-Such-Master']]
+    with gen.use_backend(emulator.InDesignEmulator()):
+        good, bad = gen.generate_edition(jobs)
+    assert good.ok and good.path.exists()
+    assert not bad.ok
+    assert bad.error.startswith('apply_master failed: ')
+
+
+def test_failed_page_leaves_other_documents_open(make_job, tmp_path):
+    """A page whose master fails to open should leave the user's work"""
+    user_file = tmp_path / 'Working.indd'
+    user_file.write_text('user document', encoding='utf-8')
+    jobs = [make_job(master_file=tmp_path / 'Missing.indd')]
+    indesign = emulator.InDesignEmulator()
+    with gen.use_backend(indesign):
+        gen.open_document(user_file)
+        gen.set_frame_contents('Edition date', 'Unsaved work')
+        result, = gen.generate_edition(jobs)
+    assert not result.ok
+    assert result.error.startswith('open_master failed: ')
+    assert [document['path'] for document in indesign.documents] == [
+        str(user_file)]
+
+
+def test_unknown_command_is_an_error():
+    """Commands outside the known vocabulary should fail loudly"""
+    indesign = emulator.InDesignEmulator()
+    stdout, stderr = indesign.run(
+        'tell application "Adobe InDesign CC 2019"\n  quit\nend tell')
+    assert stderr.startswith('execution error: Emulator does not understand')
+
+
+def test_run_editions(master_file, tmp_path):
+    """Every page set of a desk should generate against the emulator"""
+    pages = gen.construct_page_specifications(
+        gen.load_generators_json(), gen.load_masters_json())
+    stats = emulator.run_editions(
+        emulator.InDesignEmulator(), pages, ['Sport'],
+        datetime(2018, 1, 27), master_file, tmp_path)
+    assert stats['Sport']['failed'] == 0
+    assert stats['Sport']['pages'] == sum(
+        len(page_set) for page_set in pages['Sport'].values())
+
+
+def test_master_opened_once(master_file, make_job):
+    """With the master kept open each page is a copy of a clean master"""
+    jobs = [make_job(master_name=name, spread=spread, page_number=number)
+            for name, spread, number in [('News-Base-S', True, 2),
+                                         ('No-Such-Master', False, 3),
+                                         ('News-Base-R', False, 5)]]
+    indesign = emulator.InDesignEmulator()
+    with gen.use_backend(indesign):
+        with gen.master_document_open(master_file):
+            results = gen.generate_edition(jobs, master_open=True)
+            master = indesign.active_document
+    assert [result.ok for result in results] == [True, False, True]
+    assert master['path'] == str(master_file)
+    assert len(master['pages']) == 1
+    assert not indesign.documents
+    document = json.loads(results[2].path.read_text(encoding='utf-8'))
+    assert len(document['pages']) == 1
+    assert master_file.read_text(encoding='utf-8') == 'master'
+
+
+def test_pages_from_snapshots(master_file, make_job, tmp_path):
+    """Pages made from cached snapshots should match pages from the master"""
+    cache = PageSnapshotCache(tmp_path / 'cache', master_file)
+    jobs = [make_job(master_name='News-Front', slug='Front',
+                     edition_date=datetime(2018, 1, 27), page_number=1,
+                     pages_root=tmp_path / day)
+            for day in ['first', 'second']]
+    indesign = emulator.InDesignEmulator()
+    with gen.use_backend(indesign):
+        first = gen.generate_edition(jobs[:1], snapshot_cache=cache)[0]
+        scripts = indesign.script_count
+        second = gen.generate_edition(jobs[1:], snapshot_cache=cache)[0]
+        assert indesign.script_count == scripts + 1
+        expected = gen.create_from_master(
+            **dict(jobs[0], pages_root=tmp_path / 'master'))
+
+    def page_frames(path):
+        document = json.loads(path.read_text(encoding='utf-8'))
+        return document['pages']
+
+    assert first.ok and second.ok
+    assert page_frames(first.path) == page_frames(expected)
+    assert page_frames(second.path) == page_frames(expected)
+
+
+def test_generate_parallel(make_job):
+    """Pages spread across workers should come back in order"""
+    jobs = [make_job(master_name='Sprt-Base-R', slug='Sport',
+                     page_number=number)
+            for number in range(1, 20, 2)]
+    workers = [emulator.InDesignEmulator(latency=0.01) for _ in range(3)]
+    results = gen.generate_parallel(jobs, workers, master_open=True)
+    assert [result.page_number for result in results] == list(range(1, 20, 2))
+    assert all(result.ok and result.path.exists() for result in results)
+    # Each worker opens and closes the master at most once
+    assert sum(worker.script_count for worker in workers) <= len(jobs) + 12
+    assert all(not worker.documents for worker in workers)
+
+
+def test_up_to_date_pages_skipped(master_file, make_job, tmp_path):
+    """Only missing or stale pages should be generated again"""
+    jobs = [make_job(master_name='Feat-Base-L', slug='Features',
+                     page_number=number, pages_root=tmp_path / 'pages')
+            for number in [8, 10, 12]]
+    fingerprint = file_fingerprint(master_file)
+    manifest = GenerationManifest(tmp_path / 'pages')
+    with gen.use_backend(emulator.InDesignEmulator()):
+        for job, result in zip(jobs, gen.generate_edition(jobs)):
+            manifest.record(result.path, gen.job_spec_hash(job), fingerprint)
+    manifest.save()
+
+    gen.job_file_path(jobs[0]).unlink()
+    jobs[1]['master_name'] = 'Feat-Letters-L'
+    manifest = GenerationManifest(tmp_path / 'pages')
+    to_generate, up_to_date = gen.split_current_jobs(jobs, manifest,
+                                                     fingerprint)
+    assert to_generate == jobs[:2]
+    assert up_to_date == jobs[2:]
+
+    master_file.write_text('edited master', encoding='utf-8')
+    to_generate, up_to_date = gen.split_current_jobs(
+        jobs, manifest, file_fingerprint(master_file))
+    assert to_generate == jobs
+
+
+def test_resume_interrupted_run(master_file, tmp_path):
+    """--resume should only generate pages the stopped run did not finish"""
+    class FailingEmulator(emulator.InDesignEmulator):
+        """Fail with a fatal error from the second edition script onwards"""
+        editions = 0
+
+        def run(self, script_str, step=None):
+            if step == 'edition':
+                self.editions += 1
+                if self.editions > 1:
+                    return '', 'execution error: Out of memory. (-108)'
+            return super().run(script_str, step)
+
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path / "pages"}',
+            '--chunk_size=4']
+    selections = {'Choose a desk': ['Sport']}
+    with gen.use_backend(FailingEmulator(selections=selections)):
+        with pytest.raises(gen.AppleScriptError):
+            gen.generate(docopt(gen.__doc__, argv))
+    journal = RunJournal(tmp_path / 'pages')
+    run, completed, finished = journal.last_run()
+    assert run['desk'] == 'Sport' and not finished
+    assert len(completed) == 4
+
+    indesign = emulator.InDesignEmulator()
+    with gen.use_backend(indesign):
+        gen.generate(docopt(gen.__doc__, argv + ['--resume']))
+    run, completed, finished = journal.last_run()
+    assert finished
+    assert len(completed) == 9
+    assert indesign.script_count == 2
+    assert len(set(indesign.saved)) == 5
+
+
+def test_command_line_edition_needs_no_dialogs(master_file, tmp_path):
+    """--desk, --date and --set should replace the dialogs"""
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Features', '--date=2018-01-23',
+            '--set=9', '--set=12-13 (split)']
+    recorder = RecordingBackend(emulator.InDesignEmulator())
+    with gen.use_backend(recorder):
+        gen.generate(docopt(gen.__doc__, argv))
+    assert [call.step for call in recorder.calls] == ['edition']
+    assert sorted(path.name for path in tmp_path.glob('*.indd')) == [
+        '12-13_Features_230118.indd', '9_Features_230118.indd',
+        'Master.indd']
+
+
+def test_parallel_workers_need_their_own_indesign(master_file, tmp_path):
+    """--workers should run one worker command each, and refuse to share"""
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Sport', '--date=2018-01-23', '--set=14', '--set=15',
+            '--set=21', '--workers=2']
+    with pytest.raises(SystemExit):
+        gen.generate(docopt(gen.__doc__, argv))
+    assert not list(tmp_path.glob('*_Sport_*.indd'))
+
+    command = f'"{sys.executable}" "{osa_worker.__file__}" --emulator'
+    argv += [f'--worker_command={command}'] * 2
+    gen.generate(docopt(gen.__doc__, argv))
+    assert sorted(path.name for path in tmp_path.glob('*_Sport_*.indd')) == [
+        '14_Sport_230118.indd', '15_Sport_230118.indd',
+        '21_Sport_230118.indd']
+
+
+def test_unknown_page_set_exits(master_file, tmp_path):
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Features', '--date=2018-01-23', '--set=99']
+    with gen.use_backend(emulator.InDesignEmulator()) as indesign:
+        with pytest.raises(SystemExit):
+            gen.generate(docopt(gen.__doc__, argv))
+    assert indesign.script_count == 0
+
+
+def test_date_range_in_one_session(master_file, tmp_path):
+    """Every date of the range should be generated with one master open"""
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Features', '--date=2018-01-22', '--until=2018-01-24',
+            '--set=9', '--open_master_once']
+    recorder = RecordingBackend(emulator.InDesignEmulator())
+    with gen.use_backend(recorder):
+        gen.generate(docopt(gen.__doc__, argv))
+    steps = [call.step for call in recorder.calls]
+    assert steps.count('open_master') == 1
+    assert steps.count('edition') == 1
+    assert sorted(path.name for path in tmp_path.glob('*.indd')) == [
+        '9_Features_220118.indd', '9_Features_230118.indd',
+        '9_Features_240118.indd', 'Master.indd']
+    run, completed, finished = RunJournal(tmp_path).last_run()
+    assert run['until'] == '2018-01-24' and finished
+
+
+def test_date_range_must_not_end_before_it_starts(master_file, tmp_path):
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Features', '--date=2018-01-23', '--until=2018-01-22',
+            '--set=9']
+    with gen.use_backend(emulator.InDesignEmulator()) as indesign:
+        with pytest.raises(SystemExit):
+            gen.generate(docopt(gen.__doc__, argv))
+    assert indesign.script_count == 0
+
+
+def test_scheduled_page_sets_change_with_the_date(master_file, tmp_path):
+    """--scheduled should pick each date's page sets from pages.json"""
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Culture', '--date=2018-01-22', '--until=2018-01-23',
+            '--scheduled']
+    with gen.use_backend(emulator.InDesignEmulator()):
+        gen.generate(docopt(gen.__doc__, argv))
+    assert sorted(path.name for path in tmp_path.glob('*.indd')) == [
+        '11_Culture_220118.indd', '13_Culture_230118.indd', 'Master.indd']
+
+
+class FailingFillEmulator(emulator.InDesignEmulator):
+    """Emulator that cannot fill in the frames of a page"""
+
+    def _command(self, line, target):
+        if line.startswith('set contents of text frame'):
+            raise emulator.EmulatorError('Can’t set contents.', -10000)
+        return super()._command(line, target)
+
+
+def test_snapshot_failures_are_page_failures(master_file, make_job,
+                                             tmp_path):
+    """Pages without a snapshot or that fail should leave no file behind"""
+    cache = PageSnapshotCache(tmp_path / 'cache', master_file)
+    jobs = [make_job(master_name=name, slug=slug, page_number=number,
+                     pages_root=tmp_path / 'pages')
+            for name, slug, number in [('News-Base-R', 'News', 3),
+                                       ('No-Such-Master', 'Other', 5)]]
+    with gen.use_backend(emulator.InDesignEmulator()):
+        good, bad = gen.generate_edition(jobs, snapshot_cache=cache)
+    assert good.ok and good.path.exists()
+    assert not bad.ok and not bad.path.exists()
+    assert bad.error.startswith('build_snapshot failed: ')
+
+    good.path.unlink()
+    with gen.use_backend(FailingFillEmulator()):
+        failed, = gen.generate_edition(jobs[:1], snapshot_cache=cache)
+    assert not failed.ok
+    assert not failed.path.exists()
+
+
+def test_run_needing_more_snapshots_than_cache_holds(master_file, make_job,
+                                                     tmp_path):
+    """Snapshots built for a run should not be evicted during it"""
+    cache = PageSnapshotCache(tmp_path / 'cache', master_file, max_entries=1)
+    jobs = [make_job(master_name=name, page_number=number)
+            for name, number in [('News-Base-R', 3), ('News-Base-L', 4),
+                                 ('News-Front', 1)]]
+    with gen.use_backend(emulator.InDesignEmulator()):
+        results = gen.generate_edition(jobs, chunk_size=1,
+                                       snapshot_cache=cache)
+    assert all(result.ok for result in results)
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+import hashlib
+
+from files import file_digest, write_atomically
+
+
+def test_file_digest_reads_every_block(tmp_path):
+    path = tmp_path / 'page.indd'
+    data = bytes(range(256)) * 5000
+    path.write_bytes(data)
+    assert file_digest(path) == (len(data), hashlib.sha256(data).hexdigest())
+
+
+def test_write_atomically_replaces_file(tmp_path):
+    """The file should be replaced, leaving no temporary file behind"""
+    path = tmp_path / 'index.json'
+    path.write_text('old', encoding='utf-8')
+    write_atomically(path, '{"é": 1}')
+    assert path.read_text(encoding='utf-8') == '{"é": 1}'
+    assert [file.name for file in tmp_path.iterdir()] == ['index.json']
@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 
 from datetime import datetime
+import json
+import os
+from pathlib import Path
+import re
+import sys
 
+from docopt import docopt
+import pytest
+
+from backends import FakeBackend, RecordingBackend, WorkerBackend
 import gen
+from page_specs import MasterSpec, PageSpec
 
 
 def test_format_page_date():
@@ -66,3 +76,254 @@ def test_file_date_formatting():
         datetime(2016, 12, 31)]
     for case in cases:
         assert gen.format_file_date(case) == case.strftime('%d%m%y')
+
+
+@pytest.fixture
+def recorder():
+    """Record the scripts sent to a fake backend"""
+    with gen.use_backend(RecordingBackend(FakeBackend())) as backend:
+        yield backend
+
+
+def test_create_from_master_batches_steps(recorder, make_job, tmp_path):
+    """create_from_master should run all of a page's steps in one script"""
+    save_location = gen.create_from_master(**make_job(
+        master_name='News-Front', slug='Front', page_number=1))
+    assert save_location == tmp_path / '1_Front_230118.indd'
+    assert [call.step for call in recorder.calls] == ['batch']
+    script = recorder.calls[0].script
+    for step in ['open_master', 'apply_master', 'fill_frames',
+                 'override_master_items', 'save_file',
+                 'close_active_document']:
+        assert f'error "{step} failed: "' in script
+
+
+def test_create_from_master_unbatched(recorder, make_job):
+    """Without batching each step should be a separate backend call"""
+    gen.create_from_master(
+        **make_job(master_name='News-Base-S', spread=True, page_number=2),
+        batched=False)
+    assert len(recorder.calls) == 8
+    assert recorder.calls[1].step == 'open_master'
+    assert not any('failed: "' in call.script for call in recorder.calls)
+
+
+def test_labelled_frames_filled_in_one_call(recorder):
+    """Every label should be filled by the same script"""
+    gen.set_labelled_frames({'Edition date': 'Tuesday', 'Page number': 9})
+    assert len(recorder.calls) == 1
+    script = recorder.calls[0].script
+    assert script.count('every text frame') == 1
+    assert '{"Edition date", "Page number"}' in script
+    assert '{"Tuesday", "9"}' in script
+
+
+def test_parse_edition_results(tmp_path):
+    """Each page should get a result, even if the script did not report it"""
+    pages = [(n, tmp_path / f'{n}.indd') for n in [1, 2, 3]]
+    output = (f'OK\t0\t{pages[0][1]}\t\n'
+              f'FAILED\t1\t{pages[1][1]}\tInvalid object\nsecond line')
+    results = gen.parse_edition_results(output, pages)
+    assert [r.ok for r in results] == [True, False, False]
+    assert results[1].error == 'Invalid object\nsecond line'
+    assert results[2].error.startswith('No result returned')
+
+
+def test_generate_edition_chunks(recorder, make_job):
+    """generate_edition should send one script per chunk of pages"""
+    jobs = [make_job(page_number=n) for n in [3, 5, 7]]
+    results = gen.generate_edition(jobs, chunk_size=2)
+    assert len(recorder.calls) == 2
+    assert [r.page_number for r in results] == [3, 5, 7]
+    assert recorder.calls[0].script.count(
+        'set end of page_results to "OK"') == 2
+
+
+def test_worker_runs_scripts_in_one_process():
+    """Scripts should round-trip through a stand-in persistent worker"""
+    worker_script = Path(gen.__file__).with_name('osa_worker.py')
+    backend = WorkerBackend([sys.executable, str(worker_script), '--stub'])
+    with gen.use_backend(backend):
+        pid = backend.worker.process.pid
+        assert gen.run_applescript('return "é"') == 'return "é"'
+        assert gen.run_applescript('beep') == 'beep'
+        assert backend.worker.process.pid == pid
+
+
+def test_execution_error_raises():
+    """An AppleScript execution error should raise AppleScriptError"""
+    fake = FakeBackend([('open', '', 'execution error: File not found. (-43)'),
+                        ('save', '', 'execution error: Timed out. (-1712)')])
+    with gen.use_backend(fake):
+        assert gen.run_applescript('beep') == ''
+        with pytest.raises(gen.AppleScriptError) as fatal:
+            gen.run_applescript('open POSIX file "/missing.indd"')
+        with pytest.raises(gen.AppleScriptError) as transient:
+            gen.run_applescript('save')
+    assert (fatal.value.number, fatal.value.retryable) == (-43, False)
+    assert (transient.value.number, transient.value.retryable) == (-1712, True)
+
+
+def test_generate_edition_retries_transient_failures(make_job):
+    """Pages failing with a transient error should be generated again"""
+    class FlakyBackend:
+        """Report the first page of the first script as timed out"""
+        def __init__(self):
+            self.scripts = []
+
+        def run(self, script_str, step=None):
+            self.scripts.append(script_str)
+            indexes = re.findall(r'tab & "(\d+)" & tab', script_str)[::2]
+            lines = [f'OK\t{index}\tpath\t' for index in indexes]
+            if len(self.scripts) == 1:
+                lines[0] = 'FAILED\t0\tpath\tTimed out. (-1712)'
+            return '\n'.join(lines), ''
+
+        def close(self):
+            pass
+
+    jobs = [make_job(page_number=n) for n in [3, 5]]
+    reported = []
+    with gen.use_backend(FlakyBackend()) as backend:
+        results = gen.generate_edition(jobs, retries=1, retry_delay=0,
+                                       on_result=reported.append)
+    assert len(backend.scripts) == 2
+    assert '3_News_230118' in backend.scripts[1]
+    assert '5_News_230118' not in backend.scripts[1]
+    assert all(result.ok for result in results)
+    assert [result.page_number for result in reported] == [5, 3]
+
+
+def test_plan_does_not_run_scripts(recorder, master_file, tmp_path):
+    """A plan should list every page and script without running any"""
+    argv = ['--plan', f'--master={master_file}',
+            f'--pages_dir={tmp_path}', '--date=2018-01-23', '--chunk_size=50']
+    args = docopt(gen.__doc__, argv)
+    plan = gen.plan(args)
+    pages = gen.load_generators_json()
+    page_count = sum(len(page_set) for desk in pages.values()
+                     for page_set in desk.values())
+    assert recorder.calls == []
+    assert len(plan['pages']) == plan['estimate']['pages'] == page_count
+    assert plan['estimate']['backend_calls'] == -(-page_count // 50)
+    assert plan['estimate']['seconds'] is None
+
+    gen.record_run_timing(tmp_path, 'edition', 10, 25.0)
+    assert gen.plan(args)['estimate']['seconds'] == 2.5 * page_count
+
+
+def test_plan_master_open_without_desk(recorder, master_file, tmp_path):
+    """Page steps should name the open master, as the scripts sent do
+
+    Without --desk only the desks with the --set page sets are planned.
+    """
+    argv = ['--plan', f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--date=2018-01-23', '--set=Front', '--open_master_once']
+    plan = gen.plan(docopt(gen.__doc__, argv))
+    assert [page['page'] for page in plan['pages']] == [1]
+    steps = plan['pages'][0]['steps']
+    assert all('tell document "Master.indd"' in step['script']
+               for step in steps)
+    assert all(step['script'].strip() in plan['scripts'][2]['script']
+               for step in steps
+               if step['step'] != 'revert_document')
+
+
+def test_summarise_by_date(master_file, tmp_path):
+    """Each date should count its generated, failed and skipped pages"""
+    pages = gen.construct_page_specifications(gen.load_generators_json(),
+                                              gen.load_masters_json())
+    dates = gen.edition_dates(datetime(2018, 1, 22), '2018-01-24')
+    jobs = [job for date in dates
+            for job in gen.make_page_jobs(pages, 'Features', ['9'], date,
+                                          master_file, tmp_path)]
+    results = [gen.PageResult(9, gen.job_file_path(jobs[0]), True, ''),
+               gen.PageResult(9, gen.job_file_path(jobs[1]), False, 'x')]
+    assert gen.summarise_by_date(jobs, results) == {
+        '2018-01-22': {'generated': 1, 'failed': 0, 'skipped': 0},
+        '2018-01-23': {'generated': 0, 'failed': 1, 'skipped': 0},
+        '2018-01-24': {'generated': 0, 'failed': 0, 'skipped': 1}}
+
+
+def test_page_set_index():
+    """Page sets with rules should be indexed by weekday and date"""
+    pages, index = gen.split_page_set_rules({'Sport': {
+        'Back': {'days': ['Mon', 'tuesday'], 'pages': [{'page': 16}]},
+        'Gala': {'dates': ['2018-01-23'], 'pages': [{'page': 2}]},
+        '14': [{'page': 14}],
+    }})
+    assert pages == {'Sport': {'Back': [{'page': 16}], 'Gala': [{'page': 2}],
+                               '14': [{'page': 14}]}}
+    assert index == {'Sport': {0: ['Back'], 1: ['Back'],
+                               '2018-01-23': ['Gala']}}
+    tuesday = datetime(2018, 1, 23)
+    assert gen.scheduled_page_sets(index, 'Sport', tuesday) == ['Back',
+                                                                'Gala']
+    assert gen.scheduled_page_sets(index, 'Sport', datetime(2018, 1, 24)) == []
+    with pytest.raises(ValueError):
+        gen.split_page_set_rules({'Sport': {'Back': {'days': ['Mo'],
+                                                     'pages': []}}})
+
+
+def test_pages_json_schedule():
+    """The page sets in pages.json should be scheduled by their names"""
+    index = gen.load_page_specifications()[1]
+    wednesday, saturday = datetime(2018, 1, 24), datetime(2018, 1, 27)
+    assert gen.scheduled_page_sets(index, 'Culture', wednesday) == [
+        '12-13 split (Weds)']
+    assert gen.scheduled_page_sets(index, 'Sport', saturday) == [
+        'Back (24: Saturday)']
+
+
+@pytest.fixture
+def specification_files(tmp_path):
+    pages_file = tmp_path.joinpath('pages.json')
+    masters_file = tmp_path.joinpath('masters.json')
+    pages_file.write_text(json.dumps({'Sport': {
+        'Back': {'days': ['Sat'], 'pages': [{'page': 24, 'master': 'S'},
+                                            {'page': 23, 'master': 'S'}]},
+    }}))
+    masters_file.write_text(json.dumps({'S': {'slug': 'Sport',
+                                              'spread': False}}))
+    return pages_file, masters_file, tmp_path.joinpath('cache.json')
+
+
+def test_compiled_specifications_cached(specification_files, monkeypatch):
+    """Specifications should be compiled once and then read from cache"""
+    pages, index = gen.compile_page_specifications(*specification_files)
+    master = MasterSpec('S', 'Sport', False)
+    assert pages == {'Sport': {'Back': (PageSpec(24, master),
+                                        PageSpec(23, master))}}
+    assert index == {'Sport': {5: ['Back']}}
+    assert specification_files[2].exists()
+
+    def fail(*args):
+        raise AssertionError('Specifications compiled again')
+    monkeypatch.setattr(gen, 'split_page_set_rules', fail)
+    monkeypatch.setattr(gen, 'construct_page_specifications', fail)
+    cached_pages, cached_index = gen.compile_page_specifications(
+        *specification_files)
+    assert (cached_pages, cached_index) == (pages, index)
+    # Pages of the same master still share it
+    first, second = cached_pages['Sport']['Back']
+    assert first.master is second.master
+
+    # Touching a file without changing it should not invalidate the cache
+    pages_file = specification_files[0]
+    stat = pages_file.stat()
+    os.utime(pages_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert gen.compile_page_specifications(*specification_files) == (
+        pages, index)
+    monkeypatch.undo()
+
+    pages_file.write_text(json.dumps({'Sport': {
+        'Back': [{'page': 20, 'master': 'S'}]}}))
+    pages, index = gen.compile_page_specifications(*specification_files)
+    assert pages['Sport']['Back'][0].number == 20
+    assert index == {'Sport': {}}
+
+
+def test_unknown_master_rejected(specification_files):
+    specification_files[1].write_text('{}')
+    with pytest.raises(ValueError, match='unknown master'):
+        gen.compile_page_specifications(*specification_files)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import sys
+import threading
+
+import pytest
+
+from backends import WorkerBackend
+import emulator
+import gen_client
+from gen_daemon import GenerationServer
+import osa_worker
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    """Run a daemon with an emulated InDesign on a socket in tmp_path"""
+    indesign = emulator.InDesignEmulator()
+    server = GenerationServer(tmp_path / 'gen.sock', indesign)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_client_runs_generation_in_daemon(daemon, master_file, tmp_path):
+    """Requests should reuse the daemon's backend and report output"""
+    stdout, stderr = io.StringIO(), io.StringIO()
+    argv = ['--master=Master.indd', '--pages_dir=pages', '--desk=Features',
+            '--date=2018-01-23', '--set=9']
+    for _ in range(2):
+        status = gen_client.send_request(daemon.path, argv, tmp_path,
+                                         stdout, stderr)
+        assert status == 0
+    assert (tmp_path / 'pages' / '9_Features_230118.indd').exists()
+    assert daemon.backend.script_count == 1
+
+    status = gen_client.send_request(daemon.path, argv + ['--plan'],
+                                     tmp_path, stdout, stderr)
+    assert status == 0
+    assert json.loads(stdout.getvalue())['up_to_date']
+
+
+def test_bad_arguments_are_reported(daemon, tmp_path):
+    stderr = io.StringIO()
+    status = gen_client.send_request(daemon.path, ['--no-such-option'],
+                                     tmp_path, io.StringIO(), stderr)
+    assert status == 1
+    assert 'Usage:' in stderr.getvalue()
+
+
+def test_daemon_restarts_exited_worker(master_file, tmp_path):
+    """A request after the worker has died should start a new one"""
+    backend = WorkerBackend([sys.executable, osa_worker.__file__,
+                             '--emulator'])
+    server = GenerationServer(tmp_path / 'gen.sock', backend)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    argv = ['--master=Master.indd', '--pages_dir=pages', '--desk=Features',
+            '--date=2018-01-23', '--set=9', '--force']
+    try:
+        for _ in range(2):
+            status = gen_client.send_request(server.path, argv, tmp_path,
+                                             io.StringIO(), io.StringIO())
+            assert status == 0
+            backend.worker.process.kill()
+            backend.worker.process.wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        backend.close()
+    assert (tmp_path / 'pages' / '9_Features_230118.indd').exists()
+
+
+def test_worker_command_rejected(daemon, tmp_path):
+    """A single --worker_command would be ignored, so it is an error"""
+    stderr = io.StringIO()
+    argv = ['--master=Master.indd', '--pages_dir=pages', '--desk=Features',
+            '--date=2018-01-23', '--set=9', '--worker_command=osa_worker.py']
+    status = gen_client.send_request(daemon.path, argv, tmp_path,
+                                     io.StringIO(), stderr)
+    assert status == 1
+    assert '--worker_command cannot be used' in stderr.getvalue()
+    assert daemon.backend.script_count == 0
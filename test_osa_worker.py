@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import io
+
+import osa_worker
+
+
+def test_serve_frames_results_and_errors():
+    """serve should answer each request, reporting failures as errors"""
+    def execute(script_str):
+        if script_str == 'fail':
+            raise RuntimeError('Invalid object')
+        return script_str.upper(), ''
+
+    requests = io.BytesIO()
+    for script in ['tell', 'fail', 'café']:
+        osa_worker.write_request(requests, script)
+    requests.seek(0)
+    responses = io.BytesIO()
+    osa_worker.serve(execute, requests, responses)
+    responses.seek(0)
+
+    assert osa_worker.read_response(responses) == (b'TELL', b'')
+    assert osa_worker.read_response(responses) == (
+        b'', b'execution error: Invalid object (-2700)')
+    assert osa_worker.read_response(responses) == (
+        'CAFÉ'.encode('utf-8'), b'')
+
+
+class StubDescriptor:
+    """Stand-in for NSAppleEventDescriptor with the methods used"""
+
+    def __init__(self, kind, value=None, items=(), keys=()):
+        self.kind = int.from_bytes(kind.encode('mac_roman'), 'big')
+        self.value = value
+        self.items = list(items)
+        self.keys = [int.from_bytes(key.encode('mac_roman'), 'big')
+                     for key in keys]
+
+    def descriptorType(self):
+        return self.kind
+
+    def stringValue(self):
+        return self.value
+
+    def booleanValue(self):
+        return bool(self.value)
+
+    def numberOfItems(self):
+        return len(self.items)
+
+    def descriptorAtIndex_(self, index):
+        return self.items[index - 1]
+
+    def keywordForDescriptorAtIndex_(self, index):
+        return self.keys[index - 1]
+
+
+def text(value):
+    return StubDescriptor('utxt', value)
+
+
+def test_format_descriptor_like_osascript():
+    """Results should read as osascript prints them"""
+    chosen = StubDescriptor('list', items=[text('Front'), text('Home')])
+    assert osa_worker.format_descriptor(chosen) == 'Front, Home'
+    dialog = StubDescriptor('reco', items=[text('OK'), text('2018-01-23')],
+                            keys=['bhit', 'ttxt'])
+    assert osa_worker.format_descriptor(dialog) == (
+        'button returned:OK, text returned:2018-01-23')
+    user_record = StubDescriptor('reco', keys=['usrf'], items=[
+        StubDescriptor('list', items=[text('page'), text('3')])])
+    assert osa_worker.format_descriptor(user_record) == 'page:3'
+    assert osa_worker.format_descriptor(StubDescriptor('fals')) == 'false'
+    assert osa_worker.format_descriptor(StubDescriptor('bool', 1)) == 'true'
+    assert osa_worker.format_descriptor(None) == ''
+    assert osa_worker.format_descriptor(text('café')) == 'café'
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import os
+
+from page_cache import file_fingerprint, PageSnapshotCache
+
+
+def add_snapshot(cache, master_name, spread=False):
+    cache.path_for(master_name, spread).write_text(master_name)
+    cache.add(master_name, spread)
+
+
+def test_least_recently_used_evicted(master_file, tmp_path):
+    cache = PageSnapshotCache(tmp_path / 'cache', master_file, max_entries=2)
+    add_snapshot(cache, 'News-Base-L')
+    add_snapshot(cache, 'News-Base-R')
+    add_snapshot(cache, 'News-Front')
+    # Snapshots used by this cache are kept until the next run
+    assert cache.get('News-Base-L', False) is not None
+
+    cache = PageSnapshotCache(tmp_path / 'cache', master_file, max_entries=2)
+    assert cache.get('News-Base-L', False) is not None
+    add_snapshot(cache, 'News-Front')
+    assert cache.get('News-Base-R', False) is None
+    assert not cache.path_for('News-Base-R', False).exists()
+    assert cache.get('News-Base-L', False) is not None
+    assert cache.get('News-Base-L', True) is None
+
+
+def test_changed_master_invalidates_snapshots(master_file, tmp_path):
+    cache = PageSnapshotCache(tmp_path / 'cache', master_file)
+    add_snapshot(cache, 'News-Base-S', spread=True)
+    old_snapshot = cache.get('News-Base-S', True)
+
+    reopened = PageSnapshotCache(tmp_path / 'cache', master_file)
+    assert reopened.get('News-Base-S', True) == old_snapshot
+
+    master_file.write_text('edited master')
+    os.utime(master_file, ns=(0, 0))
+    changed = PageSnapshotCache(tmp_path / 'cache', master_file)
+    assert changed.get('News-Base-S', True) is None
+    assert not old_snapshot.exists()
+
+
+def test_unchanged_file_not_hashed_again(master_file):
+    """A known fingerprint with the file's size and mtime should be reused"""
+    known = dict(file_fingerprint(master_file), sha256='from an earlier run')
+    assert file_fingerprint(master_file, [known]) is known
+
+    master_file.write_text('edited master')
+    fingerprint = file_fingerprint(master_file, [known])
+    assert fingerprint == file_fingerprint(master_file)
+    assert fingerprint['sha256'] != known['sha256']
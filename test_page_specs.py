@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import pytest
+
+import gen
+from page_specs import master_specs, MasterSpec, PageSpec
+
+
+def test_specs_are_immutable():
+    page = PageSpec(3, MasterSpec('News-Base-L', 'News', False))
+    with pytest.raises(AttributeError):
+        page.number = 4
+    with pytest.raises(AttributeError):
+        page.master.slug = 'Sport'
+    with pytest.raises(AttributeError):
+        page.colour = 'red'
+    assert page.arguments() == {'master_name': 'News-Base-L',
+                                'spread': False, 'slug': 'News',
+                                'page_number': 3}
+
+
+def test_pages_share_masters():
+    """Pages using a master should share one MasterSpec for it"""
+    pages = gen.construct_page_specifications(gen.load_generators_json(),
+                                              gen.load_masters_json())
+    masters = {}
+    for page_sets in pages.values():
+        for page_set in page_sets.values():
+            assert isinstance(page_set, tuple)
+            for page in page_set:
+                assert masters.setdefault(page.master_name,
+                                          page.master) is page.master
+    assert len(masters) <= len(gen.load_masters_json())
+
+
+def test_slugs_interned():
+    masters = master_specs({'A': {'slug': ''.join(['Sp', 'ort']),
+                                  'spread': True},
+                            'B': {'slug': ''.join(['Spo', 'rt']),
+                                  'spread': 0}})
+    assert masters['A'].slug is masters['B'].slug
+    assert masters['B'].spread is False
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import json
+
+from docopt import docopt
+import pytest
+
+from backends import FakeBackend
+import emulator
+import gen
+from run_metrics import histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    values = histogram([0.01, 0.2, 3])
+    assert values['count'] == 3
+    assert values['buckets']['0.05'] == 1
+    assert values['buckets']['0.25'] == 2
+    assert values['buckets']['5'] == 3
+
+
+def test_metrics_history_and_textfile(master_file, tmp_path):
+    """Each run should add to the JSON history and replace the textfile"""
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Features', '--date=2018-01-23', '--set=9', '--set=10']
+    for metrics_file in ['history.json', 'gen.prom', 'history.json']:
+        with gen.use_backend(emulator.InDesignEmulator()):
+            gen.generate(docopt(gen.__doc__, argv + [
+                f'--metrics={tmp_path / metrics_file}']))
+
+    first, second = json.loads((tmp_path / 'history.json').read_text())
+    assert (first['pages_generated'], first['pages_skipped']) == (2, 0)
+    assert (second['pages_generated'], second['pages_skipped']) == (0, 2)
+    # The pages are batched into one script, which times their steps
+    assert first['backend_calls'] == 1
+    assert first['step_seconds']['edition']['count'] == 1
+    assert first['step_seconds']['apply_master']['count'] == 2
+    assert first['step_seconds']['save_file']['sum'] > 0
+    assert first['bytes_written'] > 0
+
+    text = (tmp_path / 'gen.prom').read_text()
+    assert 'page_generator_pages{outcome="skipped"} 2' in text
+    assert 'page_generator_run_backend_calls 0' in text
+    assert 'page_generator_call_seconds_bucket{le="+Inf"} 0' in text
+
+
+def test_batched_run_reports_steps(master_file, tmp_path):
+    """A run in the default batched mode should report each page's steps"""
+    metrics_file = tmp_path / 'gen.prom'
+    with gen.use_backend(emulator.InDesignEmulator()):
+        gen.generate(docopt(gen.__doc__, [
+            f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Features', '--date=2018-01-23', '--set=9', '--set=10',
+            f'--metrics={metrics_file}']))
+    text = metrics_file.read_text()
+    assert 'page_generator_run_backend_calls 1' in text
+    assert 'page_generator_step_seconds_count{step="edition"} 1' in text
+    assert 'page_generator_step_seconds_count{step="apply_master"} 2' in text
+    assert 'page_generator_step_seconds_count{step="save_file"} 2' in text
+
+
+def test_metrics_written_when_run_stops(master_file, tmp_path):
+    """A fatal error should still write metrics, counting pages as failed"""
+    metrics_file = tmp_path / 'history.json'
+    fatal = FakeBackend([('page_results', '',
+                          'execution error: File not found. (-43)')])
+    with gen.use_backend(fatal), pytest.raises(gen.AppleScriptError):
+        gen.generate(docopt(gen.__doc__, [
+            f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Features', '--date=2018-01-23', '--set=9', '--set=10',
+            f'--metrics={metrics_file}']))
+    [metrics] = json.loads(metrics_file.read_text())
+    assert (metrics['pages_generated'], metrics['pages_failed']) == (0, 2)
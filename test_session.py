@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from backends import FakeBackend, ScriptCall
+import emulator
+import gen
+import session
+
+
+def record_page(job, backend):
+    session_file = job['pages_root'] / 'night.jsonl.gz'
+    recorder = session.SessionRecorder(session_file, argv=['--desk=News'])
+    with gen.use_backend(backend), session.use_recorder(recorder):
+        gen.create_from_master(**job, batched=False)
+    recorder.close()
+    return session.read_session(session_file)
+
+
+@pytest.fixture
+def front_page(make_job):
+    return make_job(master_name='News-Front', slug='Front', page_number=1)
+
+
+def test_recorded_session_replays_against_stub(front_page):
+    """Replaying a session against its own recording should match"""
+    header, calls = record_page(front_page, emulator.InDesignEmulator())
+    assert header['argv'] == ['--desk=News']
+    assert [call.step for call in calls][:2] == [
+        'set_indesign_alerts_status', 'open_master']
+    pairs = session.replay(calls, session.ReplayBackend(calls))
+    summary = session.compare_replay(pairs)
+    assert sum(step['mismatches'] for step in summary.values()) == 0
+    assert summary['fill_frames']['calls'] == 1
+
+
+def test_replay_reports_differing_output(front_page):
+    """A backend answering differently should be counted as a mismatch"""
+    _, calls = record_page(front_page, emulator.InDesignEmulator())
+    fake = FakeBackend([('save', 'saved', '')])
+    summary = session.compare_replay(session.replay(calls, fake))
+    assert summary['save_file']['mismatches'] == 1
+    assert summary['apply_master']['mismatches'] == 0
+
+
+def test_replay_backend_rejects_changed_script():
+    calls = [ScriptCall('open_master', 'open', 'x', '', 0.1)]
+    stdout, stderr = session.ReplayBackend(calls).run('close')
+    assert stderr.startswith('execution error: Script differs')
+
+
+def test_session_records_main_arguments(master_file, tmp_path):
+    """A session recorded by gen.main should hold the arguments it ran"""
+    session_file = tmp_path / 'night.jsonl.gz'
+    argv = [f'--master={master_file}', f'--pages_dir={tmp_path}',
+            '--desk=Features', '--date=2018-01-23', '--set=9',
+            f'--record={session_file}']
+    gen.main(argv, backend=emulator.InDesignEmulator())
+    header, calls = session.read_session(session_file)
+    assert header['argv'] == argv
+    assert [call.step for call in calls] == ['edition']
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+from datetime import date
+import json
+import multiprocessing
+
+import custom_edition
+import gen
+import specials
+
+
+def test_special_date():
+    assert specials.special_date('2018-07-14 Durham Miners') == date(2018, 7,
+                                                                    14)
+    assert specials.special_date('Durham Miners 2018-07-14') is None
+    assert specials.special_date('2018-13-01 Bad month') is None
+
+
+def test_archive_past_specials(tmp_path):
+    """Only specials dated before today should be archived, by year"""
+    pages = {'Specials': {'2017-12-30 Old': [{'master': 'A', 'page': 1}],
+                          '2018-07-13 Gala eve': [],
+                          '2018-07-14 Gala': [],
+                          'Undated': []}}
+    tmp_path.joinpath('2017.json').write_text(json.dumps({'2017-01-01 X': []}))
+    archived = specials.archive_past_specials(pages, date(2018, 7, 14),
+                                              tmp_path)
+    assert sorted(archived) == ['2017-12-30 Old', '2018-07-13 Gala eve']
+    assert list(pages['Specials']) == ['2018-07-14 Gala', 'Undated']
+    assert list(specials.load_archived_specials(tmp_path)) == [
+        '2017-01-01 X', '2017-12-30 Old', '2018-07-13 Gala eve']
+
+
+def test_custom_edition_appends_to_journal(tmp_path, monkeypatch, capsys):
+    """Specials should be journalled, then compacted into pages.json"""
+    pages_file = tmp_path.joinpath('pages.json')
+    pages_file.write_text(json.dumps({'Specials': {'2000-01-01 Old': []}}))
+    journal_file = tmp_path.joinpath('specials.jsonl')
+    monkeypatch.setattr(custom_edition, 'masters_file',
+                        gen.APP_DIR.joinpath('masters.json'))
+    monkeypatch.setattr(custom_edition, 'pages_file', pages_file)
+    monkeypatch.setattr(custom_edition, 'journal_file', journal_file)
+    monkeypatch.setattr(custom_edition, 'archive_dir',
+                        tmp_path.joinpath('archive'))
+    monkeypatch.setattr(specials, 'COMPACT_AFTER', 2)
+
+    custom_edition.main('2999-01-02 Next\n1 News-Front\n')
+    assert list(json.loads(pages_file.read_text())['Specials']) == [
+        '2000-01-01 Old']
+    assert specials.read_journal(journal_file) == {
+        '2999-01-02 Next': [{'master': 'News-Front', 'page': 1}]}
+
+    custom_edition.main('2999-01-03 After\n1 News-Front\n')
+    assert list(json.loads(pages_file.read_text())['Specials']) == [
+        '2999-01-02 Next', '2999-01-03 After']
+    assert journal_file.read_text() == ''
+    assert list(specials.load_archived_specials(tmp_path / 'archive')) == [
+        '2000-01-01 Old']
+    assert 'Archived past special "2000-01-01 Old"' in capsys.readouterr().out
+
+
+def _append_specials(journal_file, prefix, count):
+    for number in range(count):
+        specials.append_special(journal_file, f'{prefix} {number}', [])
+
+
+def test_concurrent_appends(tmp_path):
+    """Appends from several processes at once should all be kept"""
+    journal_file = tmp_path.joinpath('specials.jsonl')
+    processes = [multiprocessing.Process(target=_append_specials,
+                                         args=(journal_file, name, 25))
+                 for name in 'abcd']
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(specials.read_journal(journal_file)) == 100
+
+
+def test_incomplete_journal_line(tmp_path):
+    """A line cut short should not spoil the entries after it"""
+    journal_file = tmp_path.joinpath('specials.jsonl')
+    journal_file.write_text('{"title": "2018-01-01 A", "pages": []}\n'
+                            '{"title": "2018-01-02 B", "pa')
+    specials.append_special(journal_file, '2018-01-03 C', [])
+    assert list(specials.read_journal(journal_file)) == ['2018-01-01 A',
+                                                         '2018-01-03 C']
+
+
+def test_journal_merged_when_loading(tmp_path):
+    journal_file = tmp_path.joinpath('specials.jsonl')
+    specials.append_special(journal_file, '2999-01-01 New',
+                            [{'master': 'News-Front', 'page': 1}])
+    pages, _ = gen.load_page_specifications(journal_file=journal_file)
+    assert pages['Specials']['2999-01-01 New'][0].slug == 'Front'
+    assert '2999-01-01 New' in gen.load_generators_json(
+        journal_file=journal_file)['Specials']
+    specials.append_special(journal_file, '2999-01-02 Newer', [])
+    pages, _ = gen.load_page_specifications(journal_file=journal_file)
+    assert '2999-01-02 Newer' in pages['Specials']
+
+
+def test_archived_specials_loaded_on_demand(tmp_path):
+    tmp_path.joinpath('2000.json').write_text(json.dumps({
+        '2000-01-01 Old': [{'master': 'News-Front', 'page': 1}]}))
+    pages, _ = gen.load_page_specifications()
+    with_archive = gen.add_archived_specials(pages, archive_dir=tmp_path)
+    assert '2000-01-01 Old' not in pages['Specials']
+    assert with_archive['Specials']['2000-01-01 Old'][0].slug == 'Front'
+    assert set(pages['Specials']) < set(with_archive['Specials'])
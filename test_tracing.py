@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import json
+
+import emulator
+import gen
+import tracing
+from tracing import Tracer, use_tracer
+
+
+def test_page_calls_nested_in_page_span(make_job):
+    """AppleScript calls should be timed inside the span of their page"""
+    tracer = Tracer()
+    with use_tracer(tracer), gen.use_backend(emulator.InDesignEmulator()):
+        gen.create_from_master(**make_job(master_name='News-Front',
+                                          slug='Front', page_number=1))
+    call, page = tracer.events
+    assert (page['name'], page['args']['page']) == ('page', 1)
+    assert call['name'] == 'batch' and call['cat'] == 'applescript'
+    assert call['args']['page'] == 1
+    assert call['args']['script_bytes'] > 0
+    assert call['args']['stderr_bytes'] == 0
+    assert page['ts'] <= call['ts']
+    assert call['ts'] + call['dur'] <= page['ts'] + page['dur']
+
+
+def test_chrome_trace_written(tmp_path):
+    tracer = Tracer()
+    with use_tracer(tracer):
+        with tracing.span('run'):
+            with tracing.span('page', page=2):
+                pass
+    tracer.write(tmp_path / 'trace.json')
+    trace = json.loads((tmp_path / 'trace.json').read_text())
+    assert [event['name'] for event in trace['traceEvents']] == ['run',
+                                                                'page']
+    assert all(event['ph'] == 'X' for event in trace['traceEvents'])
+
+
+
+def test_batched_pages_and_steps_traced(make_job):
+    """Each page of an edition script should have spans for its steps"""
+    jobs = [make_job(page_number=number) for number in [3, 5]]
+    tracer = Tracer()
+    with use_tracer(tracer), gen.use_backend(emulator.InDesignEmulator()):
+        assert all(result.ok for result in gen.generate_edition(jobs))
+    script, = [event for event in tracer.events
+               if event['cat'] == 'applescript']
+    pages = [event for event in tracer.events if event['name'] == 'page']
+    assert [page['args']['page'] for page in pages] == [3, 5]
+    for page in pages:
+        steps = [event for event in tracer.events if event['cat'] == 'step'
+                 and event['args']['page'] == page['args']['page']]
+        assert 'apply_master' in [step['name'] for step in steps]
+        for step in steps:
+            assert page['ts'] <= step['ts']
+            assert step['ts'] + step['dur'] <= page['ts'] + page['dur']
+        assert script['ts'] <= page['ts']
+        assert page['ts'] + page['dur'] <= script['ts'] + script['dur']
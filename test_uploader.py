@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import time
+
+from docopt import docopt
+
+import emulator
+import gen
+from manifest import GenerationManifest
+from uploader import PageUploader
+
+
+def test_uploads_verified_and_scratch_cleared(tmp_path):
+    scratch, pages = tmp_path / 'scratch', tmp_path / 'pages'
+    scratch.mkdir()
+    uploaded = []
+    uploader = PageUploader(pages, workers=2,
+                            on_uploaded=lambda *args: uploaded.append(args))
+    for n in range(5):
+        path = scratch / f'{n}.indd'
+        path.write_bytes(bytes([n]) * 1000)
+        uploader.upload(path)
+    assert uploader.finish() == {}
+    assert sorted(path.name for path in pages.iterdir()) == [
+        f'{n}.indd' for n in range(5)]
+    assert (pages / '3.indd').read_bytes() == bytes([3]) * 1000
+    assert not list(scratch.iterdir())
+    assert all(error is None for _, _, error in uploaded)
+
+
+def test_failed_upload_reported(tmp_path):
+    pages = tmp_path / 'pages'
+    pages.write_text('not a directory')
+    uploader = PageUploader(pages)
+    source = tmp_path / '1.indd'
+    source.write_text('page')
+    uploader.upload(source)
+    errors = uploader.finish()
+    assert list(errors) == [source]
+    assert source.exists()
+
+
+def test_scratch_run_uploads_pages(master_file, tmp_path):
+    """Pages saved to scratch should end up in the pages directory"""
+    pages = tmp_path / 'pages'
+    argv = [f'--master={master_file}', f'--pages_dir={pages}',
+            f'--scratch_dir={tmp_path / "scratch"}', '--desk=Features',
+            '--date=2018-01-23', '--set=9', '--set=12-13 (split)']
+    with gen.use_backend(emulator.InDesignEmulator()):
+        gen.generate(docopt(gen.__doc__, argv))
+    names = ['12-13_Features_230118.indd', '9_Features_230118.indd']
+    assert sorted(path.name for path in pages.glob('*.indd')) == names
+    assert not list((tmp_path / 'scratch').glob('*.indd'))
+    manifest = GenerationManifest(pages)
+    assert sorted(manifest.entries) == names
+
+
+def test_uploads_overlap_generation(master_file, tmp_path):
+    """A page should be uploaded before the last page is generated"""
+    pages = tmp_path / 'pages'
+
+    class WaitingEmulator(emulator.InDesignEmulator):
+        """Wait at the last page for an earlier page to be uploaded"""
+        editions = 0
+        uploaded_first = False
+
+        def run(self, script_str, step=None):
+            if step == 'edition':
+                self.editions += 1
+                if self.editions == 3:
+                    deadline = time.monotonic() + 10
+                    while (time.monotonic() < deadline
+                           and not list(pages.glob('*.indd'))):
+                        time.sleep(0.01)
+                    self.uploaded_first = bool(list(pages.glob('*.indd')))
+            return super().run(script_str, step)
+
+    argv = [f'--master={master_file}', f'--pages_dir={pages}',
+            f'--scratch_dir={tmp_path / "scratch"}', '--desk=Sport',
+            '--date=2018-01-23', '--set=14', '--set=15', '--set=21']
+    indesign = WaitingEmulator()
+    with gen.use_backend(indesign):
+        gen.generate(docopt(gen.__doc__, argv))
+    assert indesign.editions == 3
+    assert indesign.uploaded_first
+    assert len(list(pages.glob('*.indd'))) == 3
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Timed spans for generation runs
+
+A Tracer records spans: named, timed sections of a run such as the
+whole run, one page, or one AppleScript call. Spans opened inside
+another span on the same thread are nested in it, and take its "page"
+argument if they have none of their own.
+
+The spans can be written as Chrome trace-event JSON, which can be
+opened with chrome://tracing or https://ui.perfetto.dev:
+    {"traceEvents": [{"name": "apply_master", "cat": "applescript",
+                      "ph": "X", "ts": 1200.0, "dur": 85000.0,
+                      "pid": 1234, "tid": 5678,
+                      "args": {"page": 3, "script_bytes": 180}}, ...]}
+
+Spans timed elsewhere, such as the steps of an edition script timed by
+the script itself, are added with add_span.
+
+Tracing is off until a tracer is put in use with use_tracer. Until
+then span() does nothing, so it can be left in place in the code.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+# Arguments that spans take from the span they are nested in
+INHERITED_ARGS = ('page',)
+
+_tracer = None
+
+
+class Tracer:
+    """Collect timed spans from every thread of a run"""
+
+    def __init__(self):
+        self.events = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, category='gen', **args):
+        """Time the block as a span, yielding its dict of arguments
+
+        Arguments can be added to the yielded dict before the block
+        ends, for example the size of a result.
+        """
+        stack = self._stack()
+        if stack:
+            for key in INHERITED_ARGS:
+                if key in stack[-1]['args']:
+                    args.setdefault(key, stack[-1]['args'][key])
+        event = {'name': name, 'cat': category, 'ph': 'X',
+                 'pid': os.getpid(), 'tid': threading.get_ident(),
+                 'args': args}
+        stack.append(event)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            event['ts'] = (start - self._start) * 1e6
+            event['dur'] = (end - start) * 1e6
+            with self._lock:
+                self.events.append(event)
+
+    def add_span(self, name, start, duration, category='gen', **args):
+        """Record a span timed outside the tracer
+
+        `start` is the time.perf_counter() value the span started at and
+        `duration` its length, both in seconds. This is used for spans
+        timed by a script, such as the steps of an edition script.
+        """
+        event = {'name': name, 'cat': category, 'ph': 'X',
+                 'ts': (start - self._start) * 1e6, 'dur': duration * 1e6,
+                 'pid': os.getpid(), 'tid': threading.get_ident(),
+                 'args': args}
+        with self._lock:
+            self.events.append(event)
+
+    def chrome_trace(self):
+        """Return the spans as a Chrome trace-event dict"""
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        """Write the spans to path as Chrome trace-event JSON"""
+        Path(path).write_text(json.dumps(self.chrome_trace()),
+                              encoding='utf-8')
+
+
+def get_tracer():
+    """Return the tracer in use, or None if tracing is off"""
+    return _tracer
+
+
+@contextmanager
+def use_tracer(tracer):
+    """Record spans from every thread with tracer inside the block"""
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+
+
+@contextmanager
+def span(name, category='gen', **args):
+    """Time the block with the tracer in use, if there is one
+
+    Yields the span's dict of arguments (a throwaway dict when tracing
+    is off). See Tracer.span.
+    """
+    if _tracer is None:
+        yield args
+        return
+    with _tracer.span(name, category, **args) as span_args:
+        yield span_args
+
+
+def add_span(name, start, duration, category='gen', **args):
+    """Record a span timed outside the tracer in use, if there is one
+
+    See Tracer.add_span.
+    """
+    if _tracer is not None:
+        _tracer.add_span(name, start, duration, category, **args)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Background upload of generated pages
+
+Pages can be saved to a fast local scratch directory and copied to the
+pages directory (usually on a file server) by a pool of threads while
+InDesign carries on with the next page.
+
+Each page is copied to a temporary file next to its destination, which
+is checked against the scratch file (size and SHA-256 hash) before
+being renamed into place, so a page in the pages directory is always
+complete. The scratch file is removed once its upload is verified.
+"""
+
+from pathlib import Path
+import queue
+import shutil
+import threading
+
+from files import file_digest
+
+
+def upload_file(source, destination):
+    """Copy source to destination atomically, verifying the copy
+
+    Raises OSError if the copy fails or does not match the source.
+    """
+    destination = Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = destination.with_name(f'.{destination.name}.upload')
+    try:
+        shutil.copyfile(source, temp_file)
+        if file_digest(temp_file) != file_digest(source):
+            raise OSError(f'Copy of {source} does not match the original')
+        temp_file.replace(destination)
+    finally:
+        temp_file.unlink(missing_ok=True)
+
+
+class PageUploader:
+    """Upload files to a directory with a pool of background threads
+
+    `on_uploaded` is called from the uploading thread with (source,
+    destination, error) as each upload finishes, where error is None
+    for a verified upload, or the message of the error that stopped it.
+    """
+
+    def __init__(self, destination, workers=4, on_uploaded=None):
+        self.destination = Path(destination)
+        self.on_uploaded = on_uploaded
+        self.errors = {}
+        self._queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._upload_worker,
+                                          daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _upload_worker(self):
+        while True:
+            source = self._queue.get()
+            if source is None:
+                break
+            destination = self.destination.joinpath(source.name)
+            try:
+                upload_file(source, destination)
+                source.unlink()
+                error = None
+            except OSError as exc:
+                error = str(exc)
+                self.errors[source] = error
+            if self.on_uploaded is not None:
+                self.on_uploaded(source, destination, error)
+
+    def upload(self, path):
+        """Queue the file at path to be uploaded"""
+        self._queue.put(Path(path))
+
+    def finish(self):
+        """Wait for every queued upload to finish and stop the threads
+
+        Returns a dict of the error for each file that failed to upload.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        return self.errors